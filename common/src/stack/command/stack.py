@@ -149,8 +149,13 @@ def run_command(args, debug=False):
 		print(help.getText())
 		return -1
 
+	# set the SIGPIPE to the system default (instead of python default)
+	# before trying to print; prevents a stacktrace when exiting a pipe'd stack command
+	signal.signal(signal.SIGPIPE, signal.SIG_DFL)
+
 	try:
 		command = getattr(module, 'Command')(Database, debug=debug)
+		command.stream = sys.stdout
 #		 t0 = time.time()
 		rc = command.runWrapper(name, args[i:])
 #		syslog.syslog(syslog.LOG_INFO, 'runtime %.3f' % (time.time() - t0))
@@ -171,10 +176,6 @@ def run_command(args, debug=False):
 
 	text = command.getText()
 
-	# set the SIGPIPE to the system default (instead of python default)
-	# before trying to print; prevents a stacktrace when exiting a pipe'd stack command
-	signal.signal(signal.SIGPIPE, signal.SIG_DFL)
-
 	if text and len(text) > 0:
 		print(text, end='')
 		if text[len(text) - 1] != '\n':
@@ -12,6 +12,7 @@
 
 import os
 import time
+import contextlib
 import socket
 import string
 import re
@@ -27,6 +28,7 @@ from xml.sax import saxutils
 from xml.sax import handler
 from xml.sax import make_parser
 from pymysql import OperationalError, ProgrammingError
+from pymysql.constants import SERVER_STATUS
 from functools import partial
 from operator import itemgetter
 from itertools import groupby
@@ -717,6 +719,38 @@ class HostArgumentProcessor:
 			
 		return list
 
+	def getRunHosts(self, hosts):
+		"""
+		Returns a list of {'host': host, 'name': name} dictionaries,
+		in the order of the hosts list, where name is the address to
+		use to reach the host. If the host has a 'stack.network'
+		attribute this is the name of its interface on that network,
+		otherwise it is the host name.
+
+		Everything is looked up with two queries, so this is linear in
+		the number of hosts.
+		"""
+
+		networks = {}
+		for row in self.call('list.host.attr', hosts + [ 'attr=stack.network' ]):
+			networks[row['host']] = row['value']
+
+		names = {}
+		if networks:
+			for (host, netname, subnet, zone) in self.db.select("""
+				n.name, net.name, s.name, s.zone from
+				nodes n, networks net, subnets s where
+				net.node = n.id and net.subnet = s.id
+				"""):
+
+				# If interface exists, but name is not set
+				# infer name from nodes table, and append
+				# dns zone
+				if networks.get(host) == subnet:
+					names[host] = '%s.%s' % (netname if netname else host, zone)
+
+		return [ { 'host': host, 'name': names.get(host, host) } for host in hosts ]
+
 	def getHosts(self, args):
 		"""
 		Return the host names for the hosts or patterns specified in args,
@@ -1335,6 +1369,49 @@ class DatabaseConnection:
 		
 		return None
 
+	def executemany(self, command, args):
+		"""
+		Runs the command once for each of the args, inserts are sent
+		to the database as a single multi-row statement.
+		"""
+
+		command = command.strip()
+		self.clearCache()
+
+		if self.link and args:
+			t0 = time.time()
+			result = self.link.executemany(command, args)
+			t1 = time.time()
+			Debug('SQL EX: %.3f %d x %s' % ((t1 - t0), len(args), command))
+			return result
+
+		return None
+
+	@contextlib.contextmanager
+	def transaction(self):
+		"""
+		Context manager that runs the statements of its block as one
+		transaction, committed at the end of the block and rolled back
+		if it raises. Inside a transaction of the caller (e.g.
+		discovery) the statements become part of that transaction
+		instead.
+		"""
+
+		if not self.database or \
+		   self.database.server_status & SERVER_STATUS.SERVER_STATUS_IN_TRANS:
+			yield
+			return
+
+		self.database.begin()
+		try:
+			yield
+		except BaseException:
+			self.database.rollback()
+			self.clearCache()
+			raise
+
+		self.database.commit()
+
 	def fetchone(self):
 		if self.link:
 			row = self.link.fetchone()
@@ -1722,6 +1799,12 @@ class Command:
 		self.text  = ''
 		self.bytes = b''
 
+		# File the caller would like large output written to as it
+		# is produced, rather than collected in the text buffer.
+		# Only commands that stream their output and the json
+		# format of endOutput look at it.
+		self.stream = None
+
 		self._exec = stack.util._exec
 		
 		self.output = []
@@ -2140,8 +2223,17 @@ class Command:
 				header = []
 				for i in range(0, rows):
 					header.append('col-%d' % i)
+
+			# When the caller gave us a stream the json is written
+			# to it a row at a time, the same text json.dumps()
+			# gives for the whole list.
+			stream = None
+			if format == 'json' and self.stream:
+				stream = self.stream
+				stream.write('[')
+
 			list = []
-			for line in self.output:
+			for n, line in enumerate(self.output):
 				dict = {}
 				for i in range(0, len(header)):
 					if header[i]:
@@ -2153,8 +2245,16 @@ class Command:
 							dict[key].append(val)
 						else:
 							dict[key] = val
-				list.append(dict)
-			if format == 'col':
+				if stream:
+					if n:
+						stream.write(', ')
+					stream.write(json.dumps(dict))
+				else:
+					list.append(dict)
+
+			if stream:
+				stream.write(']\n')
+			elif format == 'col':
 				for row in list:
 					try:
 						self.addText('%s\n' % row[format_args])
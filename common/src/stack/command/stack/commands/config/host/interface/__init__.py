@@ -147,4 +147,4 @@ class Command(stack.commands.config.host.command):
 		post_config = self.command('list.host.interface', [host])
 
 		if pre_config != post_config:
-			self.command('sync.config')
+			self.command('sync.config', [ host ])
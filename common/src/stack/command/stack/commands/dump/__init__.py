@@ -12,6 +12,7 @@
 
 import stack.commands
 import json
+import types
 
 class Command(stack.commands.Command):
 	"""
@@ -57,6 +58,36 @@ class Command(stack.commands.Command):
 	bootaction.
 	</arg>
 	"""
+	def iterencode(self, document):
+		"""
+		Yields the document as json a piece at a time, the same text
+		as json.dumps(document, indent=2). Sections can be generators
+		so large ones are never in memory all at once.
+		"""
+
+		encoder = json.JSONEncoder(indent=2)
+
+		if not document:
+			yield '{}'
+			return
+
+		separator = '{'
+		for key, value in document.items():
+			yield '%s\n  %s: ' % (separator, encoder.encode(key))
+			separator = ','
+
+			if isinstance(value, (list, types.GeneratorType)):
+				empty = True
+				for item in value:
+					yield '%s\n    ' % ('[' if empty else ',')
+					yield encoder.encode(item).replace('\n', '\n    ')
+					empty = False
+				yield '[]' if empty else '\n  ]'
+			else:
+				yield encoder.encode(value).replace('\n', '\n  ')
+
+		yield '\n}'
+
 	def run(self,params, args):
 		# runPlugins() returns a list of tuples where tuple[0] is the plugin name and
 		# tuple[1] is the return value
@@ -66,6 +97,15 @@ class Command(stack.commands.Command):
 		for plugin in data:
 			document_prep.update(plugin[1])
 
+		# write the document out as it is generated when we can,
+		# a large cluster makes for a very large document
+		if self.stream and not params.get('output-format'):
+			for chunk in self.iterencode(document_prep):
+				self.stream.write(chunk)
+			self.stream.write('\n')
+			self.stream.flush()
+			return
+
 		self.beginOutput()
-		self.addOutput(None,json.dumps(document_prep, indent=2))
+		self.addOutput(None, ''.join(self.iterencode(document_prep)))
 		self.endOutput(trimOwner=True)
@@ -24,129 +24,294 @@ class Plugin(stack.commands.Plugin):
 		if not host_data:
 			return document_prep
 
-		# since list host attr is relatively expensive, call it once for all hosts up here
+		# the hosts are generated one at a time as the document is
+		# written out, so they are never all in memory
+		document_prep['host'] = self.hosts(host_data)
+		return(document_prep)
+
+
+	def hosts(self, host_data):
+
+		# everything is listed once for all of the hosts up here then
+		# grouped by host, listing it host by host is far too slow
+		# on a large cluster
+		interfaces = {}
+		for line in self.owner.call('list.host.interface'):
+			interfaces.setdefault(line['host'], []).append(line)
+
 		grouped_hosts = {}
 		for line in self.owner.call('list.host.attr'):
-			if line['host'] in grouped_hosts:
-				grouped_hosts[line['host']].append(line)
-			else:
-				grouped_hosts[line['host']] = [line]
+			grouped_hosts.setdefault(line['host'], []).append(line)
+
+		groups = {}
+		for line in self.owner.call('list.host.group'):
+			groups[line['host']] = line['groups'].split()
+
+		aliases     = self.aliases()
+		firewalls   = self.firewalls()
+		routes      = self.routes()
+		partitions  = self.partitions()
+		controllers = self.controllers()
 
 		for host in host_data:
 			hostname = host['host']
-			interface_data = self.owner.call('list.host.interface', [ hostname ])
-			if not interface_data:
-				interface_data = []
+
 			interface_prep = []
-			for interface in interface_data:
-				# grab the alias data for this interface
-				interface_alias_data = self.owner.call('list.host.alias', [
-											hostname,
-											f'interface={interface["interface"]}'
-				])
-				if not interface_alias_data:
-					interface_alias_data = []
-
-				if interface['host'] == hostname:
-					interface_prep.append({
-							'interface':interface['interface'],
-							'default':interface['default'],
-							'mac':interface['mac'],
-							'ip':interface['ip'],
-							'network':interface['network'],
-							'name':interface['name'],
-							'module':interface['module'],
-							'vlan':interface['vlan'],
-							'options':interface['options'],
-							'channel':interface['channel'],
-							'alias':interface_alias_data
-					})
-			attr_data = grouped_hosts[hostname]
-			if not attr_data:
-				attr_data = []
+			for interface in interfaces.get(hostname, []):
+				interface_prep.append({
+						'interface':interface['interface'],
+						'default':interface['default'],
+						'mac':interface['mac'],
+						'ip':interface['ip'],
+						'network':interface['network'],
+						'name':interface['name'],
+						'module':interface['module'],
+						'vlan':interface['vlan'],
+						'options':interface['options'],
+						'channel':interface['channel'],
+						'alias':aliases.get((hostname, interface['interface']), [])
+				})
+
 			attr_prep = []
 			metadata = None
-			for attr in attr_data:
-				if attr['host'] == hostname:
-					if attr['scope'] == 'host':
-						# metadata is stored as an attr and we want to pull it to the side
-						# once we have it we dont want to keep it with the rest of the attrs
-						if attr['attr'] == 'metadata':
-							metadata = attr['value']
-							continue
-
-						if attr['type'] == 'shadow':
-							shadow = True
-						else:
-							shadow = False
-						attr_prep.append({
-							'name':attr['attr'],
-							'value':attr['value'],
-							'shadow':shadow
-							})
-
-			firewall_data = self.owner.call('list.host.firewall', [ hostname ])
-			if not firewall_data:
-				firewall_data = []
-			firewall_prep = []
-			for rule in firewall_data:
-				if rule['host'] == hostname and rule['source'] == 'H':
-					firewall_prep.append(rule)
-
-
-			route_data = self.owner.call('list.host.route', [ hostname ])
-			if not route_data:
-				route_data = []
-			route_prep = []
-			for route in route_data:
-				if route['host'] == hostname and route['source'] == 'H':
-					route_prep.append(route)
-
-
-			group_data = self.owner.call('list.host.group', [ hostname ])
-			if not group_data:
-				group_data = []
-			group_prep = []
-			for group in group_data:
-				if group['host'] == hostname:
-
-					groups = group['groups'].split()
-					for item in groups:
-						group_prep.append(item)
-
-
-			partition_data = self.owner.call('list.storage.partition', [ hostname ])
-			if not partition_data:
-				partition_data = []
-			partition_prep = []
-			if partition_data:
-				for partition in partition_data:
-					if partition['scope'] == hostname:
-						partition_prep.append(partition)
-
-
-			controller_data = self.owner.call('list.storage.controller', [ hostname ])
-			if not controller_data:
-				controller_data = []
-
-
-			document_prep['host'].append({
-						'name':hostname,
-						'rack':host['rack'],
-						'rank':host['rank'],
-						'interface':interface_prep,
-						'attrs':attr_prep,
-						'firewall':firewall_prep,
-						'box':host['box'],
-						'appliance':host['appliance'],
-						'comment':host['comment'],
-						'metadata':metadata,
-						'environment':host['environment'],
-						'osaction':host['osaction'],
-						'installaction':host['installaction'],
-						'route':route_prep,
-						'group':group_prep,
-						'partition':partition_prep,
-						'controller':controller_data
+			for attr in grouped_hosts.get(hostname, []):
+				if attr['scope'] == 'host':
+					# metadata is stored as an attr and we want to pull it to the side
+					# once we have it we dont want to keep it with the rest of the attrs
+					if attr['attr'] == 'metadata':
+						metadata = attr['value']
+						continue
+
+					if attr['type'] == 'shadow':
+						shadow = True
+					else:
+						shadow = False
+					attr_prep.append({
+						'name':attr['attr'],
+						'value':attr['value'],
+						'shadow':shadow
 						})
-		return(document_prep)
+
+			yield {
+				'name':hostname,
+				'rack':host['rack'],
+				'rank':host['rank'],
+				'interface':interface_prep,
+				'attrs':attr_prep,
+				'firewall':firewalls.get(hostname, []),
+				'box':host['box'],
+				'appliance':host['appliance'],
+				'comment':host['comment'],
+				'metadata':metadata,
+				'environment':host['environment'],
+				'osaction':host['osaction'],
+				'installaction':host['installaction'],
+				'route':routes.get(hostname, []),
+				'group':groups.get(hostname, []),
+				'partition':partitions.get(hostname, []),
+				'controller':controllers.get(hostname, [])
+				}
+
+
+	def aliases(self):
+		"""
+		Returns the rows of 'list host alias' keyed by host and
+		interface.
+		"""
+
+		aliases = {}
+		for (host, alias, device) in self.db.select("""
+			n.name, a.name, net.device
+			from aliases a, networks net, nodes n
+			where a.network = net.id and net.node = n.id
+			order by a.id"""):
+			aliases.setdefault((host, device), []).append({
+				'host':host,
+				'alias':alias,
+				'interface':device
+				})
+
+		return aliases
+
+
+	def firewalls(self):
+		"""
+		Returns the host rules of 'list host firewall' for each host,
+		in the same order.
+		"""
+
+		subnets = dict(self.db.select('id, name from subnets'))
+
+		def network(subnet):
+			if subnet == 0:
+				return 'all'
+			return subnets.get(subnet, '')
+
+		# host rules replace the global, os, and appliance rules of
+		# the same name, and take their place in the list
+		global_names = [ name for name, in self.db.select('name from global_firewall') ]
+
+		os_names = {}
+		for (os, name) in self.db.select('os, name from os_firewall'):
+			os_names.setdefault(os, []).append(name)
+
+		appliance_names = {}
+		for (appliance, name) in self.db.select('appliance, name from appliance_firewall'):
+			appliance_names.setdefault(appliance, []).append(name)
+
+		resolved = {}
+		for (host, os, appliance, name, table, insubnet, outsubnet, service,
+		     protocol, chain, action, flags, comment) in self.db.select("""
+			n.name, o.name, n.appliance, f.name, f.tabletype,
+			f.insubnet, f.outsubnet, f.service, f.protocol, f.chain,
+			f.action, f.flags, f.comment
+			from node_firewall f, nodes n, boxes b, oses o
+			where f.node = n.id and n.box = b.id and b.os = o.id
+			order by n.id, f.name"""):
+
+			if host not in resolved:
+				resolved[host] = dict.fromkeys(global_names +
+							       os_names.get(os, []) +
+							       appliance_names.get(appliance, []))
+			resolved[host][name] = {
+				'host':host,
+				'name':name,
+				'table':table,
+				'service':service,
+				'protocol':protocol,
+				'chain':chain,
+				'action':action,
+				'network':network(insubnet),
+				'output-network':network(outsubnet),
+				'flags':flags,
+				'comment':comment,
+				'source':'H',
+				'type':'var'
+				}
+
+		# accept rules first and reject rules last
+		firewalls = {}
+		for host, rules in resolved.items():
+			rules = [ rule for rule in rules.values() if rule ]
+			firewalls[host] = [ rule for rule in rules if rule['action'] == 'ACCEPT' ]
+			firewalls[host].extend([ rule for rule in rules if rule['action'] not in ('ACCEPT', 'REJECT') ])
+			firewalls[host].extend([ rule for rule in rules if rule['action'] == 'REJECT' ])
+
+		return firewalls
+
+
+	def routes(self):
+		"""
+		Returns the host routes of 'list host route' for each host.
+		"""
+
+		subnets = dict(self.db.select('id, name from subnets'))
+
+		# routes on a network go out the interface of the host on it
+		devices = {}
+		for (host, subnet, device) in self.db.select("""
+			n.name, net.subnet, net.device from networks net, nodes n
+			where net.node = n.id and net.subnet is not null
+			and net.device not like 'vlan%'"""):
+			devices[(host, subnet)] = device
+
+		resolved = {}
+		for (host, network, netmask, gateway, subnet, interface) in self.db.select("""
+			n.name, r.network, r.netmask, r.gateway, r.subnet, r.interface
+			from node_routes r, nodes n where r.node = n.id"""):
+			if subnet:
+				interface = devices.get((host, subnet), interface)
+			resolved.setdefault(host, {})[network] = (netmask, gateway, interface, subnet)
+
+		routes = {}
+		for host, networks in resolved.items():
+			routes[host] = []
+			for network in sorted(networks):
+				(netmask, gateway, interface, subnet) = networks[network]
+				routes[host].append({
+					'host':host,
+					'network':network,
+					'netmask':netmask,
+					'gateway':gateway,
+					'subnet':subnets[subnet] if subnet else None,
+					'interface':interface,
+					'source':'H'
+					})
+
+		return routes
+
+
+	def partitions(self):
+		"""
+		Returns the rows of 'list storage partition' for each host.
+		"""
+
+		partitions = {}
+		for (host, device, mountpoint, size, fstype, options, partid) in self.db.select("""
+			n.name, p.device, p.mountpoint, p.size, p.fstype, p.options, p.partid
+			from storage_partition p, nodes n
+			where p.scope = 'host' and p.tableid = n.id
+			order by p.device, p.partid, p.fstype, p.size"""):
+
+			if size == -1:
+				size = 'recommended'
+			elif size == -2:
+				size = 'hibernation'
+			if mountpoint == 'None':
+				mountpoint = None
+			if fstype == 'None':
+				fstype = None
+			if partid == 0:
+				partid = None
+
+			partitions.setdefault(host, []).append({
+				'scope':host,
+				'device':device,
+				'partid':partid,
+				'mountpoint':mountpoint,
+				'size':size,
+				'fstype':fstype,
+				'options':options
+				})
+
+		return partitions
+
+
+	def controllers(self):
+		"""
+		Returns the rows of 'list storage controller' for each host.
+		"""
+
+		controllers = {}
+		for (host, adapter, enclosure, slot, raidlevel, arrayid, options) in self.db.select("""
+			n.name, c.adapter, c.enclosure, c.slot, c.raidlevel, c.arrayid, c.options
+			from storage_controller c, nodes n
+			where c.scope = 'host' and c.tableid = n.id
+			order by c.enclosure, c.adapter, c.slot"""):
+
+			if adapter == -1:
+				adapter = None
+			if enclosure == -1:
+				enclosure = None
+			if slot == -1:
+				slot = '*'
+			if raidlevel == '-1':
+				raidlevel = 'hotspare'
+			if arrayid == -1:
+				arrayid = 'global'
+			elif arrayid == -2:
+				arrayid = '*'
+
+			# the list command only names the scope on its first row
+			rows = controllers.setdefault(host, [])
+			rows.append({
+				'scope':host if not rows else 'None',
+				'enclosure':enclosure,
+				'adapter':adapter,
+				'slot':slot,
+				'raidlevel':raidlevel,
+				'arrayid':arrayid,
+				'options':options.strip('"')
+				})
+
+		return controllers
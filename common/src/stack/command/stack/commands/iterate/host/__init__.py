@@ -11,7 +11,12 @@
 # @rocks@
 
 import os
+import signal
+import subprocess
+import sys
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import stack.commands
+from stack.exception import ParamType, ParamValue
 
 
 class command(stack.commands.HostArgumentProcessor,
@@ -21,7 +26,7 @@ class command(stack.commands.HostArgumentProcessor,
 	
 class Command(command):
 	"""
-	Iterate sequentially over a list of hosts.  This is used to run 
+	Iterate over a list of hosts.  This is used to run 
 	a shell command on the frontend with with '%' wildcard expansion for
 	every host specified.
 				
@@ -35,15 +40,141 @@ class Command(command):
 	a wildcard to indicate the hostname.  Quoting of the '%' to expand to a 
 	literal is accomplished with '%%'.
 	</param>
+
+	<param type='string' name='threads'>
+	The number of hosts to run the command for at once. With more than
+	one the output of each command is captured and printed when it is
+	done, so the output of different hosts is never mixed.
+	Default is 1 (one host after the other).
+	Set "iterate.host.threads" to set the default.
+	</param>
+
+	<param type='string' name='timeout'>
+	Sets the maximum length of time (in seconds) that the command is
+	allowed to run for each host. Default is '0' (no timeout).
+	</param>
+
+	<param type='boolean' name='collate'>
+	If 'yes', capture the output and prepend the hostname to every line.
+	Default is 'no'.
+	</param>
+
+	<param type='boolean' name='ordered'>
+	If 'yes', the output is listed in host order rather than in the order
+	the commands finish. Default is 'yes'.
+	</param>
 	
 	<example cmd='iterate host backend command="scp file %:/tmp/"'>
 	Copies file to the /tmp directory of every backend node
 	</example>
+
+	<example cmd='iterate host backend command="ipmitool -H %-ipmi power status" threads=32'>
+	Check the power status of every backend node, 32 at a time.
+	</example>
 	"""
 
+	def expand(self, cmd, host):
+		"""
+		Turn the wildcard '%' into the hostname, and '%%' into
+		a single '%'.
+		"""
+
+		s = ''
+		prev = ''
+		for i in range(0, len(cmd)):
+			curr = cmd[i]
+			try:
+				next = cmd[i + 1]
+			except IndexError:
+				next = ''
+			if curr == '%':
+				if prev != '%' and next != '%':
+					s   += host
+					prev = host
+					continue # consume '%'
+				elif prev == '%':
+					s   += '%'
+					prev = '*'
+					continue # consume '%'
+			else:
+				s += curr
+			prev = curr
+
+		return s
+
+	def execute(self, host, cmd):
+		"""
+		Runs the command for a host, returning (host, output). The
+		output is None when it is not captured. On a timeout the whole
+		process group of the command is killed.
+		"""
+
+		if self.capture:
+			stdout = subprocess.PIPE
+		else:
+			stdout = None
+
+		# A command that may have to be killed, or whose output is
+		# captured, gets a session of its own. Otherwise it stays on
+		# the terminal, so password prompts and Ctrl-C reach it.
+		proc = subprocess.Popen(cmd, shell=True, stdout=stdout,
+					stderr=subprocess.STDOUT if self.capture else None,
+					start_new_session=self.capture or self.timeout > 0)
+		try:
+			o, e = proc.communicate(timeout=self.timeout or None)
+		except subprocess.TimeoutExpired:
+			os.killpg(proc.pid, signal.SIGKILL)
+			o, e = proc.communicate()
+			if self.capture:
+				o += b'timeout after %d seconds\n' % self.timeout
+
+		if o is not None:
+			o = o.decode(errors='replace')
+
+		return (host, o)
+
+	def report(self, host, output):
+		if output is None:
+			return
+
+		if self.collate:
+			for line in output.splitlines():
+				self.addOutput(host, line)
+		else:
+			sys.stdout.write(output)
+			sys.stdout.flush()
+
 	def run(self, params, args):
 
-		(cmd, ) = self.fillParams([ ('command', None, True) ])
+		(cmd, threads, timeout, collate, ordered) = self.fillParams([
+			('command', None, True),
+			('threads', self.getAttr('iterate.host.threads')),
+			('timeout', '0'),
+			('collate', 'n'),
+			('ordered', 'y')
+			])
+
+		try:
+			threads = int(threads or 1)
+		except ValueError:
+			raise ParamType(self, 'threads', 'integer')
+		if threads < 1:
+			raise ParamValue(self, 'threads', '> 0')
+
+		try:
+			self.timeout = int(timeout)
+		except ValueError:
+			raise ParamType(self, 'timeout', 'integer')
+		if self.timeout < 0:
+			raise ParamValue(self, 'timeout', '>= 0')
+
+		self.collate = self.str2bool(collate)
+		ordered = self.str2bool(ordered)
+
+		# One host at a time the command keeps the terminal, same as
+		# it always did. Otherwise capture the output so hosts don't
+		# write over each other.
+		self.capture = self.collate or threads > 1
 
 		self.beginOutput()
 
@@ -62,34 +193,24 @@ class Command(command):
 				hosts.append(host)
 		else:
 			hosts = self.getHostnames(args)
-			
-		for host in hosts:
-			# Turn the wildcard '%' into the hostname, and '%%' into
-			# a single '%'.
-
-			s = ''
-			prev = ''
-			for i in range(0, len(cmd)):
-				curr = cmd[i]
-				try:
-					next = cmd[i + 1]
-				except:
-					next = ''
-				if curr == '%':
-					if prev != '%' and next != '%':
-						s   += host
-						prev = host
-						continue # consume '%'
-					elif prev == '%':
-						s   += '%'
-						prev = '*'
-						continue # consume '%'
-				else:
-					s += curr
-				prev = curr
-
-			os.system(s)
-#			for line in os.popen(s).readlines():
-#				self.addOutput(host, line[:-1])
+
+		with ThreadPoolExecutor(max_workers=threads) as pool:
+			futures = [ pool.submit(self.execute, host, self.expand(cmd, host))
+				    for host in hosts ]
+
+			# Report each host as soon as it is done, or in host order
+			# as soon as all the ones before it are done.
+			done = {}
+			index = 0
+			for future in as_completed(futures):
+				host, output = future.result()
+				if not ordered:
+					self.report(host, output)
+					continue
+
+				done[host] = output
+				while index < len(hosts) and hosts[index] in done:
+					self.report(hosts[index], done.pop(hosts[index]))
+					index += 1
 
 		self.endOutput(padChar='')
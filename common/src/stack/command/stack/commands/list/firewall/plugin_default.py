@@ -155,7 +155,9 @@ class Plugin(stack.commands.Plugin):
 			rules = self.db.select("""name, tabletype, insubnet,
 				outsubnet, service, protocol, chain, action,
 				flags, comment from os_firewall where os =
-				(select os from nodes where name = %s)""", host)
+				(select o.name from nodes n, boxes b, oses o
+				where n.name = %s and n.box = b.id and b.os = o.id)
+				""", host)
 
 			for n, tt, i, o, s, p, c, a, f, cmt in rules:
 				self.formatRule(n, tt, i, o, s, p, c, a, f,
@@ -264,7 +266,8 @@ class Plugin(stack.commands.Plugin):
 			rules = self.db.select("""name, tabletype, insubnet,
 				outsubnet, service, protocol, chain, action,
 				flags, comment from node_firewall where node =
-				(select id from nodes where name = %s)""", host)
+				(select id from nodes where name = %s)
+				order by name""", host)
 
 			for n, tt, i, o, s, p, c, a, f, cmt in rules:
 				self.formatRule(n, tt, i, o, s, p, c, a, f,
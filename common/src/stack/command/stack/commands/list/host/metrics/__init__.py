@@ -0,0 +1,104 @@
+# @copyright@
+# Copyright (c) 2006 - 2018 Teradata
+# All rights reserved. Stacki(r) v5.x stacki.com
+# https://github.com/Teradata/stacki/blob/master/LICENSE.txt
+# @copyright@
+
+import time
+from stack.exception import CommandError, ParamType, ParamValue
+import stack.mq.rollup
+import stack.commands
+
+
+class Command(stack.commands.list.host.command):
+	"""
+	List the metric rollups collected by the smq-processor for one
+	or more hosts.  Each row is one bucket of the requested resolution
+	with the number of samples and the average, minimum, and maximum
+	values.
+
+	<arg optional='1' type='string' name='host' repeat='1'>
+	Zero, one or more host names. If no host names are supplied, info about
+	all the known hosts is listed.
+	</arg>
+
+	<param type='string' name='metric'>
+	Name of the metric (e.g. load, cpu, mem). If not provided all
+	the metrics of the host are listed.
+	</param>
+
+	<param type='int' name='window'>
+	Number of seconds of history to list. Default is 300.
+	</param>
+
+	<param type='int' name='resolution'>
+	Bucket size in seconds, one of 10, 60, or 3600. Default is the
+	finest resolution that covers the window.
+	</param>
+
+	<example cmd='list host metrics backend-0-0 metric=load window=86400'>
+	List the one minute load average rollups for backend-0-0 over the
+	last day.
+	</example>
+	"""
+
+	def run(self, params, args):
+
+		(metric, window, resolution) = self.fillParams([
+			('metric',     None),
+			('window',     '300'),
+			('resolution', None)
+			])
+
+		try:
+			window = int(window)
+		except ValueError:
+			raise ParamType(self, 'window', 'integer')
+
+		resolutions = [ r for (r, size) in stack.mq.rollup.RESOLUTIONS ]
+		if resolution is None:
+			resolution = stack.mq.rollup.resolution(window)
+		else:
+			try:
+				resolution = int(resolution)
+			except ValueError:
+				raise ParamType(self, 'resolution', 'integer')
+			if resolution not in resolutions:
+				raise ParamValue(self, 'resolution', 'one of %s' %
+						 ', '.join(str(r) for r in resolutions))
+
+		import redis # not part of the installer but command line is
+		r = redis.StrictRedis(host='localhost')
+
+		ids = {}
+		for name, id in self.db.select('name, id from nodes'):
+			ids[name] = id
+
+		end   = int(time.time())
+		start = end - window
+
+		self.beginOutput()
+
+		for host in self.getHostnames(args):
+			try:
+				if metric:
+					metrics = [ metric ]
+				else:
+					metrics = sorted(m.decode() for m in
+						r.smembers(stack.mq.rollup.metricsKey(ids[host])))
+
+				rollups = stack.mq.rollup.fetch(r, ids[host], metrics,
+								resolution, start, end)
+			except redis.exceptions.RedisError as e:
+				raise CommandError(self, 'cannot read metrics from redis: %s' % e)
+
+			for name in metrics:
+				for (t, count, total, lo, hi) in rollups[name]:
+					self.addOutput(host, (name,
+						time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(t)),
+						count,
+						round(total / count, 2),
+						lo, hi))
+
+		self.endOutput(header=[ 'host', 'metric', 'time', 'samples',
+					'avg', 'min', 'max' ], trimOwner=False)
@@ -5,8 +5,113 @@
 # @rocks@
 #
 
+import ipaddress
+import re
 import stack.commands
+from stack.exception import CommandError
 
 
 class command(stack.commands.Command):
 	pass
+
+
+class HostChecks:
+	"""
+	The checks and defaults of 'add host', for the loaders that write
+	the hosts to the database themselves. Errors are raised for the
+	command doing the loading.
+	"""
+
+	def __init__(self, owner):
+		db = owner.db
+		self.owner	= owner
+		self.appliances = dict(db.select('name, id from appliances'))
+		self.boxes	= {}
+		self.boxos	= {}
+		for (id, name, os) in db.select('id, name, os from boxes'):
+			self.boxes[name] = id
+			self.boxos[id]	 = os
+		self.oses	= dict(db.select('id, name from oses'))
+
+		# a boot action without an os works for every box
+		self.bootactions = {}
+		for (id, name, type, os) in db.select("""
+			bn.id, bn.name, bn.type, ba.os from
+			bootactions ba inner join bootnames bn on ba.bootname = bn.id
+			"""):
+			(_, oses) = self.bootactions.setdefault((name, type), (id, set()))
+			oses.add(os)
+
+	def name(self, host):
+		return host.lower()
+
+	def placement(self, host, appliance, rack, rank):
+		"""
+		Returns the appliance id, rack and rank of a new host. Those not
+		given are taken from a basename-rack-rank host name, the
+		appliance only if the basename is one.
+		"""
+
+		try:
+			(basename, name_rack, name_rank) = host.split('-')
+		except ValueError:
+			basename = name_rack = name_rank = None
+		if basename not in self.appliances:
+			basename = None
+
+		appliance = appliance or basename
+		if rack in (None, ''):
+			rack = name_rack
+		if rank in (None, ''):
+			rank = name_rank
+
+		if not appliance:
+			raise CommandError(self.owner, 'host "%s" needs an appliance' % host)
+		if rack in (None, '') or rank in (None, ''):
+			raise CommandError(self.owner, 'host "%s" needs a rack and rank' % host)
+
+		return (self.appliance(appliance), rack, rank)
+
+	def appliance(self, name):
+		if name not in self.appliances:
+			raise CommandError(self.owner, 'appliance "%s" is not in the database' % name)
+		return self.appliances[name]
+
+	def box(self, name):
+		if name not in self.boxes:
+			raise CommandError(self.owner, 'box "%s" is not in the database' % name)
+		return self.boxes[name]
+
+	def bootaction(self, name, type, box):
+		"""
+		Returns the id of the boot action, which must exist for the
+		os of the box (by id).
+		"""
+
+		os = self.boxos.get(box)
+		(id, oses) = self.bootactions.get((name, type), (None, set()))
+		if os not in oses and None not in oses:
+			raise CommandError(self.owner, '"%s" %s boot action for "%s" is missing' %
+					   (name, type, self.oses.get(os)))
+		return id
+
+	def ip(self, ip):
+		"""
+		Returns the address, None for no address or "auto".
+		"""
+
+		if not ip or ip.upper() == 'NULL':
+			return None
+		if ip.upper() == 'AUTO':
+			return 'auto'
+		try:
+			return str(ipaddress.ip_address(ip))
+		except ValueError:
+			raise CommandError(self.owner, 'ip "%s" is not a valid address' % ip)
+
+	def mac(self, mac):
+		if not mac or mac.upper() == 'NULL':
+			return None
+		if not re.match(r'^[0-9a-fA-F]{2}(:[0-9a-fA-F]{2})+$', mac):
+			raise CommandError(self.owner, 'mac "%s" is not a valid address' % mac)
+		return mac
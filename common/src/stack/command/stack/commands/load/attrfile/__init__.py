@@ -30,6 +30,11 @@ class Command(stack.commands.load.command,
 	The processor used to parse the file and to load the data into the
 	database. Default: default.
 	</param>
+
+	<param type='boolean' name='bulk' optional='1'>
+	Load all of the attributes with a few statements in one
+	transaction rather than one command at a time. Default: true
+	</param>
 	
 	<example cmd='load attrfile file=attrs.csv'>
 	Load all the attributes in file named attrs.csv and use the default
@@ -76,10 +81,12 @@ class Command(stack.commands.load.command,
 			
 
 	def run(self, params, args):
-		filename, processor = self.fillParams([
+		filename, processor, bulk = self.fillParams([
 			('file', None, True),
-			('processor', 'default')
+			('processor', 'default'),
+			('bulk', True)
 			])
+		self.bulk = self.str2bool(bulk)
 
 		if not os.path.exists(filename):
 			raise CommandError(self, 'file "%s" does not exist' % filename)
@@ -89,16 +96,17 @@ class Command(stack.commands.load.command,
 		#
 		self.attrs = {}
 		self.runImplementation('load_%s' % processor, (filename, ))
-		self.runPlugins(self.attrs)
+		with self.db.transaction():
+			self.runPlugins(self.attrs)
 		self.command('sync.config')
 
 		# Only sync the host config for the hosts in the
 		# imported spreadsheet.
 
 		hosts = self.getHostnames()
-		for host in self.attrs.keys():
-			if host in hosts:
-				self.call('sync.host.config', [ host ])
+		hosts = [ host for host in self.attrs.keys() if host in hosts ]
+		if hosts:
+			self.call('sync.host.config', hosts)
 	
 
 		#
@@ -6,7 +6,9 @@
 #
 # @rocks@
 
+import re
 import stack.commands
+from stack.exception import CommandError
 
 
 class Plugin(stack.commands.ApplianceArgumentProcessor, 
@@ -16,7 +18,85 @@ class Plugin(stack.commands.ApplianceArgumentProcessor,
 	def provides(self):
 		return 'default'
 
+	def load(self, attrs):
+		"""
+		Replaces the attributes in the spreadsheet with a handful of
+		statements.
+		"""
+
+		db = self.db
+
+		appliances   = dict(db.select('name, id from appliances'))
+		environments = dict(db.select('name, id from environments'))
+		nodes	     = dict(db.select('name, id from nodes'))
+
+		#
+		# check everything before the first change
+		#
+		scopes	= []
+		inserts = []
+		boxes	= []
+		for target in attrs.keys():
+			if target == 'default':
+				continue
+			elif target == 'global':
+				if 'environment' not in attrs[target]:
+					scope = ('global', None)
+				else:
+					environment = attrs[target]['environment']
+					if environment not in environments:
+						raise CommandError(self.owner, 'environment "%s" does not exist' % environment)
+					scope = ('environment', environments[environment])
+			elif target in appliances:
+				scope = ('appliance', appliances[target])
+			else:
+				host = self.db.getHostname(target)
+				if host not in nodes:
+					raise CommandError(self.owner, 'cannot resolve host "%s"' % target)
+				scope = ('host', nodes[host])
+
+				if attrs[target].get('environment'):
+					boxes.append((host, attrs[target]['environment']))
+
+			scopes.append(scope + (list(attrs[target].keys()), ))
+
+			for attr, value in attrs[target].items():
+				#
+				# only add attributes that have a value
+				#
+				if not value:
+					continue
+				if not re.match('^[a-zA-Z_][a-zA-Z0-9_.]*$', attr):
+					raise CommandError(self.owner, 'invalid attr name "%s"' % attr)
+				inserts.append(scope + (attr, value))
+
+		# Clear out all the attributes represented in the
+		# spreadsheet, then add only the cells with set values.
+
+		for (scope, scopeid, names) in scopes:
+			if names:
+				db.execute("""
+					delete from attributes where
+					scope = %s and scopeid <=> %s and attr in %s
+					""", (scope, scopeid, names))
+
+		db.executemany("""
+			insert into attributes (scope, scopeid, attr, value)
+			values (%s, %s, %s, %s)
+			""", inserts)
+
+		# If the environment is set move all the hosts
+		# to an environment specific box.
+
+		for (host, box) in boxes:
+			self.owner.call('set.host.box', [ host, 'box=%s' % box ])
+
+
 	def run(self, attrs):
+		if self.owner.bulk:
+			self.load(attrs)
+			return
+
 		appliances = self.getApplianceNames()
 		hosts      = self.getHostnames()
 
@@ -30,6 +30,11 @@ class Command(stack.commands.load.command):
 	The processor used to parse the file and to load the data into the
 	database. Default: default.
 	</param>
+
+	<param type='boolean' name='bulk' optional='1'>
+	Load all of the hosts with a few statements in one transaction
+	rather than one command at a time. Default: true
+	</param>
 	
 	<example cmd='load hostfile file=hosts.csv'>
 	Load all the host info in file named hosts.csv and use the default
@@ -41,10 +46,12 @@ class Command(stack.commands.load.command):
 
 
 	def run(self, params, args):
-		filename, processor = self.fillParams([
+		filename, processor, bulk = self.fillParams([
 			('file', None),
-			('processor', 'default')
+			('processor', 'default'),
+			('bulk', True)
 			])
+		self.bulk = self.str2bool(bulk)
 
 		if not filename:
 			raise ParamRequired(self, 'file')
@@ -58,24 +65,27 @@ class Command(stack.commands.load.command):
 		sys.stderr.write('Loading Spreadsheet\n')
 		self.runImplementation('load_%s' % processor, (filename, ))
 
+		# Nothing is changed unless all of the hosts load
+
 		sys.stderr.write('Configuring Database\n')
-		args = self.hosts, self.interfaces
-		self.runPlugins(args)
+		with self.db.transaction():
+			args = self.hosts, self.interfaces
+			self.runPlugins(args)
 
-		# Set each host's default boot action to os, before we
-		# build out the DHCP file with sync.config
+			# Set each host's default boot action to os, before we
+			# build out the DHCP file with sync.config
 
-		sys.stderr.write('Setting Bootaction to OS\n')
+			sys.stderr.write('Setting Bootaction to OS\n')
 
-		argv = []
-		for a in self.hosts.keys():
-			argv.append(a)
-		argv.append('action=os')
-		argv.append('sync=false')
+			argv = []
+			for a in self.hosts.keys():
+				argv.append(a)
+			argv.append('action=os')
+			argv.append('sync=false')
 
-		self.call('set.host.boot', argv)
+			self.call('set.host.boot', argv)
 		
-		self.call('sync.config')
+		self.call('sync.config', list(self.hosts.keys()))
 
 		argv = []
 		for a in self.hosts.keys():
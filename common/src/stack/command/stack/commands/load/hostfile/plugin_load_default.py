@@ -8,6 +8,7 @@
 
 import sys
 import stack.commands
+from stack.commands.load import HostChecks
 from stack.exception import CommandError
 from stack.bool import str2bool
 
@@ -25,8 +26,163 @@ class Plugin(stack.commands.HostArgumentProcessor, stack.commands.Plugin):
 				self.owner.call('remove.host.interface',
 					[ host, 'interface=%s' % v['interface'] ])
 
+	def load(self, hosts, interfaces):
+		"""
+		Loads the hosts and their interfaces with a handful of
+		statements, the spreadsheet has already been checked by the
+		implementation that parsed it.
+		"""
+
+		if not hosts:
+			return
+
+		db = self.db
+
+		checks	= HostChecks(self.owner)
+		subnets = dict(db.select('name, id from subnets'))
+
+		# host names are lowercase, as with 'add host'
+		hosts	   = { checks.name(host): values for host, values in hosts.items() }
+		interfaces = { checks.name(host): values for host, values in interfaces.items() }
+
+		nodes = {}
+		for row in db.select("""
+			name, id, appliance, box, rack, rank, comment,
+			osaction, installaction from nodes"""):
+			nodes[row[0]] = list(row[1:])
+
+		#
+		# check everything before the first change
+		#
+		new	= []
+		updates = []
+		for host in hosts.keys():
+			values	  = hosts[host]
+			appliance = values.get('appliance')
+			comment	  = values.get('comment')
+
+			if comment and len(comment) > 140:
+				raise CommandError(self.owner, 'comments must be no longer than 140 characters')
+
+			if host not in nodes:
+				if appliance == 'frontend':
+					raise CommandError(self.owner, 'Renaming frontend is not supported!')
+
+				(appliance, rack, rank) = checks.placement(host, appliance,
+									   values.get('rack'), values.get('rank'))
+				box = checks.box(values.get('box', 'default'))
+				new.append((host, appliance, box, rack, rank, comment,
+					    checks.bootaction(values.get('osaction', 'default'), 'os', box),
+					    checks.bootaction(values.get('installaction', 'default'), 'install', box)))
+			else:
+				row = nodes[host]
+				current = row[1:]
+				row = list(current)
+				if appliance:
+					row[0] = checks.appliance(appliance)
+				if 'box' in values:
+					row[1] = checks.box(values['box'])
+				if 'rack' in values:
+					row[2] = values['rack']
+				if 'rank' in values:
+					row[3] = values['rank']
+				if comment:
+					row[4] = comment
+				if 'osaction' in values:
+					row[5] = checks.bootaction(values['osaction'], 'os', row[1])
+				if 'installaction' in values:
+					row[6] = checks.bootaction(values['installaction'], 'install', row[1])
+				if row != current:
+					updates.append(tuple(row) + (nodes[host][0], ))
+
+		db.executemany("""
+			insert into nodes
+			(name, appliance, box, rack, rank, comment, osaction, installaction)
+			values (%s, %s, %s, %s, %s, %s, %s, %s)
+			""", new)
+		db.executemany("""
+			update nodes set appliance=%s, box=%s, rack=%s, rank=%s,
+			comment=%s, osaction=%s, installaction=%s where id=%s
+			""", updates)
+
+		ids = dict(db.select('name, id from nodes where name in %s',
+				     (list(hosts.keys()), )))
+
+		#
+		# the groups in the spreadsheet replace the groups of the hosts
+		#
+		groups = dict(db.select('name, id from groups'))
+		db.executemany('insert into groups (name) values (%s)', sorted(set(
+			(group, ) for host in hosts.values()
+			for group in host.get('groups', [])
+			if group not in groups)))
+		groups = dict(db.select('name, id from groups'))
+
+		db.execute('delete from memberships where nodeid in %s',
+			   (list(ids.values()), ))
+		db.executemany('insert into memberships (nodeid, groupid) values (%s, %s)', [
+			(ids[host], groups[group]) for host in hosts.keys()
+			for group in dict.fromkeys(hosts[host].get('groups', [])) ])
+
+		#
+		# the interfaces in the spreadsheet replace the interfaces
+		# of the hosts, those with ip=auto get their address at the
+		# end with the frontend first
+		#
+		if not interfaces:
+			return
+
+		nics = [ ids[host] for host in interfaces.keys() ]
+		db.execute("""
+			delete from aliases where network in
+			(select id from networks where node in %s)
+			""", (nics, ))
+		db.execute('delete from networks where node in %s', (nics, ))
+
+		frontend = self.db.getHostname('localhost')
+		rows	 = []
+		autoip	 = []
+		for host in sorted(interfaces.keys(), key=lambda h: h != frontend):
+			for interface, values in interfaces[host].items():
+				default = str2bool(values.get('default', False))
+
+				name = values.get('ifhostname')
+				if default:
+					name = host
+
+				module = None
+				if 'bond' == interface[:4]:
+					module = 'bonding'
+
+				ip = values.get('ip')
+				if ip == 'auto':
+					ip = None
+					autoip.append((host, interface))
+
+				rows.append((ids[host], values.get('mac'), ip, name,
+					     interface, subnets.get(values.get('network')),
+					     module, values.get('vlan'), values.get('options'),
+					     values.get('channel'), default))
+
+		db.executemany("""
+			insert into networks
+			(node, mac, ip, name, device, subnet, module, vlanid,
+			 options, channel, main)
+			values (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+			""", rows)
+
+		for (host, interface) in autoip:
+			self.owner.call('set.host.interface.ip',
+					[ host, 'interface=%s' % interface, 'ip=auto' ])
+
+
 	def run(self, args):
 		hosts, interfaces = args
+
+		if self.owner.bulk:
+			self.load(hosts, interfaces)
+			return
+
 		existinghosts = self.getHostnames()
 		existing_memberships = {}
 		existing_groups = {}
@@ -35,6 +35,16 @@ class Command(command):
 	The json document containing the configuration information.
 	</param>
 
+	<param optional='1' type='boolean' name='bulk'>
+	Load the hosts in one transaction instead of one command at a
+	time. If any of the hosts can't be loaded nothing is changed.
+	Default: true
+	</param>
+
+	<param optional='1' type='boolean' name='sync'>
+	Sync the configuration once the data is loaded. Default: true
+	</param>
+
 	<arg optional='1' type='string' name='software'>
 	Load pallet, cart, and box data. If the pallet exists on a remote
 	server that requires authentication, be sure to provide the username
@@ -118,10 +128,13 @@ class Command(command):
 
 
 	def run(self, params, args):
-		filename, sync, = self.fillParams([
+		filename, sync, bulk, = self.fillParams([
 			('file', None, True),
 			('sync', True),
+			('bulk', True),
 		])
+		self.sync = str2bool(sync)
+		self.bulk = str2bool(bulk)
 
 		if not os.path.exists(filename):
 			raise CommandError(self, f'file {filename} does not exist')
@@ -166,7 +179,7 @@ class Command(command):
 			self.runPlugins(args)
 
 			# the usual load commands sync their configs after the load
-			if str2bool(sync):
+			if self.sync:
 				self.notify('\tSyncing config\n')
 				self.command('sync.config')
 				self.log.info('config synced')
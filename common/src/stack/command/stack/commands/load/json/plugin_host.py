@@ -4,8 +4,10 @@
 # https://github.com/Teradata/stacki/blob/master/LICENSE.txt
 # @copyright@
 
+import re
 import stack.commands
 import json
+from stack.commands.load import HostChecks
 from stack.exception import CommandError
 
 class Plugin(stack.commands.Plugin, stack.commands.Command):
@@ -31,173 +33,525 @@ class Plugin(stack.commands.Plugin, stack.commands.Command):
 			return
 
 		self.notify('\n\tLoading host\n')
+
+		# load all of the hosts in one transaction, if the document
+		# has anything the bulk loader can't handle fall back to
+		# loading the hosts one command at a time
+		if self.owner.bulk and import_data:
+			try:
+				changes = self.diff(import_data)
+			except CommandError as e:
+				self.owner.log.info(f'unable to bulk load hosts, loading one host at a time: {e}')
+				changes = None
+
+			if changes:
+				with self.owner.db.transaction():
+					self.apply(changes)
+					for host in import_data:
+						self.load_extras(host)
+
+				if self.owner.sync:
+					self.owner.command('sync.host.boot', [ host['name'] for host in import_data ])
+				return
+
 		# add each host then assign its various values to it
 		for host in import_data:
-			host_name = host['name']
-			parameters = [
-				host_name,
-				f'box={host["box"]}',
-				f'rack={host["rack"]}',
-				f'rank={host["rank"]}',
-				f'appliance={host["appliance"]}'
-			]
+			self.load_host(host)
+
+
+	def diff(self, import_data):
+		"""
+		Compares the hosts in the document to the database and returns
+		the rows to insert and update for each table. Raises a
+		CommandError for anything it can't resolve, before anything is
+		written.
+		"""
+
+		db = self.owner.db
+
+		checks	     = HostChecks(self)
+		environments = dict(db.select('name, id from environments'))
+		subnets	     = dict(db.select('name, id from subnets'))
+		groups	     = dict(db.select('name, id from groups'))
+
+		nodes = {}
+		boxes = {}
+		for (id, name, box, osaction, installaction, environment, comment, metadata) in db.select("""
+			id, name, box, osaction, installaction, environment, comment, metadata
+			from nodes"""):
+			nodes[name] = [ id, osaction, installaction, environment, comment, metadata ]
+			boxes[name] = box
+
+		interfaces = {}
+		for row in db.select("""
+			node, device, mac, ip, name, subnet, module, vlanid, options, channel, main
+			from networks"""):
+			interfaces[(row[0], row[1])] = list(row[2:])
+
+		attrs = {}
+		for (scopeid, attr, value, shadow) in db.select("""
+			scopeid, attr, value, shadow from attributes where scope='host'"""):
+			attrs[(scopeid, attr)] = (value, shadow)
+
+		memberships = set(db.select('nodeid, groupid from memberships'))
+
+		aliases = {}
+		for (alias, host, device) in db.select("""
+			a.name, n.name, nt.device from aliases a, networks nt, nodes n
+			where a.network = nt.id and nt.node = n.id"""):
+			aliases.setdefault(alias, []).append((host, device))
+
+		def lookup(table, key, what):
+			if key not in table:
+				raise CommandError(self, f'{what} "{key}" does not exist')
+			return table[key]
+
+		changes = {
+			'hosts'	      : [],
+			'new'	      : [],
+			'update'      : [],
+			'interfaces'  : [],
+			'default'     : [],
+			'auto'	      : [],
+			'aliases'     : [],
+			'attrs'	      : [],
+			'memberships' : []
+		}
+
+		seen = set()
+		for host in import_data:
+			# host names are lowercase, as with 'add host'
+			name = host['name'] = checks.name(host['name'])
+			if name in seen:
+				raise CommandError(self, f'host "{name}" is in the document more than once')
+			changes['hosts'].append(name)
+			seen.add(name)
+
+			environment = None
 			if host['environment']:
-				parameters.append(f'environment={host["environment"]}')
-			self.owner.try_command('add.host',parameters , f'adding host {host["name"]}', 'exists')
+				environment = lookup(environments, host['environment'], 'environment')
 
+			if name not in nodes:
+				(appliance, rack, rank) = checks.placement(name, host['appliance'],
+									   host['rack'], host['rank'])
+				box = checks.box(host['box'] or 'default')
+				changes['new'].append((
+					name, appliance, box, rack, rank,
+					checks.bootaction(host['osaction'] or 'default', 'os', box),
+					checks.bootaction(host['installaction'] or 'default', 'install', box),
+					environment,
+					host['comment'],
+					host['metadata']
+				))
+			else:
+				# existing hosts keep their name, rack, rank, box, and
+				# appliance just like with 'add host'
+				current = nodes[name]
+				row = list(current[1:])
+				if host['osaction']:
+					row[0] = checks.bootaction(host['osaction'], 'os', boxes[name])
+				if host['installaction']:
+					row[1] = checks.bootaction(host['installaction'], 'install', boxes[name])
+				if environment:
+					row[2] = environment
+				if host['comment']:
+					row[3] = host['comment']
+				if host['metadata']:
+					row[4] = host['metadata']
+				if row != current[1:]:
+					changes['update'].append(tuple(row) + (current[0],))
+
+			if host['comment'] and len(host['comment']) > 140:
+				raise CommandError(self, 'comments must be no longer than 140 characters')
 
-			# iterate through each interface for the host and set it
 			for interface in host['interface']:
-				self.owner.try_command('add.host.interface',[ host_name, f'interface={interface["interface"]}'], f'adding interface {interface["interface"]}', 'exists')
+				device = interface['interface']
 
+				subnet = None
+				if interface['network']:
+					subnet = lookup(subnets, interface['network'], 'network')
+
+				vlan = interface['vlan']
+				if vlan:
+					try:
+						vlan = int(vlan)
+					except ValueError:
+						raise CommandError(self, f'vlan "{vlan}" is not an integer')
+
+				ip = checks.ip(interface['ip'])
+				if ip == 'auto':
+					changes['auto'].append((name, device))
+					ip = None
+
+				if interface['name'] and '.' in interface['name']:
+					raise CommandError(self, f'interface name "{interface["name"]}" is not a base hostname')
+
+				# only the values set in the document change, the
+				# rest are left as they are
+				changes['interfaces'].append((name, device, {
+					'mac'	  : checks.mac(interface['mac']),
+					'ip'	  : ip,
+					'name'	  : interface['name'],
+					'subnet'  : subnet,
+					'module'  : interface['module'],
+					'vlanid'  : vlan,
+					'options' : interface['options'],
+					'channel' : interface['channel']
+				}))
+				if interface['default']:
+					changes['default'].append((name, device))
 
-				# iterate over each key in interface, ignoring 'already exists' warnings
-			for interface in host['interface']:
-				for k, v in interface.items():
-					if v and k != 'interface' and k!= 'alias':
-						parameters = [
-							host_name,
-							f'{k}={v}',
-							f'interface={interface["interface"]}',
-							]
-						self.owner.try_command(f'set.host.interface.{k}', parameters, f'setting {host_name} interface {k}', 'exists')
-
-				# the alias cannot be set, so add it here. There can be multiple
 				for alias in interface['alias']:
-					parameters = [
-						host_name,
-						f'alias={alias["alias"]}',
-						f'interface={interface["interface"]}',
-						]
-					self.owner.try_command('add.host.alias', parameters, f'adding {host_name} alias {alias}', 'exists')
+					alias = alias['alias']
+					if alias.isdigit() or re.match(r'^\d+\.\d+\.\d+\.\d+$', alias):
+						raise CommandError(self, f'alias "{alias}" is not a hostname')
+
+					# same rule as 'add host alias', an alias may be on
+					# more than one interface of the same host
+					owners = aliases.setdefault(alias, [])
+					if (name, device) in owners or [ h for (h, d) in owners if h != name ]:
+						self.owner.log.info(f'warning adding {name} alias {alias}: exists')
+						self.owner.warnings += 1
+						continue
+					owners.append((name, device))
+					changes['aliases'].append((name, device, alias))
 
-			# iterate through each attr for the host and add it
 			for attr in host['attrs']:
-				attr_name = attr['name']
+				attr_name  = attr['name']
 				attr_value = attr['value']
 				if not isinstance(attr_value, str):
 					attr_value = ' '.join(attr['value'])
-				attr_shadow = attr['shadow']
-				parameters = [
-					host_name,
-					f'attr={attr_name}',
-					f'value={attr_value}',
-					f'shadow={attr_shadow}'
-				]
-				self.owner.try_command('set.host.attr', parameters, f'setting {host["name"]} attr {attr_name}', 'exists')
+				if not attr_value:
+					continue
+				if not re.match('^[a-zA-Z_][a-zA-Z0-9_.]*$', attr_name):
+					raise CommandError(self, f'invalid attr name "{attr_name}"')
 
-			# add firewall rules. If the firewall rule already exists, then remove it and add the one in the json
-			for rule in host['firewall']:
-				parameters = [
-					host_name,
-					f'action={rule["action"]}',
-					f'chain={rule["chain"]}',
-					f'protocol={rule["protocol"]}',
-					f'service={rule["service"]}',
-					f'comment={rule["comment"]}',
-					f'flags={rule["flags"]}',
-					f'network={rule["network"]}',
-					f'output-network={rule["output-network"]}',
-					f'rulename={rule["name"]}',
-					f'table={rule["table"]}',
-				]
-				if rule['flags']:
-					parameters.append(f'flags={rule["flags"]}')
-				if rule['comment']:
-					parameters.append(f'comment={rule["comment"]}')
-				# if the add command returns false, run the remove command then re-run the add command
-				if not self.owner.try_command('add.host.firewall', parameters, f'adding host firewall rule {rule["name"]}', 'exists'):
-					self.owner.try_command('remove.host.firewall', [ host_name, f'rulename={rule["name"]}' ], 'removing host firewall rule {rule["action"]}', 'exists')
-					self.owner.try_command('add.host.firewall', parameters, f'adding host firewall rule {rule["name"]}', 'exists')
-
-			# add host routes
-			for route in host['route']:
-				parameters = [
-					host_name,
-					f'address={route["network"]}',
-					f'gateway={route["gateway"]}',
-					f'netmask={route["netmask"]}',
-				]
-				self.owner.try_command('add.host.route', parameters, f'adding host route {route}', 'exists')
+				if attr['shadow']:
+					value = (None, attr_value)
+				else:
+					value = (attr_value, None)
+				if name in nodes and attrs.get((nodes[name][0], attr_name)) == value:
+					continue
+				changes['attrs'].append((name, attr_name) + value)
 
-			# add host groups
 			for group in host['group']:
-				parameters = [
-					host_name,
-					f'group={group}',
-				]
-				self.owner.try_command('add.host.group', parameters, f'adding host {host_name} to group {group}', 'exists')
+				groupid = lookup(groups, group, 'group')
+				if name in nodes and (nodes[name][0], groupid) in memberships:
+					self.owner.log.info(f'warning adding host {name} to group {group}: exists')
+					self.owner.warnings += 1
+					continue
+				changes['memberships'].append((name, groupid))
+
+		self.interfaces = interfaces
+		return changes
+
+
+	def apply(self, changes):
+		"""
+		Writes the changes from diff() to the database.
+		"""
+
+		db = self.owner.db
+
+		db.executemany("""
+			insert into nodes
+			(name, appliance, box, rack, rank, osaction, installaction,
+			 environment, comment, metadata)
+			values (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+			""", changes['new'])
+
+		db.executemany("""
+			update nodes set osaction=%s, installaction=%s,
+			environment=%s, comment=%s, metadata=%s
+			where id=%s
+			""", changes['update'])
+
+		nodes = dict(db.select('name, id from nodes where name in %s', (changes['hosts'],)))
+
+		# interfaces the hosts already have are updated with the
+		# values from the document, the others are added
+		interfaces = self.interfaces
+		columns	   = [ 'mac', 'ip', 'name', 'subnet', 'module', 'vlanid', 'options', 'channel' ]
+
+		inserts = {}
+		updates = {}
+		devices = {}
+		for key in interfaces:
+			devices.setdefault(key[0], []).append(key[1])
+
+		for (name, device, values) in changes['interfaces']:
+			key = (nodes[name], device)
+			if key in interfaces:
+				row = list(interfaces[key])
+			else:
+				row = [ None ] * len(columns) + [ False ]
+				devices.setdefault(key[0], []).append(device)
+			for i, column in enumerate(columns):
+				if values[column]:
+					row[i] = values[column]
 
-			# add host partitions
-			for partition in host['partition']:
+			if key not in interfaces or key in inserts:
+				inserts[key] = row
+			elif row != interfaces[key]:
+				updates[key] = row
+			interfaces[key] = row
+
+		# the default interface is the only main one of the host
+		for (name, device) in changes['default']:
+			node = nodes[name]
+			for other in devices[node]:
+				key = (node, other)
+				row = interfaces[key]
+				main = (other == device)
+				if bool(row[-1]) != main:
+					row[-1] = main
+					if key not in inserts:
+						updates[key] = row
+
+		db.executemany("""
+			insert into networks
+			(node, device, mac, ip, name, subnet, module, vlanid, options, channel, main)
+			values (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+			""", [ key + tuple(row) for key, row in inserts.items() ])
+
+		db.executemany("""
+			update networks set mac=%s, ip=%s, name=%s, subnet=%s, module=%s,
+			vlanid=%s, options=%s, channel=%s, main=%s
+			where node=%s and device=%s
+			""", [ tuple(row) + key for key, row in updates.items() ])
+
+		for (name, device) in changes['auto']:
+			self.owner.try_command('set.host.interface.ip', [ name, f'interface={device}', 'ip=auto' ],
+					       f'setting {name} interface ip', 'exists')
+
+		if changes['aliases']:
+			networks = { (node, device): id for (id, node, device) in db.select(
+				'id, node, device from networks where node in %s', (list(nodes.values()),)) }
+			db.executemany("""
+				insert into aliases (network, name) values (%s, %s)
+				""", [ (networks[(nodes[name], device)], alias)
+				       for (name, device, alias) in changes['aliases'] ])
+
+		attrs = [ (nodes[name], attr, value, shadow)
+			  for (name, attr, value, shadow) in changes['attrs'] ]
+		db.executemany("""
+			delete from attributes where
+			scope='host' and scopeid=%s and attr=%s
+			""", [ (node, attr) for (node, attr, value, shadow) in attrs ])
+		db.executemany("""
+			insert into attributes (scope, scopeid, attr, value, shadow)
+			values ('host', %s, %s, %s, %s)
+			""", attrs)
+
+		db.executemany("""
+			insert into memberships (nodeid, groupid) values (%s, %s)
+			""", [ (nodes[name], group) for (name, group) in changes['memberships'] ])
+
+		for name in changes['hosts']:
+			self.owner.log.info(f'success loading host {name}')
+		self.owner.successes += len(changes['hosts'])
+
+
+	def load_host(self, host):
+		host_name = host['name']
+		parameters = [
+			host_name,
+			f'box={host["box"]}',
+			f'rack={host["rack"]}',
+			f'rank={host["rank"]}',
+			f'appliance={host["appliance"]}'
+		]
+		if host['environment']:
+			parameters.append(f'environment={host["environment"]}')
+		self.owner.try_command('add.host',parameters , f'adding host {host["name"]}', 'exists')
+
+
+		# iterate through each interface for the host and set it
+		for interface in host['interface']:
+			self.owner.try_command('add.host.interface',[ host_name, f'interface={interface["interface"]}'], f'adding interface {interface["interface"]}', 'exists')
+
+
+			# iterate over each key in interface, ignoring 'already exists' warnings
+		for interface in host['interface']:
+			for k, v in interface.items():
+				if v and k != 'interface' and k!= 'alias':
+					parameters = [
+						host_name,
+						f'{k}={v}',
+						f'interface={interface["interface"]}',
+						]
+					self.owner.try_command(f'set.host.interface.{k}', parameters, f'setting {host_name} interface {k}', 'exists')
+
+			# the alias cannot be set, so add it here. There can be multiple
+			for alias in interface['alias']:
 				parameters = [
 					host_name,
-					f'device={partition["device"]}',
-					f'mountpoint={partition["mountpoint"]}',
-					f'size={partition["size"]}',
+					f'alias={alias["alias"]}',
+					f'interface={interface["interface"]}',
 					]
-				if partition['fstype']:
-					parameters.append(f'fs={partition["fstype"]}')
-				if partition['partid']:
-					parameters.append(f'partid={partition["partid"]}')
-				if partition['options']:
-					parameters.append(f'options={partition["options"]}')
-				self.owner.try_command('add.storage.partition', parameters, f'adding partition {partition}', 'exists')
-
-			# add host controllers
-			for controller in host['controller']:
-				parameters = [
-					host_name,
-					f'arrayid={controller["arrayid"]}',
-				]
-				if controller['adapter']:
-					parameters.append(f'adapter={controller["adapter"]}')
-				if controller['enclosure']:
-					parameters.append(f'enclosure={controller["enclosure"]}')
-				if controller['raidlevel']:
-					parameters.append(f'raidlevel={controller["raidlevel"]}')
-				if controller['slot']:
-					parameters.append(f'slot={controller["slot"]}')
-				self.owner.try_command('add.storage.controller', parameters, f'adding host controller {controller}', 'exists')
-
-			# set the osaction of the host
-			if host["osaction"]:
-				parameters = [
-					host_name,
-					'type=os',
-					f'action={host["osaction"]}',
-				]
-				self.owner.try_command('set.host.bootaction', parameters, f'setting osaction of {host_name} to {host["osaction"]}', 'exists')
+				self.owner.try_command('add.host.alias', parameters, f'adding {host_name} alias {alias}', 'exists')
 
-			# set the installaction of the host
-			if host["installaction"]:
-				parameters = [
-					host_name,
-					'type=install',
-					f'action={host["installaction"]}',
-				]
-				self.owner.try_command('set.host.bootaction', parameters, f'setting installaction of {host_name} to {host["installaction"]}', 'exists')
+		# iterate through each attr for the host and add it
+		for attr in host['attrs']:
+			attr_name = attr['name']
+			attr_value = attr['value']
+			if not isinstance(attr_value, str):
+				attr_value = ' '.join(attr['value'])
+			attr_shadow = attr['shadow']
+			parameters = [
+				host_name,
+				f'attr={attr_name}',
+				f'value={attr_value}',
+				f'shadow={attr_shadow}'
+			]
+			self.owner.try_command('set.host.attr', parameters, f'setting {host["name"]} attr {attr_name}', 'exists')
 
-			# set metadata if there is any
-			if host['metadata']:
-				parameters = [
-					host_name,
-					f'metadata={host["metadata"]}',
-				]
-				self.owner.try_command('set.host.metadata', parameters, f'setting metadata of {host_name}', 'exists')
+		self.load_firewall(host)
+		self.load_route(host)
 
-			# set the comment if there is one
-			if host['comment']:
-				parameters = [
-					host_name,
-					f'comment={host["comment"]}',
-				]
-				self.owner.try_command('set.host.comment', parameters, f'setting comment of {host_name}', 'exists')
+		# add host groups
+		for group in host['group']:
+			parameters = [
+				host_name,
+				f'group={group}',
+			]
+			self.owner.try_command('add.host.group', parameters, f'adding host {host_name} to group {group}', 'exists')
 
-			# set the environment if there is one
-			if host['environment']:
-				parameters = [
-					host_name,
-					f'environment={host["environment"]}',
+		self.load_partition(host)
+		self.load_controller(host)
+
+		# set the osaction of the host
+		if host["osaction"]:
+			parameters = [
+				host_name,
+				'type=os',
+				f'action={host["osaction"]}',
+			]
+			self.owner.try_command('set.host.bootaction', parameters, f'setting osaction of {host_name} to {host["osaction"]}', 'exists')
+
+		# set the installaction of the host
+		if host["installaction"]:
+			parameters = [
+				host_name,
+				'type=install',
+				f'action={host["installaction"]}',
+			]
+			self.owner.try_command('set.host.bootaction', parameters, f'setting installaction of {host_name} to {host["installaction"]}', 'exists')
+
+		# set metadata if there is any
+		if host['metadata']:
+			parameters = [
+				host_name,
+				f'metadata={host["metadata"]}',
+			]
+			self.owner.try_command('set.host.metadata', parameters, f'setting metadata of {host_name}', 'exists')
+
+		# set the comment if there is one
+		if host['comment']:
+			parameters = [
+				host_name,
+				f'comment={host["comment"]}',
+			]
+			self.owner.try_command('set.host.comment', parameters, f'setting comment of {host_name}', 'exists')
+
+		# set the environment if there is one
+		if host['environment']:
+			parameters = [
+				host_name,
+				f'environment={host["environment"]}',
+			]
+			self.owner.try_command('set.host.environment', parameters, f'setting environment of {host_name}', 'exists')
+
+
+	def load_extras(self, host):
+		"""
+		The firewall rules, routes, and storage of a host are still
+		loaded with the commands, hosts rarely have any.
+		"""
+
+		self.load_firewall(host)
+		self.load_route(host)
+		self.load_partition(host)
+		self.load_controller(host)
+
+
+	def load_firewall(self, host):
+		host_name = host['name']
+
+		# add firewall rules. If the firewall rule already exists, then remove it and add the one in the json
+		for rule in host['firewall']:
+			parameters = [
+				host_name,
+				f'action={rule["action"]}',
+				f'chain={rule["chain"]}',
+				f'protocol={rule["protocol"]}',
+				f'service={rule["service"]}',
+				f'comment={rule["comment"]}',
+				f'flags={rule["flags"]}',
+				f'network={rule["network"]}',
+				f'output-network={rule["output-network"]}',
+				f'rulename={rule["name"]}',
+				f'table={rule["table"]}',
+			]
+			if rule['flags']:
+				parameters.append(f'flags={rule["flags"]}')
+			if rule['comment']:
+				parameters.append(f'comment={rule["comment"]}')
+			# if the add command returns false, run the remove command then re-run the add command
+			if not self.owner.try_command('add.host.firewall', parameters, f'adding host firewall rule {rule["name"]}', 'exists'):
+				self.owner.try_command('remove.host.firewall', [ host_name, f'rulename={rule["name"]}' ], 'removing host firewall rule {rule["action"]}', 'exists')
+				self.owner.try_command('add.host.firewall', parameters, f'adding host firewall rule {rule["name"]}', 'exists')
+
+
+	def load_route(self, host):
+		host_name = host['name']
+
+		# add host routes
+		for route in host['route']:
+			parameters = [
+				host_name,
+				f'address={route["network"]}',
+				f'gateway={route["gateway"]}',
+				f'netmask={route["netmask"]}',
+			]
+			self.owner.try_command('add.host.route', parameters, f'adding host route {route}', 'exists')
+
+
+	def load_partition(self, host):
+		host_name = host['name']
+
+		# add host partitions
+		for partition in host['partition']:
+			parameters = [
+				host_name,
+				f'device={partition["device"]}',
+				f'mountpoint={partition["mountpoint"]}',
+				f'size={partition["size"]}',
 				]
-				self.owner.try_command('set.host.environment', parameters, f'setting environment of {host_name}', 'exists')
+			if partition['fstype']:
+				parameters.append(f'fs={partition["fstype"]}')
+			if partition['partid']:
+				parameters.append(f'partid={partition["partid"]}')
+			if partition['options']:
+				parameters.append(f'options={partition["options"]}')
+			self.owner.try_command('add.storage.partition', parameters, f'adding partition {partition}', 'exists')
+
+
+	def load_controller(self, host):
+		host_name = host['name']
+
+		# add host controllers
+		for controller in host['controller']:
+			parameters = [
+				host_name,
+				f'arrayid={controller["arrayid"]}',
+			]
+			if controller['adapter']:
+				parameters.append(f'adapter={controller["adapter"]}')
+			if controller['enclosure']:
+				parameters.append(f'enclosure={controller["enclosure"]}')
+			if controller['raidlevel']:
+				parameters.append(f'raidlevel={controller["raidlevel"]}')
+			if controller['slot']:
+				parameters.append(f'slot={controller["slot"]}')
+			self.owner.try_command('add.storage.controller', parameters, f'adding host controller {controller}', 'exists')
@@ -49,7 +49,8 @@ class Command(stack.commands.load.command,
 		self.columns = {}
 		self.runImplementation('load_%s' % processor, (filename, ))
 		args = self.networks, self.current_networks
-		self.runPlugins(args)
+		with self.db.transaction():
+			self.runPlugins(args)
 
 		#
 		# checkin the spreadsheet
@@ -50,5 +50,12 @@ class Command(command):
 		if me in hosts:
 			raise CommandError(self, 'cannot remove "%s"' % me)
 
-		self.runPlugins(hosts)
-		self.command('sync.config')
+		# Each plugin removes the rows of all the hosts in its tables
+		# at once, and the whole removal is a single transaction.
+		with self.db.transaction():
+			results = dict(self.runPlugins(hosts))
+
+		# Now that the hosts are gone, their boot files can go too
+		results['boot']()
+
+		self.command('sync.config', hosts)
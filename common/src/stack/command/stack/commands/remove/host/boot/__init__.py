@@ -32,33 +32,31 @@ class Command(stack.commands.remove.host.command):
 	</example>
 	"""
 	
-	def getHostHexIP(self, host):
-		#
-		# Get the IP and NETMASK of the host
-		#
-	
-		appliance = self.getHostAttr(host, 'appliance')
-		if appliance == 'frontend':
-			return []
+	def getHostIPs(self, hosts):
+		"""
+		Returns a dictionary of host to the list of its PXE
+		addresses, which the boot files are named after. The
+		frontend doesn't have any boot files.
+		"""
+
+		if not hosts:
+			return {}
+
+		appliances = self.getHostAttrDict(list(hosts), 'appliance')
 
-		hex_ip_list = []
-		for row in self.call('list.host.interface', [host, 'expanded=True']):
-			ip = row['ip']
-			pxe = row['pxe']
-			if ip and pxe:
-				#
-				# Compute the HEX IP filename for the host
-				#
-				hexstr = ''
-				for i in ip.split('.'):
-					hexstr += '%02x' % (int(i))
+		ips = { host: [] for host in hosts }
+		for row in self.call('list.host.interface', hosts + [ 'expanded=True' ]):
+			host = row['host']
+			if appliances.get(host, {}).get('appliance') == 'frontend':
+				continue
+			if row['ip'] and row['pxe']:
+				ips[host].append(row['ip'])
 
-				hex_ip_list.append(hexstr.upper())
-		return hex_ip_list
+		return ips
 
 	def run(self, params, args):
 		if not len(args):
 			raise ArgRequired(self, 'host')
 
 		hosts = self.getHostnames(args)
-		self.runPlugins(hosts)
+		self.runPlugins(self.getHostIPs(hosts))
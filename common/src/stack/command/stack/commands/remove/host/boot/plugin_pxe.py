@@ -15,12 +15,11 @@ class Plugin(stack.commands.Plugin):
 	def provides(self):
 		return "pxe"
 
-	def run(self, hosts):
-		for host in hosts:
-			hex_ip_list = self.owner.getHostHexIP(host)
-			if hex_ip_list == []:
-				return
-			for ip in hex_ip_list:
-				filename = '/tftpboot/pxelinux/pxelinux.cfg/%s' % ip
+	def run(self, ips):
+		for host in ips:
+			for ip in ips[host]:
+				# IP as Hex
+				filename = '/tftpboot/pxelinux/pxelinux.cfg/%s' % \
+					''.join('%02X' % int(x) for x in ip.split('.'))
 				if os.path.exists(filename):
 					os.unlink(filename)
@@ -15,12 +15,9 @@ class Plugin(stack.commands.Plugin):
 	def provides(self):
 		return 'uefi'
 
-	def run(self, hosts):
-		for host in hosts:
-			hex_ip_list = self.owner.getHostHexIP(host)
-			if hex_ip_list == []:
-				return
-			for ip in hex_ip_list:
+	def run(self, ips):
+		for host in ips:
+			for ip in ips[host]:
 				filename = '/tftpboot/pxelinux/uefi/grub.cfg-%s' % ip
 				if os.path.exists(filename):
 					os.unlink(filename)
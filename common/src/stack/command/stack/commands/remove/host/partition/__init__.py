@@ -62,23 +62,22 @@ class Command(stack.commands.remove.host.command):
 			('uuid', None)
 		])
 
-		for host in hosts:
-			sql = """
-				delete from partitions
-				where node=(select id from nodes where name=%s)
-			"""
-			values = [host]
-
-			if uuid:
-				sql += ' and uuid=%s'
-				values.append(uuid)
-
-			if partition:
-				sql += ' and mountpoint=%s'
-				values.append(partition)
-
-			if device:
-				sql += ' and device=%s'
-				values.append(device)
-
-			self.db.execute(sql, values)
+		sql = """
+			delete from partitions
+			where node in (select id from nodes where name in %s)
+		"""
+		values = [hosts]
+
+		if uuid:
+			sql += ' and uuid=%s'
+			values.append(uuid)
+
+		if partition:
+			sql += ' and mountpoint=%s'
+			values.append(partition)
+
+		if device:
+			sql += ' and device=%s'
+			values.append(device)
+
+		self.db.execute(sql, values)
@@ -19,12 +19,11 @@ class Plugin(stack.commands.Plugin):
 		return 'alias'
 
 	def run(self, hosts):
-		for host in hosts:
-			self.owner.db.execute("""
-				delete from aliases
-				where network IN (
-					select id from networks where node=(
-						select id from nodes where name=%s
-					)
+		self.owner.db.execute("""
+			delete from aliases
+			where network IN (
+				select id from networks where node IN (
+					select id from nodes where name IN %s
 				)
-			""", (host,))
+			)
+		""", (hosts,))
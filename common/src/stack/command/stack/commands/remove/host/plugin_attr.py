@@ -19,10 +19,9 @@ class Plugin(stack.commands.Plugin):
 		return 'attr'
 
 	def run(self, hosts):
-		for host in hosts:
-			self.owner.db.execute("""
-				delete from attributes
-				where scope="host" and scopeid=(
-					select id from nodes where name=%s
-				)
-			""", (host,))
+		self.owner.db.execute("""
+			delete from attributes
+			where scope="host" and scopeid IN (
+				select id from nodes where name IN %s
+			)
+		""", (hosts,))
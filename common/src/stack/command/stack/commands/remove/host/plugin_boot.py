@@ -11,6 +11,7 @@
 # @rocks@
 
 import stack.commands
+import stack.commands.remove.host.boot
 
 
 class Plugin(stack.commands.Plugin):
@@ -19,4 +20,11 @@ class Plugin(stack.commands.Plugin):
 		return 'boot'
 
 	def run(self, hosts):
-		self.owner.command('remove.host.boot', hosts)
+		# The boot files are named after the addresses of the hosts,
+		# look them up while the hosts are still there. Files can't
+		# be rolled back, so remove host only removes them once the
+		# transaction is committed.
+		boot = stack.commands.remove.host.boot.Command(self.owner.db.database)
+		ips = boot.getHostIPs(hosts)
+
+		return lambda: boot.runPlugins(ips)
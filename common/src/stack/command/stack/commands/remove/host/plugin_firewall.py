@@ -19,8 +19,7 @@ class Plugin(stack.commands.Plugin):
 		return 'firewall'
 
 	def run(self, hosts):
-		for host in hosts:
-			self.db.execute("""
-				delete from node_firewall
-				where node=(select id from nodes where name=%s)
-			""", (host,))
+		self.db.execute("""
+			delete from node_firewall
+			where node IN (select id from nodes where name IN %s)
+		""", (hosts,))
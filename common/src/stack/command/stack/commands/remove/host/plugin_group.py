@@ -13,8 +13,7 @@ class Plugin(stack.commands.Plugin):
 		return 'group'
 
 	def run(self, hosts):
-		for host in hosts:
-			self.owner.db.execute("""
-				delete from memberships
-				where nodeid=(select id from nodes where name=%s)
-			""", (host,))
+		self.owner.db.execute("""
+			delete from memberships
+			where nodeid IN (select id from nodes where name IN %s)
+		""", (hosts,))
@@ -25,5 +25,4 @@ class Plugin(stack.commands.Plugin):
 		return [ 'interface', 'TAIL']
 
 	def run(self, hosts):
-		for host in hosts:
-			self.owner.db.execute('delete from nodes where name=%s', (host,))
+		self.owner.db.execute('delete from nodes where name IN %s', (hosts,))
@@ -22,8 +22,7 @@ class Plugin(stack.commands.Plugin):
 		return [ 'boot', 'TAIL']
 
 	def run(self, hosts):
-		for host in hosts:
-			self.owner.db.execute("""
-				delete from networks
-				where node=(select id from nodes where name=%s)
-			""", (host,))
+		self.owner.db.execute("""
+			delete from networks
+			where node IN (select id from nodes where name IN %s)
+		""", (hosts,))
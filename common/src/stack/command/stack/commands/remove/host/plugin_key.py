@@ -19,8 +19,7 @@ class Plugin(stack.commands.Plugin):
 		return 'key'
 
 	def run(self, hosts):
-		for host in hosts:
-			self.owner.db.execute("""
-				delete from public_keys
-				where node=(select id from nodes where name=%s)
-			""", (host,))
+		self.owner.db.execute("""
+			delete from public_keys
+			where node IN (select id from nodes where name IN %s)
+		""", (hosts,))
@@ -19,5 +19,7 @@ class Plugin(stack.commands.Plugin):
 		return 'route'
 
 	def run(self, hosts):
-		hosts.append('address=%')
-		self.owner.command('remove.host.route', hosts)
+		self.owner.db.execute("""
+			delete from node_routes
+			where node IN (select id from nodes where name IN %s)
+		""", (hosts,))
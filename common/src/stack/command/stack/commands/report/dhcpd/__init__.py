@@ -14,6 +14,7 @@ import stack
 import ipaddress
 import stack.commands
 from stack.commands import Warn
+import stack.omapi
 import stack.text
 
 header = """
@@ -52,6 +53,12 @@ class Command(stack.commands.HostArgumentProcessor,
 		self.addOutput('', stack.text.DoNotEdit())
 		self.addOutput('', '%s' % header)
 
+		# Let sync dhcpd change hosts on the running dhcpd
+		if self.str2bool(self.getAttr('dhcpd.omapi')):
+			self.addOutput('', 'include "%s";' % stack.omapi.KEY_FILE)
+			self.addOutput('', 'omapi-port %d;' % stack.omapi.PORT)
+			self.addOutput('', 'omapi-key %s;\n' % stack.omapi.KEY_NAME)
+
 		# Build a dictionary of DHCPD server addresses
 		# for each subnet that serves PXE (DHCP).
 
@@ -137,45 +144,74 @@ class Command(stack.commands.HostArgumentProcessor,
 						self.addOutput('', '\t}\n')
 					self.addOutput('', '}\n')
 
+		hosts = self.getHostnames()
+
+		# All the interfaces, grouped by host and in device order.
+		# This is the same query 'list host interface' uses, so the
+		# interfaces (and the duplicates among them) are the same.
+
+		interfaces = { host: [] for host in hosts }
+		for row in self.db.select("""
+			distinctrow
+			n.name, net.device, net.mac, net.ip, net.channel,
+			IF(net.subnet, sub.name, NULL), net.main,
+			net.module, net.name, net.vlanid, net.options
+			from
+			nodes n, networks net, subnets sub
+			where
+			net.node=n.id
+			and (net.subnet=sub.id or net.subnet is NULL)
+			order by net.device
+			"""):
+			(host, device, mac, ip, channel) = row[:5]
+			if host not in interfaces:
+				continue
+			if device and device.startswith('vlan'):
+				mac = ip = None
+			interfaces[host].append((device, mac, ip, channel))
+
+		# Every network row, to resolve the address of an interface
+		# through its channel (e.g. a bond) and to find the PXE
+		# network of an address.
+
+		self.networks = {}
+		pxe = {}
+		for (host, device, ip, channel, netname, ispxe) in self.db.select("""
+			n.name, nt.device, nt.ip, nt.channel, s.name, s.pxe
+			from nodes n, networks nt left join subnets s on nt.subnet=s.id
+			where nt.node=n.id
+			"""):
+			self.networks.setdefault((host, device), []).append((ip, channel))
+			if ip and ispxe:
+				pxe.setdefault((host, ip), netname)
+
+		kickstartable = self.getHostAttrDict([], 'kickstartable')
+		aws = self.getHostAttrDict([], 'aws')
+
 		data = {}
-		for host in self.call('list.host'):
-			data[host['host']] = []
-
-		host_devices = {}
-		interfaces = self.call('list.host.interface')
-		for interface in interfaces:
-			host = interface['host']
-			mac = interface['mac']
-			ip = interface['ip']
-			device = interface['interface']
-			channel = interface['channel']
-
-			other_interfaces = [iface['interface'] for iface in interfaces
-					    if iface['host'] == host and iface['interface'] != device]
-
-			if channel:
-				if device == 'ipmi' and not ip:
-					Warn(f'WARNING: skipping IPMI interface on host "{host}" - interface has a channel but no IP')
-					continue
-				elif device != 'ipmi' and channel not in other_interfaces:
-					Warn(f'WARNING: skipping interface "{device}" on host "{host}" - '
-					     f'interface has channel "{channel}" that does not match any other interface on the host')
-					continue
-			if host in host_devices:
-				if device in host_devices[host]:
+		for host in hosts:
+			data[host] = []
+
+			devices = [ device for (device, mac, ip, channel) in interfaces[host] ]
+			host_devices = []
+			for (device, mac, ip, channel) in interfaces[host]:
+				if channel:
+					if device == 'ipmi' and not ip:
+						Warn(f'WARNING: skipping IPMI interface on host "{host}" - interface has a channel but no IP')
+						continue
+					elif device != 'ipmi' and (channel == device or channel not in devices):
+						Warn(f'WARNING: skipping interface "{device}" on host "{host}" - '
+						     f'interface has channel "{channel}" that does not match any other interface on the host')
+						continue
+				if device in host_devices:
 					Warn(f'WARNING: skipping interface "{device}" on host "{host}" - duplicate interface detected')
 					continue
-				else:
-					host_devices[host].append(device)
-			elif host:
-				host_devices[host] = [device]
+				host_devices.append(device)
 
-			if host and mac:
-				data[host].append((mac, ip, device))
+				if mac:
+					data[host].append((mac, ip, device))
 
 		for name in data.keys():
-			kickstartable = self.str2bool(self.getHostAttr(name, 'kickstartable'))
-			aws = self.str2bool(self.getHostAttr(name, 'aws'))
 			mac = None
 			ip  = None
 			dev = None
@@ -189,18 +225,13 @@ class Command(stack.commands.HostArgumentProcessor,
 					try:
 						ip = self.resolve_ip(name, dev)
 					except ValueError:
-						Warn(f'WARNING: skipping interface "{device}" on host "{host}" - duplicate interface detected')
+						Warn(f'WARNING: skipping interface "{dev}" on host "{name}" - could not resolve its address')
 						continue
 				netname = None
 				if ip:
-					r = self.db.select("""
-					s.name from subnets s, networks nt,
-					nodes n where nt.node=n.id and
-					n.name='%s' and nt.subnet=s.id and
-					s.pxe = TRUE and nt.ip = '%s'""" % (name, ip))
-					if r:
-						(netname, ) = r[0]
-				if ip and mac and dev and netname and not aws:
+					netname = pxe.get((name, ip))
+				if ip and mac and dev and netname and \
+				   not self.str2bool(aws.get(name, {}).get('aws')):
 					self.addOutput('', '\nhost %s.%s.%s {' %
 						(name, netname, dev))
 					self.addOutput('', '\toption host-name\t"%s";' % name)
@@ -208,7 +239,7 @@ class Command(stack.commands.HostArgumentProcessor,
 					self.addOutput('', '\thardware ethernet\t%s;' % mac)
 					self.addOutput('', '\tfixed-address\t\t%s;' % ip)
 
-					if kickstartable:
+					if self.str2bool(kickstartable.get(name, {}).get('kickstartable')):
 
 						self.addOutput('', filename)
 						server = servers.get(netname)
@@ -230,10 +261,7 @@ class Command(stack.commands.HostArgumentProcessor,
 		(for example, if the interface is part of a bond).
 		"""
 
-		(ip, channel), = self.db.select("""nt.ip,
-			nt.channel from networks nt, nodes n
-			where n.name=%s and nt.device=%s and
-			nt.node=n.id""", (host, device))
+		(ip, channel), = self.networks.get((host, device), [])
 
 		if channel:
 			return self.resolve_ip(host, channel)
@@ -92,6 +92,18 @@ class Command(stack.commands.Command,
 				h['ramdisk'] = b['ramdisk']
 				h['args']    = b['args']
 
+		# UEFI boot files for the OS need the uuid of the EFI
+		# partition, get all of them at once
+		efi = {}
+		for (name, uuid) in self.db.select("""
+			n.name, p.uuid from partitions p, nodes n
+			where p.node = n.id and p.mountpoint = '/boot/efi'
+			order by p.device"""):
+			efi.setdefault(name, uuid)
+
+		for host in hosts:
+			ha[host]['efi'] = efi.get(host)
+
 		argv = []
 		for host in hosts:
 			argv.append(host)
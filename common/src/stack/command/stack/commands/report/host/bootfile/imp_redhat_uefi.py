@@ -48,12 +48,8 @@ class Implementation(stack.commands.Implementation):
 		# Get the bootaction for the host (install or os) and
 		# lookup the actual kernel, ramdisk, and args for the
 		# specific action.
-		root_uuid = None
+		root_uuid = h['efi']
 		if boottype == 'os':
-			for part in self.owner.call('list.host.partition', [host]):
-				if part['mountpoint'] == '/boot/efi':
-					root_uuid = part['uuid']
-					break
 			if root_uuid:
 				self.owner.addOutput(host, os_template % root_uuid)
 
@@ -81,13 +81,13 @@ zone "0.0.127.in-addr.arpa" IN {
 zone_template = """
 zone "%s" {
 	type master;
-	notify no;
+	notify no;%s
 	file "%s.domain";
 };
 
 zone "%s.in-addr.arpa" {
 	type master;
-	notify no;
+	notify no;%s
 	file "reverse.%s.domain.%s";
 };
 """
@@ -145,13 +145,23 @@ class Command(stack.commands.report.command):
 		# and reverse it. This is basically the
 		# format that named understands
 
+		# With dynamic DNS, sync dns can update single hosts with
+		# the rndc key rather than rewriting every zone.
+
+		if self.str2bool(self.getAttr('dns.dynamic')):
+			update = '\n\tallow-update { key rndc-key; };'
+		else:
+			update = ''
+
 		for network in networks:
 			sn = self.getSubnet(network['address'], network['mask'])
 			sn.reverse()
 			r_sn = '.'.join(sn)
 			s += zone_template % (network['zone'],
+					      update,
 					      network['network'],
 					      r_sn,
+					      update,
 					      network['network'],
 					      r_sn)
 
@@ -11,6 +11,7 @@
 # @rocks@
 
 import os
+import re
 import time
 import stack.commands
 
@@ -27,12 +28,16 @@ preamble_template = """$TTL 3D
 
 """
 
+serial_pattern = re.compile(r'^(\s*)(\d+) ; Serial$', re.M | re.I)
+
 
 class Command(stack.commands.report.command):
 	"""
 	Prints out all the named zone.conf and reverse-zone.conf files in XML.
 	To actually create these files, run the output of the command through
 	"stack report script"
+
+	The serial of a zone only changes when the content of the zone does.
 	
 	<example cmd='report zones'>
 	Prints contents of all the zone config files
@@ -44,20 +49,40 @@ class Command(stack.commands.report.command):
 	
 	<related>sync dns</related>
 	"""
-	def hostlines(self, name, zone):
-
-		"Lists the name->IP mappings for all hosts"
 
-		s = ""
+	def interfaces(self):
+		"""
+		Loads every interface on a subnet, with its aliases, in one
+		query. Returns a list of (subnet, zone, host, ip, name,
+		aliases) tuples.
+		"""
+
+		interfaces = []
+		index = {}
+		for (id, subnet, zone, host, ip, name, alias) in self.db.select("""
+			nt.id, s.name, s.zone, n.name, nt.ip, nt.name, a.name
+			from networks nt
+			join nodes n on nt.node = n.id
+			join subnets s on nt.subnet = s.id
+			left join aliases a on a.network = nt.id
+			order by nt.id, a.id
+			"""):
+			if id not in index:
+				index[id] = (subnet, zone, host, ip, name, [])
+				interfaces.append(index[id])
+			if alias:
+				index[id][5].append(alias)
+
+		return interfaces
+
+	def hostlines(self, interfaces):
 
-		self.db.execute("select n.name, nt.ip, nt.name " +
-			"from subnets s, nodes n, networks nt "	 +
-			"where s.zone='%s' " % (zone)	+
-			"and nt.subnet=s.id and nt.node=n.id")
+		"Lists the name->IP mappings for all hosts"
 
-		for (name, device, network_name) in self.db.fetchall():
+		s = []
+		for (subnet, zone, name, ip, network_name, aliases) in interfaces:
 
-			if device is None:
+			if ip is None:
 				continue
 
 			if network_name is None:
@@ -65,56 +90,49 @@ class Command(stack.commands.report.command):
 			
 			record = network_name
 
-			s += '%s A %s\n' % (record, device)
+			s.append('%s A %s\n' % (record, ip))
 
 			# Now record the aliases. We always substitute 
 			# network names with aliases. Nothing else will
 			# be allowed
-			self.db.execute('select a.name from aliases a, ' +
-				'networks nt where nt.id=a.network and '	+
-				'nt.device="%s"' % (device))
-
-			for alias, in self.db.fetchall():
-				s += '%s CNAME %s\n' % (alias, record)
+			for alias in aliases:
+				s.append('%s CNAME %s\n' % (alias, record))
 
 		return s
 
 	def hostlocal(self, name, zone):
-		"Appends any manually defined hosts to domain file"
+		"""
+		Returns the manually defined hosts to append to the domain
+		file, and a stub local file to write if there isn't one yet.
+		"""
 		
 		filename = '%s/%s.domain.local' % (self.named, name)
-		s = ''
 		# If local file exists import from it
 		if os.path.isfile(filename):
-			s += "\n;Imported from %s\n\n" % filename
-			file = open(filename, 'r')
-			s += file.read()
-			file.close()
+			with open(filename, 'r') as file:
+				return "\n;Imported from %s\n\n%s" % (filename, file.read()), ''
+
 		# if it doesn't exist, create a stub file
-		else:
-			s += "</stack:file>\n"
-			s += '<stack:file stack:name="%s" stack:perms="0644">\n' % filename
-			s += ';Extra host mappings go here. Example\n'
-			s += ';myhost	A	10.1.1.1\n'
+		s = []
+		s.append('<stack:file stack:name="%s" stack:perms="0644">\n' % filename)
+		s.append(';Extra host mappings go here. Example\n')
+		s.append(';myhost	A	10.1.1.1\n')
+		s.append('</stack:file>\n')
 
-		return s
+		return '', ''.join(s)
 
-	def reversehostlines(self, r_sn, s_name):
+	def reversehostlines(self, r_sn, s_name, interfaces):
 		"Lists the IP -> name mappings for all hosts. "
 		"Handles only IPv4 addresses."
 
-		s = ''
+		s = []
 		subnet_len = len(r_sn.split('.'))
-		self.db.execute('select nt.name, n.name, nt.ip, s.zone ' +
-				'from networks nt, subnets s, nodes n where ' +
-				's.name="%s" ' % (s_name)	+
-				'and nt.subnet=s.id and nt.node=n.id')
 
 		# Remove all elements of the IP address that are
 		# present in the subnet. This is done by counting
 		# the number of elements in the subnet, and popping
 		# that many from the IP address
-		for (netname, nodename, ip, zone) in self.db.fetchall():
+		for (subnet, zone, nodename, ip, netname, aliases) in interfaces:
 			if netname:
 				name = netname
 			else:
@@ -128,7 +146,7 @@ class Command(stack.commands.report.command):
 			t_ip = ip.split('.')[subnet_len:]
 			t_ip.reverse()
 			
-			s += '%s PTR %s.%s.\n' % ('.'.join(t_ip), name, zone)
+			s.append('%s PTR %s.%s.\n' % ('.'.join(t_ip), name, zone))
 
 		#
 		# handle reverse local additions
@@ -136,22 +154,46 @@ class Command(stack.commands.report.command):
 		filename = '%s/reverse.%s.domain.%s.local' \
 			% (self.named, s_name, r_sn)
 		if os.path.exists(filename):
-			s += '\n;Imported from %s\n\n' % filename
-			f = open(filename, 'r')
-			s += f.read()
-			f.close()
-			s += '\n'
+			s.append('\n;Imported from %s\n\n' % filename)
+			with open(filename, 'r') as f:
+				s.append(f.read())
+			s.append('\n')
 		else:
-			s += '\n'
-			s += '; Custom entries for network %s\n' % s_name
-			s += '; can be placed in %s\n' % filename
-			s += '; These entries will be sourced on sync\n'
+			s.append('\n')
+			s.append('; Custom entries for network %s\n' % s_name)
+			s.append('; can be placed in %s\n' % filename)
+			s.append('; These entries will be sourced on sync\n')
 
 		return s
 
+	def zonefile(self, filename, body):
+		"""
+		Returns the <stack:file> for a zone. BODY has a '%s' for the
+		serial. The serial of the current zone file is kept if nothing
+		else changed, otherwise it goes up.
+		"""
+
+		serial = self.serial
+		try:
+			with open(filename, 'r') as f:
+				current = f.read()
+		except OSError:
+			current = None
+
+		if current:
+			m = serial_pattern.search(current)
+			if m:
+				old = int(m.group(2))
+				if serial_pattern.sub(r'\1%s ; Serial', current, 1).strip() == body.strip():
+					serial = old
+				else:
+					serial = max(serial, old + 1)
+
+		return '<stack:file stack:name="%s" stack:perms="0644">\n%s</stack:file>\n' % \
+			(filename, body.replace('%s ; Serial', '%d ; Serial' % serial, 1))
 
 	def run(self, params, args):
-		serial = int(time.time())
+		self.serial = int(time.time())
 
 		networks = []
 		for row in self.call('list.network', [ 'dns=true' ]):
@@ -164,6 +206,13 @@ class Command(stack.commands.report.command):
 			self.named = '/var/named'
 		self.beginOutput()
 
+		# Group the interfaces by zone (forward) and subnet (reverse)
+		zones   = {}
+		subnets = {}
+		for interface in self.interfaces():
+			zones.setdefault(interface[1], []).append(interface)
+			subnets.setdefault(interface[0], []).append(interface)
+
 		#
 		# Forward Lookups
 		#
@@ -172,21 +221,20 @@ class Command(stack.commands.report.command):
 			name = network['network']
 			zone = network['zone']
 			filename = '%s/%s.domain' % (self.named, name)
-			s = ''
-			s += '<stack:file stack:name="%s" stack:perms="0644">\n' % filename
-			s += preamble_template % (zone, zone, serial, zone, zone)
-			s += 'ns A 127.0.0.1\n\n'
-			s += self.hostlines(name, zone)
-			s += self.hostlocal(name, zone)
-			s += '</stack:file>\n'
-			self.addOutput('', s)
+			local, stub = self.hostlocal(name, zone)
+
+			s = []
+			s.append(preamble_template % (zone, zone, '%s', zone, zone))
+			s.append('ns A 127.0.0.1\n\n')
+			s.extend(self.hostlines(zones.get(zone, [])))
+			s.append(local)
+			self.addOutput('', self.zonefile(filename, ''.join(s)) + stub)
 
 		#    
 		# Reverse Lookups
 		#
 		
-		subnet_list = {}
-		s = ''
+		s = []
 		for network in networks:
 			address = network['address']
 			mask    = network['mask']
@@ -198,10 +246,10 @@ class Command(stack.commands.report.command):
 			r_sn = '.'.join(sn)
 
 			filename = '%s/reverse.%s.domain.%s' % (self.named, name, r_sn)
-			s += '<stack:file stack:name="%s" stack:perms="0644">\n' % filename
-			s += preamble_template % (name, name, serial, name, name)
-			s += self.reversehostlines(r_sn, name)
-			s += '</stack:file>\n'
+			body = []
+			body.append(preamble_template % (name, name, '%s', name, name))
+			body.extend(self.reversehostlines(r_sn, name, subnets.get(name, [])))
+			s.append(self.zonefile(filename, ''.join(body)))
 
-		self.addOutput('', s)
+		self.addOutput('', ''.join(s))
 		self.endOutput(padChar='')
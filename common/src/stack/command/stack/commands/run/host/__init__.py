@@ -14,132 +14,11 @@
 import os
 import stack.commands
 from stack.exception import ParamType, ParamValue
-import threading
-import socket
-import time
-import subprocess
-
-class Parallel(threading.Thread):
-	def __init__(self, cmd, host, output, timeout):
-		threading.Thread.__init__(self)
-		self.cmd = cmd
-		self.host = host
-		self.output = output
-		self.timeout = timeout
-
-	def run(self):
-		"""
-		Runs the COMMAND on the remote HOST.  If the HOST is the
-		current machine just run the COMMAND in a subprocess.
-		"""
-
-		online = True
-
-		if self.host != socket.gethostname().split('.')[0]:
-			# First check to make the machine is up and SSH is responding.
-			#
-			# This catches the case when the node is up, sshd is sitting
-			# on port 22, but it is not responding (e.g., the node is
-			# overloaded, sshd is hung, etc.)
-			#
-			# sock.recv() should return something like:
-			#
-			#	SSH-2.0-OpenSSH_4.3
-
-			sock   = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-			sock.settimeout(2.0)
-			try:
-				sock.connect((self.host, 22))
-				buf = sock.recv(64)
-			except:
-				online = False
-
-		# If we're online, run the SSH command. Make sure to
-		# pipe STDERR to STDOUT. We wan't to merge the streams
-		# as if this were the output of running the command on
-		# the command line.
-		if online:
-			proc = subprocess.Popen([ 'ssh', self.host, self.cmd ],
-						stdin=None,
-						stdout=subprocess.PIPE,
-						stderr=subprocess.STDOUT)
-
-			# If we dont have a timeout, just wait for the process
-			# to finish
-			if self.timeout <= 0:
-				retval = proc.wait()
-			else:
-				hit_timeout = False
-				start_time = time.time()
-				while hit_timeout is False:
-					# Check if process is done
-					retval = proc.poll()
-					if retval is not None:
-						break
-					# If we're not done, check if we're out
-					# of time.
-					if time.time() - start_time > self.timeout:
-						hit_timeout = True
-						break
-					# If we're not done, and not timed out yet,
-					# just wait
-					if retval is None:
-						time.sleep(0.25)
-
-				# If we hit a timeout, terminate, and
-				# get return code
-				if hit_timeout is True:
-					proc.terminate()
-					retval = proc.wait()
-
-			# Finally get the output, and return back
-			o, e = proc.communicate()
-			self.output['retval'] = retval
-			self.output['output'] = o.strip()
-
-		else:
-			# If we couldn't connect to the host,
-			# return back
-			self.output['retval'] = -1
-			self.output['output'] = 'down'
-
-		return
 
 class command(stack.commands.Command,
 	stack.commands.HostArgumentProcessor):
 
-	def getRunHosts(self, hosts):
-		self.mgmt_networks = {}
-		run_hosts = []
-		self.attrs = self.call('list.host.attr',hosts)
-		f = lambda x: x['attr'] == 'stack.network'
-		network_attrs = list(filter(f, self.attrs))
-
-		self.mgmt_networks = {}
-		for host in hosts:
-			g = lambda x: x['host'] == host
-			s = list(filter(g, network_attrs))
-			if len(s):
-				network = s[0]['value']
-				if network not in self.mgmt_networks:
-					self.mgmt_networks[network] = []
-				self.mgmt_networks[network].append(host)
-
-		a = []
-		b = []
-		for net in self.mgmt_networks:
-			h = self.mgmt_networks[net]
-			a.extend(h)
-			b.extend(self.getHostnames(h, subnet=net))
-
-		for host in hosts:
-			if host in a:
-				idx = a.index(host)
-				run_hosts.append({'host':host, 'name':b[idx]})
-			else:
-				run_hosts.append({'host':host, 'name':host})
-
-		return run_hosts
+	pass
 
 class Command(command):
 	"""
@@ -187,10 +66,33 @@ class Command(command):
 	</param>
 
 	<param type='string' name='threads'>
-	The number of threads to start in parallel. Default is 0.
+	The maximum number of hosts to run the command on in parallel.
+	Default is 0 (no limit).
 	Set "run.host.threads" to set the default
 	</param>
 
+	<param type='boolean' name='collapse'>
+	If 'yes', wait for all the hosts and list each distinct output
+	once with the hosts that produced it. Default is 'no'.
+	</param>
+
+	<param type='string' name='fanout'>
+	How the frontend reaches the hosts. With 'flat' it connects to every
+	host itself. With 'tree' it only connects to the lowest ranked host
+	of each rack, which runs the command on the rest of its rack and
+	streams the results back. The hosts a relay can't reach are run
+	directly. The relays reach their racks with the ssh agent of the
+	caller forwarded to them, so root on a relay can use it for as
+	long as the command runs.
+	Default is 'flat'.
+	</param>
+
+	<param type='string' name='persist'>
+	Number of seconds to keep an idle ssh connection to a host open so
+	it is reused by the next command. Default is the "ssh.persist"
+	attribute, if it is unset connections are not shared.
+	</param>
+
 	<example cmd='run host backend-0-0 command="hostname"'>
 	Run the command 'hostname' on backend-0-0.
 	</example>
@@ -204,7 +106,7 @@ class Command(command):
 	def run(self, params, args):
 
 		# Parse Params
-		(cmd, managed, x11, t, d, collate, n, method) = self.fillParams([
+		(cmd, managed, x11, t, d, collate, n, collapse, fanout, persist, method) = self.fillParams([
 			('command', None, True),	# Command
 			('managed', 'y'),		# Run on Managed Hosts only
 			('x11', 'n'),			# Run without X11
@@ -212,6 +114,9 @@ class Command(command):
 			('delay', '0'),			# Set delay between each thread
 			('collate', 'y'),		# Collate output
 			('threads', self.getAttr('run.host.threads')),
+			('collapse', 'n'),		# Collapse identical output
+			('fanout', 'flat'),		# Connect to every host or through relays
+			('persist', self.getAttr('ssh.persist')),
 			('method', self.getAttr('run.host.impl'))
 			])
 		#  Check that a command was even input:
@@ -246,6 +151,16 @@ class Command(command):
 		except:	
 			raise ParamType(self, 'delay', 'float')
 
+		if fanout not in [ 'flat', 'tree' ]:
+			raise ParamValue(self, 'fanout', 'flat or tree')
+		self.fanout = fanout
+
+		# Share the ssh connection to each host for this long
+		try:
+			self.persist = int(persist or 0)
+		except ValueError:
+			raise ParamType(self, 'persist', 'integer')
+
 		# Check if we want to unset the Display
 		if not self.str2bool(x11):
 			try:
@@ -263,6 +178,9 @@ class Command(command):
 		# Check if we should collate the output
 		self.collate = self.str2bool(collate)
 
+		# Check if hosts with identical output are listed together
+		self.collapse = self.str2bool(collapse)
+
 		if self.collate:
 			self.beginOutput()
 
@@ -4,106 +4,254 @@
 # https://github.com/Teradata/stacki/blob/master/LICENSE.txt
 # @copyright@
 
+import asyncio
+import json
+import subprocess
+import sys
 import stack.commands
-import threading
-import time
-from stack.commands.run.host import Parallel
+import stack.ssh
+
 
 class Implementation(stack.commands.Implementation):
+	"""
+	Runs the command over ssh on all the hosts from a single
+	asyncio event loop, rather than a thread per host. At most
+	'threads' hosts are worked on at once, and without collation
+	the output of each host is printed as soon as it finishes.
 
-	#@warningLicenseCheck
-	def run(self, args):
-		# Command to run
-		cmd = self.owner.cmd
+	With fanout=tree the frontend only connects to one relay host
+	per rack (the lowest ranked one), which runs the command on the
+	rest of its rack and streams the results back.
+	"""
 
-		# Hosts to run the commands on
-		hosts = self.owner.run_hosts
+	async def probe(self, host):
+		"""
+		Check the machine is up and SSH is responding.
 
-		# Dictionary to store output
-		host_output = {}
+		This catches the case when the node is up, sshd is sitting
+		on port 22, but it is not responding (e.g., the node is
+		overloaded, sshd is hung, etc.)
 
-		# Control Collation
-		collate = self.owner.collate
+		The banner should be something like:
 
-		# Number of simultaneous threads allowed
-		numthreads = self.owner.numthreads
+			SSH-2.0-OpenSSH_4.3
+		"""
+		try:
+			reader, writer = await asyncio.wait_for(
+				asyncio.open_connection(host, 22), 2.0)
+		except (OSError, asyncio.TimeoutError):
+			return False
 
-		# Delay between starting threads.
-		delay = self.owner.delay
+		try:
+			await asyncio.wait_for(reader.read(64), 2.0)
+		except (OSError, asyncio.TimeoutError):
+			return False
+		finally:
+			writer.close()
 
-		# Timeout that controls when to terminate SSH
-		timeout = self.owner.timeout
+		return True
 
-		threads = []
+	async def execute(self, host, name):
+		"""
+		Runs the command on the remote host. STDERR is merged into
+		STDOUT as if this were the output of running the command on
+		the command line.
+		"""
 
+		if not await self.probe(name):
+			return (host, -1, 'down')
 
-		# If we haven't set the number of threads
-		# to run concurrently, don't check for
-		# running threads.
-		if numthreads == 0:
-			running_threads = -1
-		else:
-			running_threads = 0
-		work = len(hosts)
-		i = 0
-		while work:
-			# Run the first batch of threads
-			while running_threads < numthreads and i < len(hosts):
-				host = hosts[i]['host']
-				hostname = hosts[i]['name']
-
-				host_output[host] = {'output': None, 'retval': -1}
-				p = Parallel(cmd, hostname, host_output[host], timeout)
-				p.setDaemon(True)
-				p.start()
-				threads.append(p)	
-
-				# Increment number of running threads, only if
-				# there is a maximum number of allowed threads
-				if numthreads > 0:
-					running_threads += 1
-				i += 1	
-
-				if delay > 0:
-					time.sleep(delay)
-
-			# Collect completed threads
+		proc = await asyncio.create_subprocess_exec(
+			'ssh', *stack.ssh.options(self.owner.persist),
+			name, self.owner.cmd,
+			stdin=subprocess.DEVNULL,
+			stdout=subprocess.PIPE,
+			stderr=subprocess.STDOUT)
+
+		# Read the output while we wait, so whatever the command
+		# printed before a timeout is kept.
+
+		reader = asyncio.ensure_future(proc.stdout.read())
+		try:
+			if self.owner.timeout > 0:
+				await asyncio.wait_for(proc.wait(), self.owner.timeout)
+			else:
+				await proc.wait()
+		except asyncio.TimeoutError:
+			proc.terminate()
+			await proc.wait()
+
+		output = await reader
+		return (host, proc.returncode, output.decode(errors='replace').strip())
+
+	async def relay(self, semaphore, relay, hosts):
+		"""
+		Runs the command on a rack of hosts through a relay host,
+		returning a (host, retval, output) result for each of them.
+		The hosts the relay can't be reached for, or can't reach
+		itself, are run directly just like without fanout.
+		"""
+
+		results = []
+		async with semaphore:
+			if await self.probe(relay['name']):
+				(results, hosts) = await self.relayed(relay, hosts)
+
+		for o in await asyncio.gather(*[ self.limited(semaphore, self.streamed(h['host'], h['name']))
+						 for h in hosts ]):
+			results.extend(o)
+		return results
+
+	async def relayed(self, relay, hosts):
+		"""
+		Returns the results the relay reported and the hosts it
+		didn't get to.
+		"""
+
+		names = { h['name']: h['host'] for h in hosts }
+
+		cmd = stack.ssh.relayCommand(relay['name'], list(names), self.owner.cmd,
+					     timeout=self.owner.timeout,
+					     threads=self.owner.numthreads or 32,
+					     persist=self.owner.persist)
+
+		# Agent forwarding lets the relay use our keys for its rack
+		proc = await asyncio.create_subprocess_exec(
+			'ssh', '-T', '-x', '-A', *stack.ssh.options(self.owner.persist),
+			relay['name'], cmd,
+			stdin=subprocess.PIPE,
+			stdout=subprocess.PIPE,
+			stderr=subprocess.DEVNULL)
+		proc.stdin.write(stack.ssh.RELAY.encode())
+		proc.stdin.close()
+
+		results = []
+		while True:
+			line = await proc.stdout.readline()
+			if not line:
+				break
 			try:
-				active = threading.enumerate()
-
-				t = threads
-				for thread in threads:
-					if thread not in active:
-						thread.join(0.1)
-						threads.remove(thread)
-						# As threads exit, decrement the
-						# number of running threads.
-						running_threads -= 1
-						work -= 1
-
-				# If we're running fewer threads
-				# than maximum allowed, continue
-				# to create newer threads
-				if running_threads < numthreads:
-					continue
-
-				# If not, don't burn the CPU
-				time.sleep(0.5)
-
-
-			except KeyboardInterrupt:
-				work = 0
-
-		# Gather and print the output
-		for host in host_output:
-			if not collate:
-				if host_output[host]['output']:
-					print(str(host_output[host]['output']))
+				o = json.loads(line.decode())
+			except ValueError:
+				continue
+			# The relay couldn't ssh to the host, we may still
+			# be able to
+			if o['retval'] == 255 and o['output'] == 'down':
+				continue
+			result = (names[o['host']], o['retval'], o['output'])
+			results.append(result)
+			self.report([ result ], stream=True)
+		await proc.wait()
+
+		done = { r[0] for r in results }
+		return (results, [ h for h in hosts if h['host'] not in done ])
+
+	async def limited(self, semaphore, coro):
+		async with semaphore:
+			return await coro
+
+	def racks(self, hosts):
+		"""
+		Groups the hosts by rack, ordered by rank, so the first host
+		of each group is its relay.
+		"""
+
+		location = {}
+		for (name, rack, rank) in self.owner.db.select('name, rack, rank from nodes'):
+			location[name] = (rack, rank)
+
+		racks = {}
+		for h in hosts:
+			rack, rank = location.get(h['host'], (None, None))
+			racks.setdefault(rack, []).append((rank, h))
+
+		return [ [ h for rank, h in sorted(group, key=lambda x: (x[0] is None, x[0] or 0)) ]
+			 for group in racks.values() ]
+
+	async def runAll(self, hosts):
+		"""
+		Starts the command on every host (or relay), honoring the
+		delay between them, and returns the (host, retval, output)
+		results once they are all done.
+		"""
+
+		limit = self.owner.numthreads
+		if limit <= 0:
+			limit = max(len(hosts), 1)
+		semaphore = asyncio.Semaphore(limit)
+
+		tasks = []
+		if self.owner.fanout == 'tree':
+			for group in self.racks(hosts):
+				tasks.append(asyncio.ensure_future(
+					self.relay(semaphore, group[0], group)))
+				if self.owner.delay > 0:
+					await asyncio.sleep(self.owner.delay)
+		else:
+			for h in hosts:
+				tasks.append(asyncio.ensure_future(
+					self.limited(semaphore, self.streamed(h['host'], h['name']))))
+				if self.owner.delay > 0:
+					await asyncio.sleep(self.owner.delay)
+
+		results = []
+		for o in await asyncio.gather(*tasks):
+			results.extend(o)
+
+		return results
+
+	async def streamed(self, host, name):
+		result = await self.execute(host, name)
+		self.report([ result ], stream=True)
+		return [ result ]
+
+	def report(self, results, stream=False):
+		"""
+		Output the results. Without collation (and collapsing) each
+		host is printed as soon as it is done, otherwise the output
+		is added to the command output when all hosts are done.
+		"""
+
+		streaming = not self.owner.collate and not self.owner.collapse
+		if stream != streaming:
+			return
+
+		if self.owner.collapse:
+			# Group the hosts with identical output, keeping the
+			# order each distinct output was first seen in.
+			groups = {}
+			for (host, retval, output) in results:
+				groups.setdefault(output, []).append(host)
+			results = [ (','.join(hosts), None, output)
+				    for output, hosts in groups.items() ]
+
+		for (host, retval, output) in results:
+			if not self.owner.collate:
+				if output:
+					if self.owner.collapse:
+						print('%s:' % host)
+					print(output)
+					sys.stdout.flush()
 			else:
-				if isinstance((host_output[host]['output']), bytes):
-					out = (host_output[host]['output']).decode('utf').split('\n')
-				else:
-					out = (host_output[host]['output']).split('\n')
-				for line in out:
+				for line in output.split('\n'):
 					self.owner.addOutput(host, line)
 
+	def run(self, args):
+		hosts = self.owner.run_hosts
+
+		loop = asyncio.new_event_loop()
+		asyncio.set_event_loop(loop)
+		asyncio.get_child_watcher().attach_loop(loop)
+
+		try:
+			results = loop.run_until_complete(self.runAll(hosts))
+		except KeyboardInterrupt:
+			results = []
+		finally:
+			loop.close()
+
+		# Collated output stays in the host order
+		order = { h['host']: i for i, h in enumerate(hosts) }
+		results.sort(key=lambda r: order[r[0]])
+
+		self.report(results)
@@ -62,23 +62,20 @@ class Command(stack.commands.set.host.command):
 		if action not in ['os', 'install']:
 			raise ParamValue(self, 'action', 'one of: os, install')
 
-		# Get the mapping of hosts with boot actions and thier PK
-		hosts_with_boot = {row[0]: row[1] for row in self.db.select(
-			'nodes.name, nodes.id from nodes, boot where nodes.id=boot.node'
-		)}
-
-		for host in hosts:
-			if host in hosts_with_boot:
-				self.db.execute(
-					'update boot set action=%s where node=%s',
-					(action, hosts_with_boot[host])
-				)
-			else:
-				self.db.execute("""
-					insert into boot(action, node) values (
-						%s, (select id from nodes where name=%s)
-					)
-				""", (action, host))
+		# Set the action of all the hosts at once, inside the
+		# transaction of our caller if there is one (e.g. discovery)
+		with self.db.transaction():
+			self.db.execute("""
+				update boot b, nodes n set b.action=%s
+				where b.node=n.id and n.name in %s
+				""", (action, hosts))
+
+			self.db.execute("""
+				insert into boot(node, action)
+				select n.id, %s from nodes n
+				left join boot b on b.node=n.id
+				where n.name in %s and b.node is null
+				""", (action, hosts))
 
 		if nukedisks is not None:
 			args = hosts.copy()
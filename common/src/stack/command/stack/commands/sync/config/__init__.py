@@ -20,6 +20,12 @@ class Command(stack.commands.sync.command):
 	rebuild the configuration file by extracting data from the
 	database, then restart the relevant services.
 
+	<arg optional='1' type='string' name='host' repeat='1'>
+	Zero, one or more names of the hosts that changed (including hosts
+	that were just removed). Services that can be updated one host at a
+	time (e.g., DNS with the "dns.dynamic" attribute) only update these.
+	</arg>
+
 	<example cmd='sync config'>
 	Rebuild all configuration files and restart relevant services.
 	</example>
@@ -29,4 +35,4 @@ class Command(stack.commands.sync.command):
 
 		self.notify('Sync Config\n')
 
-		self.runPlugins()
+		self.runPlugins(args)
@@ -16,5 +16,5 @@ class Plugin(stack.commands.Plugin):
 		return 'dns'
 
 	def run(self, args):
-		self.owner.command('sync.dns', [])
+		self.owner.command('sync.dns', args)
 
@@ -7,7 +7,12 @@
 #
 #
 
+import hashlib
+import json
+import os
+import re
 import stack.commands
+import stack.omapi
 import subprocess
 
 
@@ -16,18 +21,167 @@ class Command(stack.commands.sync.command):
 	Rebuild the DHCPD configuration files on the frontend and restart the
 	DHCPD service
 
+	If the "dhcpd.omapi" attribute is true and only host sections of the
+	configuration changed since the last sync, the changed hosts are
+	updated in the running DHCPD through OMAPI rather than restarting it.
+
+	<param type='boolean' name='reconcile'>
+	If 'yes' (and OMAPI is in use), check every host in the running DHCPD
+	against the configuration file and fix the ones that differ. This is
+	meant to be run periodically (e.g., from cron).
+	Default is 'no'.
+	</param>
+
 	<example cmd='sync dhcpd'>
-	Rebuild the DHCPD configuration files on the frontend and restar
-t the
+	Rebuild the DHCPD configuration files on the frontend and restart the
 	DHCPD service
 	</example>
 	"""
 
+	STATE = '/var/lib/stack/dhcpd.json'
+
+	def parse(self):
+		"""
+		Splits the DHCPD configuration into a digest of everything
+		but the host sections and a dictionary of host name to
+		[ mac, ip, statements ] for the host sections.
+		"""
+
+		with open('/etc/dhcp/dhcpd.conf') as f:
+			conf = f.read()
+
+		hosts = {}
+		for (name, body) in re.findall(r'^host (\S+) \{\n(.*?)^\}\n', conf, re.M | re.S):
+			mac = ip = None
+			statements = []
+			for line in body.split('\n'):
+				line = line.strip()
+				if line.startswith('hardware ethernet'):
+					mac = line.split()[-1].rstrip(';')
+				elif line.startswith('fixed-address'):
+					ip = line.split()[-1].rstrip(';')
+				elif line:
+					statements.append(line)
+			hosts[name] = [ mac, ip, ' '.join(statements) ]
+
+		rest = re.sub(r'^host (\S+) \{\n(.*?)^\}\n', '', conf, flags=re.M | re.S)
+		if os.path.exists('/etc/sysconfig/dhcpd'):
+			with open('/etc/sysconfig/dhcpd') as f:
+				rest += f.read()
+
+		return hashlib.sha1(rest.encode()).hexdigest(), hosts
+
+	def loadState(self):
+		try:
+			with open(self.STATE) as f:
+				return json.load(f)
+		except (OSError, ValueError):
+			return None
+
+	def saveState(self, digest, hosts):
+		os.makedirs(os.path.dirname(self.STATE), exist_ok=True)
+		with open(self.STATE, 'w') as f:
+			json.dump({ 'digest': digest, 'hosts': hosts }, f)
+
+	def leasesFile(self):
+		if self.os == 'sles':
+			return '/var/lib/dhcp/db/dhcpd.leases'
+		return '/var/lib/dhcpd/dhcpd.leases'
+
+	def leasedHosts(self):
+		"""
+		Returns the names of the hosts DHCPD was given through OMAPI
+		and still has, going by its leases file.
+		"""
+
+		try:
+			with open(self.leasesFile()) as f:
+				text = f.read()
+		except OSError:
+			return set()
+
+		# Removing a host writes it again marked as deleted, the
+		# last entry for a name wins
+		hosts = {}
+		for (name, body) in re.findall(r'^host (\S+) \{\n(.*?)^\}\n', text, re.M | re.S):
+			hosts[name.strip('"')] = 'deleted;' not in body
+
+		return { name for name, present in hosts.items() if present }
+
+	def restart(self, omapi):
+		"""
+		Restarts DHCPD. With OMAPI the hosts it wrote to the leases
+		file are dropped first, the configuration file now has all of
+		them. The dhcpd unit does the same on every start (see
+		dhcp-server.xml) so a reboot doesn't bring back stale hosts.
+		"""
+
+		if not omapi:
+			subprocess.call(['/sbin/service', 'dhcpd', 'restart'],
+					stdout=open('/dev/null'), stderr=open('/dev/null'))
+			return
+
+		subprocess.call(['/sbin/service', 'dhcpd', 'stop'],
+				stdout=open('/dev/null'), stderr=open('/dev/null'))
+
+		stack.omapi.stripLeases(self.leasesFile())
+
+		subprocess.call(['/sbin/service', 'dhcpd', 'start'],
+				stdout=open('/dev/null'), stderr=open('/dev/null'))
+
+	def update(self, digest, hosts, reconcile):
+		"""
+		Pushes the host changes since the last sync to the running
+		DHCPD. Returns False if a restart is needed instead.
+		"""
+
+		state = self.loadState()
+		if not state or state['digest'] != digest:
+			return False
+
+		api = stack.omapi.OMAPI(stack.omapi.readKey())
+		try:
+			old = state['hosts']
+			if reconcile:
+				# Also look for the hosts removed from the
+				# configuration that DHCPD may still have
+				names = set(hosts) | set(old) | self.leasedHosts()
+				running = api.lookup(sorted(names))
+				old = { name: [ mac, ip, hosts[name][2] if name in hosts else None ]
+					for name, (mac, ip) in running.items() }
+
+			for name in old:
+				if name not in hosts:
+					api.remove(name)
+			for name, (mac, ip, statements) in hosts.items():
+				if old.get(name) != [ mac, ip, statements ]:
+					api.add(name, mac, ip, statements)
+			api.commit()
+		except stack.omapi.OMAPIError:
+			return False
+
+		return True
+
 	def run(self, params, args):
 
+		(reconcile, ) = self.fillParams([ ('reconcile', 'n') ])
+		reconcile = self.str2bool(reconcile)
+
 		self.notify('Sync DHCP\n')
 
+		omapi = self.str2bool(self.getAttr('dhcpd.omapi'))
+		if omapi:
+			stack.omapi.createKey()
+
 		self.report('report.dhcpd')
-		
-		subprocess.call(['/sbin/service', 'dhcpd', 'restart'],
-				stdout=open('/dev/null'), stderr=open('/dev/null'))
+
+		if not omapi:
+			self.restart(omapi)
+			if os.path.exists(self.STATE):
+				os.unlink(self.STATE)
+			return
+
+		(digest, hosts) = self.parse()
+		if not self.update(digest, hosts, reconcile):
+			self.restart(omapi)
+		self.saveState(digest, hosts)
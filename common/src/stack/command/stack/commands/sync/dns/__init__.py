@@ -11,21 +11,247 @@
 # @rocks@
 
 
-import stack.commands
+import ipaddress
+import json
+import os
 import subprocess
+import stack.commands
+import stack.commands.report
 
 
-class Command(stack.commands.sync.command):
+class Command(stack.commands.sync.command,
+	stack.commands.HostArgumentProcessor):
 	"""
-	Rebuild the DNS configuration files, then restart named.
+	Rebuild the DNS configuration files, then reload named.
+
+	<arg optional='1' type='string' name='host' repeat='1'>
+	Zero, one or more host names. If the "dns.dynamic" attribute is true
+	only the records of these hosts are updated in the running named
+	(with RFC 2136 dynamic updates) rather than rebuilding every zone.
+	Records the hosts had at the last sync but don't anymore (e.g., a
+	removed alias or host) are deleted.
+	</arg>
 
 	<example cmd='sync dns'>
-	Rebuild the DNS configuration files, then restart named.
+	Rebuild the DNS configuration files, then reload named.
+	</example>
+
+	<example cmd='sync dns backend-0-0'>
+	Update the records of backend-0-0 in named.
 	</example>
 	"""
 
+	TTL   = 259200 # same as the $TTL of the zone files
+	STATE = '/var/lib/stack/dns.json'
+
+	def lookup(self, names):
+		"""
+		Returns a dictionary of name to the set of addresses named
+		currently has for it.
+		"""
+
+		addresses = { name: set() for name in names }
+		if not names:
+			return addresses
+
+		p = subprocess.run(['dig', '@127.0.0.1', '+noall', '+answer', '-f', '-'],
+				   input='\n'.join('%s A' % name for name in names).encode(),
+				   stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+		for line in p.stdout.decode().split('\n'):
+			fields = line.split()
+			if len(fields) == 5 and fields[3] == 'A' and fields[0] in addresses:
+				addresses[fields[0]].add(fields[4])
+
+		return addresses
+
+	def loadState(self):
+		try:
+			with open(self.STATE) as f:
+				return json.load(f)
+		except (OSError, ValueError):
+			return None
+
+	def saveState(self, state):
+		os.makedirs(os.path.dirname(self.STATE), exist_ok=True)
+		with open(self.STATE, 'w') as f:
+			json.dump(state, f)
+
+	def records(self, hosts=None):
+		"""
+		Returns a dictionary of host name to the [ fqdn, zone, ip,
+		alias ] records of its interfaces, for every host if HOSTS
+		is None.
+		"""
+
+		zones = { network['zone'] for network in self.call('list.network', [ 'dns=true' ]) }
+
+		query = """
+			n.name, nt.ip, nt.name, s.zone, a.name
+			from networks nt
+			join nodes n on nt.node = n.id
+			join subnets s on nt.subnet = s.id
+			left join aliases a on a.network = nt.id
+			where nt.ip is not NULL
+			"""
+		if hosts is not None:
+			if not hosts:
+				return {}
+			query += ' and n.name in %s'
+		query += ' order by nt.id, a.id'
+
+		records = {}
+		for (host, ip, name, zone, alias) in self.db.select(query,
+				(hosts, ) if hosts is not None else None):
+			if zone in zones:
+				records.setdefault(host, []).append(
+					[ '%s.%s.' % (name or host, zone), zone, ip, alias ])
+
+		return records
+
+	def update(self, hosts):
+		"""
+		Sends the A, CNAME, and PTR records of the hosts to named
+		with nsupdate, and deletes the ones they had at the last sync
+		but don't anymore (removed hosts, interfaces, and aliases).
+		Returns False if that didn't work.
+		"""
+
+		state = self.loadState()
+		if state is None:
+			return False
+
+		reverses = []
+		for network in self.call('list.network', [ 'dns=true' ]):
+			sn = stack.commands.report.command.getSubnet(self,
+				network['address'], network['mask'])
+			sn.reverse()
+			reverses.append((ipaddress.IPv4Network('%s/%s' % (network['address'], network['mask'])),
+					 '.'.join(sn)))
+
+		def reverse(ip):
+			"""
+			Returns the reverse zone of an address and its PTR
+			name in that zone (the same way report zones names them).
+			"""
+			for (network, r_sn) in reverses:
+				if ipaddress.IPv4Address(ip) in network:
+					t_ip = ip.split('.')[len(r_sn.split('.')):]
+					t_ip.reverse()
+					zone = '%s.in-addr.arpa' % r_sn
+					return zone, '%s.%s.' % ('.'.join(t_ip), zone)
+			return None, None
+
+		new = self.records(hosts)
+		records = [ r for host in hosts for r in new.get(host, []) ]
+		fqdns   = { r[0] for r in records }
+		cnames  = { (r[3], r[1]) for r in records if r[3] }
+
+		script = [ 'server 127.0.0.1' ]
+
+		# Drop what is gone since the last sync
+		for host in hosts:
+			for (fqdn, domain, ip, alias) in state.get(host, []):
+				if alias and (alias, domain) not in cnames:
+					script.append('zone %s' % domain)
+					script.append('update delete %s.%s. CNAME' % (alias, domain))
+					script.append('send')
+				if fqdn not in fqdns:
+					script.append('zone %s' % domain)
+					script.append('update delete %s A' % fqdn)
+					script.append('send')
+					zone, ptr = reverse(ip)
+					if zone:
+						script.append('zone %s' % zone)
+						script.append('update delete %s PTR' % ptr)
+						script.append('send')
+
+		current = self.lookup(list(fqdns))
+
+		done = set()
+		for (fqdn, domain, ip, alias) in records:
+			if fqdn not in done:
+				done.add(fqdn)
+
+				# Drop the old PTRs of a name that moved
+				for old in current[fqdn] - { ip }:
+					zone, ptr = reverse(old)
+					if zone:
+						script.append('zone %s' % zone)
+						script.append('update delete %s PTR' % ptr)
+						script.append('send')
+
+				script.append('zone %s' % domain)
+				script.append('update delete %s A' % fqdn)
+				script.append('update add %s %d A %s' % (fqdn, self.TTL, ip))
+				script.append('send')
+
+				zone, ptr = reverse(ip)
+				if zone:
+					script.append('zone %s' % zone)
+					script.append('update delete %s PTR' % ptr)
+					script.append('update add %s %d PTR %s' % (ptr, self.TTL, fqdn))
+					script.append('send')
+
+			if alias:
+				cname = '%s.%s.' % (alias, domain)
+				script.append('zone %s' % domain)
+				script.append('update delete %s CNAME' % cname)
+				script.append('update add %s %d CNAME %s' % (cname, self.TTL, fqdn))
+				script.append('send')
+
+		p = subprocess.run(['nsupdate', '-k', '/etc/rndc.key'],
+				   input='\n'.join(script + [ '' ]).encode(),
+				   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+		if p.returncode != 0:
+			return False
+
+		for host in hosts:
+			state.pop(host, None)
+		state.update(new)
+		self.saveState(state)
+
+		return True
+
 	def run(self, params, args):
 
 		self.notify('Sync DNS\n')
+
+		dynamic = self.str2bool(self.getAttr('dns.dynamic'))
+
+		if dynamic and args:
+			# Hosts that were just removed are no longer in the
+			# database, named still has their records
+			state = self.loadState() or {}
+			hosts = [ arg for arg in args if arg in state ]
+			others = [ arg for arg in args if arg not in state ]
+			if others:
+				hosts.extend(self.getHostnames(others))
+			if self.update(hosts):
+				return
+
+		# Dynamic zones have to be frozen while the zone files are
+		# rewritten, thawing them loads the new files.
+
+		if dynamic:
+			subprocess.call(['rndc', 'freeze'],
+					stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
 		self.runPlugins()
-		subprocess.call(['systemctl','restart','named'])
+
+		if dynamic:
+			subprocess.call(['rndc', 'thaw'],
+					stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+		# Only zones whose files changed are loaded again by a
+		# reload, named keeps answering for the rest.
+
+		if subprocess.call(['rndc', 'reload'],
+				   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL) != 0:
+			subprocess.call(['systemctl', 'restart', 'named'])
+
+		# What named has now, for the next incremental update
+
+		if dynamic:
+			self.saveState(self.records())
+		elif os.path.exists(self.STATE):
+			os.unlink(self.STATE)
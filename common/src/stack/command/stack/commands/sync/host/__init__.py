@@ -13,8 +13,10 @@
 import stack.commands
 import threading
 import subprocess
+import signal
 import time
 import os
+from concurrent.futures import ThreadPoolExecutor
 
 max_threading = 512
 timeout	= 30
@@ -22,38 +24,42 @@ timeout	= 30
 
 class command(stack.commands.sync.command,
 	stack.commands.HostArgumentProcessor):
-	def getRunHosts(self, hosts):
-		self.mgmt_networks = {}
-		run_hosts = []
-		self.attrs = self.call('list.host.attr',hosts)
-		f = lambda x: x['attr'] == 'stack.network'
-		network_attrs = list(filter(f, self.attrs))
-
-		self.mgmt_networks = {}
-		for host in hosts:
-			g = lambda x: x['host'] == host
-			s = list(filter(g, network_attrs))
-			if len(s):
-				network = s[0]['value']
-				if network not in self.mgmt_networks:
-					self.mgmt_networks[network] = []
-				self.mgmt_networks[network].append(host)
-
-		a = []
-		b = []
-		for net in self.mgmt_networks:
-			h = self.mgmt_networks[net]
-			a.extend(h)
-			b.extend(self.getHostnames(h, subnet=net))
-
-		for host in hosts:
-			if host in a:
-				idx = a.index(host)
-				run_hosts.append({'host':host, 'name':b[idx]})
-			else:
-				run_hosts.append({'host':host, 'name':host})
-
-		return run_hosts
+
+	def runParallel(self, cmds, threads=64):
+		"""
+		Runs a shell command for each host from a pool of at most
+		'threads' workers, rather than a thread per host.
+
+		CMDS is a dictionary of host to (cmd, stdin) tuples, stdin
+		may be None. Returns a dictionary of host to the same
+		output, error, and rc dictionary Parallel fills in. A command
+		still running after the timeout is killed and its rc is None.
+		"""
+
+		def run(cmd, stdin):
+			p = subprocess.Popen(cmd,
+				stdin=subprocess.PIPE if stdin else subprocess.DEVNULL,
+				stdout=subprocess.PIPE,
+				stderr=subprocess.STDOUT,
+				shell=True,
+				start_new_session=True)
+			try:
+				(o, e) = p.communicate(stdin.encode() if stdin else None,
+						       timeout=timeout)
+				rc = p.returncode
+			except subprocess.TimeoutExpired:
+				os.killpg(p.pid, signal.SIGKILL)
+				(o, e) = p.communicate()
+				rc = None
+
+			return {"output": o.decode(errors='replace') if o else "",
+				"error": "", "rc": rc}
+
+		with ThreadPoolExecutor(max_workers=max(threads, 1)) as pool:
+			futures = { host: pool.submit(run, cmd, stdin)
+				    for host, (cmd, stdin) in cmds.items() }
+
+		return { host: future.result() for host, future in futures.items() }
 
 
 class Parallel(threading.Thread):
@@ -8,6 +8,7 @@
 
 import sys
 import stack.commands
+import stack.ssh
 from stack.commands.sync.host import Parallel
 from stack.commands.sync.host import timeout
 
@@ -56,6 +57,7 @@ class Command(stack.commands.sync.host.command):
 
 		hosts = self.getHostnames(args, managed_only=0)
 		run_hosts = self.getRunHosts(hosts)
+		ssh_options = stack.ssh.optionString(self.getAttr('ssh.persist'))
 		me    = self.db.getHostname('localhost')
 
 		# Only shutdown stdout/stderr if we not local
@@ -89,7 +91,7 @@ class Command(stack.commands.sync.host.command):
 			cmd += '/opt/stack/bin/stack report script | '
 
 			if me != host:
-				cmd += 'ssh -T -x %s ' % hostname
+				cmd += 'ssh -T -x %s %s ' % (ssh_options, hostname)
 			cmd += 'bash > /dev/null 2>&1 '
 
 			try:
@@ -4,14 +4,24 @@
 # https://github.com/Teradata/stacki/blob/master/LICENSE.txt
 # @copyright@
 
+import os
+import re
+import shutil
 import stack.commands
 
 
+# The boot files come out of 'report host bootfile' as <stack:file>
+# sections holding the contents in a CDATA block.
+
+file_pattern = re.compile(r'<stack:file\s+(.*?)>\s*<!\[CDATA\[(.*?)\]\]>\s*</stack:file>', re.S)
+attr_pattern = re.compile(r'stack:(\w+)="([^"]*)"')
+
+
 class Command(stack.commands.sync.host.command):
 	"""
 	You'll rarely have to use this command.
 
-	It usually gets run as part of the 
+	It usually gets run as part of the
 	"stack set host boot" command.
 
 	Recreates the /tftpboot/pxelinux/pxelinux.cfg/
@@ -23,14 +33,106 @@ class Command(stack.commands.sync.host.command):
 	If the "stack set host boot &lt;nodes&gt; action=os"
 	backends install from local disk.
 
-	<example cmd='sync host bootfile'> 
+	Only the boot files whose contents changed are written.
+
+	<param type='string' name='root' optional='1'>
+	Directory the boot files are written under. Default: /
+	</param>
+
+	<example cmd='sync host bootfile'>
 	Rebuild all tftpboot files for backend nodes.
 	</example>
 	"""
+
+	def files(self, hosts):
+		"""
+		Returns a list of (filename, owner, perms, contents) for
+		the boot files of the hosts.
+		"""
+
+		text = '\n'.join(row['col-1'] for row in
+				 self.call('report.host.bootfile', hosts))
+
+		files = []
+		for (attrs, contents) in file_pattern.findall(text):
+			attrs = dict(attr_pattern.findall(attrs))
+
+			# Same contents the here document of the report
+			# script would have written
+			if contents.startswith('\n'):
+				contents = contents[1:]
+			if contents and not contents.endswith('\n'):
+				contents += '\n'
+
+			files.append((attrs['name'], attrs.get('owner'),
+				      attrs.get('perms'), contents))
+
+		return files
+
+	def write(self, filename, owner, perms, contents):
+		"""
+		Writes the file unless it already has the contents. Returns
+		True if the file was written.
+		"""
+
+		try:
+			with open(filename) as f:
+				if f.read() == contents:
+					return False
+		except (FileNotFoundError, UnicodeDecodeError):
+			pass
+
+		dirname = os.path.dirname(filename)
+		os.makedirs(dirname, exist_ok=True)
+
+		# Replace the file in one step so a host booting right
+		# now never sees half of it. That needs to be able to
+		# write the directory, otherwise (e.g. run as apache on a
+		# frontend installed before the UEFI directory was group
+		# writable) the file is written in place.
+		if not os.access(dirname, os.W_OK):
+			with open(filename, 'w') as f:
+				f.write(contents)
+			if perms:
+				try:
+					os.chmod(filename, int(perms, 8))
+				except PermissionError:
+					pass
+			return True
+
+		tmp = '%s.%d' % (filename, os.getpid())
+		with open(tmp, 'w') as f:
+			f.write(contents)
+		if owner:
+			user, _, group = owner.partition(':')
+			try:
+				shutil.chown(tmp, user or None, group or None)
+			except (LookupError, PermissionError):
+				# e.g. run as apache by the install complete
+				# endpoint
+				pass
+		if perms:
+			os.chmod(tmp, int(perms, 8))
+		os.rename(tmp, filename)
+
+		return True
+
 	def run(self, params, args):
 
+		(root, ) = self.fillParams([
+			('root', os.sep)
+		])
+
 		self.notify('Sync Host Boot\n')
 
-		argv = self.getHostnames(args, managed_only=True)
-		argv.append('notify=true')
-		self.report('report.host.bootfile', argv)
+		hosts = self.getHostnames(args, managed_only=True)
+		if not hosts:
+			return
+
+		changed = 0
+		for (filename, owner, perms, contents) in self.files(hosts):
+			filename = os.path.join(root, filename.lstrip(os.sep))
+			if self.write(filename, owner, perms, contents):
+				changed += 1
+
+		self.notify('Wrote %d boot files\n' % changed)
@@ -11,6 +11,7 @@
 # @rocks@
 
 import stack.commands
+import stack.ssh
 from stack.commands.sync.host import Parallel
 from stack.commands.sync.host import timeout
 
@@ -36,6 +37,7 @@ class Command(stack.commands.sync.host.command):
 
 		hosts = self.getHostnames(args, managed_only=1)
 		run_hosts = self.getRunHosts(hosts)
+		ssh_options = stack.ssh.optionString(self.getAttr('ssh.persist'))
 
 		me = self.db.getHostname('localhost')
 
@@ -44,16 +46,10 @@ class Command(stack.commands.sync.host.command):
 		host_output = {}
 
 		
-		ha = self.call('list.host.attr', hosts)
-		g = lambda x: (x['attr'], x['value'])
-		
-		host_attrs = {}
-		for host in hosts:
-			if host not in host_attrs:
-				host_attrs[host] = {}
-			f = lambda x : x['host'] == host
-			tmp_f = list(filter(f, ha))
-			host_attrs[host] = dict(list(map(g, tmp_f)))
+		host_attrs = { host: {} for host in hosts }
+		for row in self.call('list.host.attr', hosts):
+			if row['host'] in host_attrs:
+				host_attrs[row['host']][row['attr']] = row['value']
 
 		for h in run_hosts:
 			host = h['host']
@@ -70,7 +66,7 @@ class Command(stack.commands.sync.host.command):
 			cmd += '/opt/stack/bin/stack report script '
 			cmd += 'attrs="%s" | ' % attrs
 			if me != host:
-				cmd += 'ssh -T -x %s ' % hostname
+				cmd += 'ssh -T -x %s %s ' % (ssh_options, hostname)
 			cmd += 'bash > /dev/null 2>&1 '
 
 			p = Parallel(cmd, host_output[host])
@@ -102,7 +98,7 @@ class Command(stack.commands.sync.host.command):
 						cmd = 'systemctl restart stacki-iptables'
 
 				if me != host:
-					cmd = 'ssh -T -x %s "%s"' % (hostname, cmd)
+					cmd = 'ssh -T -x %s %s "%s"' % (ssh_options, hostname, cmd)
 				host_output[host] = {"output": "", "error": "", "rc": 0}
 				p = Parallel(cmd, host_output[host])
 				threads.append(p)
@@ -11,12 +11,11 @@
 # @rocks@
 
 import os
+import re
 import stack.commands
-import tempfile
+import stack.ssh
 import subprocess
-import io
-from stack.commands.sync.host import Parallel
-from stack.commands.sync.host import timeout
+from stack.exception import ParamType, ParamValue
 
 
 class Command(stack.commands.sync.host.command):
@@ -29,6 +28,12 @@ class Command(stack.commands.sync.host.command):
 	The default is: yes.
 	</param>
 
+	<param type='string' name='threads'>
+	The maximum number of hosts to push the configuration to at once.
+	The default is the "sync.host.threads" attribute, or 64 if it is
+	not set.
+	</param>
+
 	<example cmd='sync host network backend-0-0'>
 	Reconfigure and restart the network on backend-0-0.
 	</example>
@@ -61,51 +66,122 @@ class Command(stack.commands.sync.host.command):
 					os.remove(filename)
 
 
+	def template(self, text, values):
+		"""
+		Replaces every occurrence of the host specific values (its
+		name, addresses, etc.) in the text with a placeholder, so
+		hosts whose configuration only differs by those values end
+		up with the same template. The markup itself is left alone.
+		"""
+
+		index = {}
+		for value in values:
+			if value and value not in index:
+				index[value] = len(index)
+
+		if not index:
+			return text
+
+		pattern = re.compile('|'.join(re.escape(v) for v in
+			sorted(index, key=len, reverse=True)))
+
+		parts = re.split(r'(<[^>]*>)', text)
+		for i in range(0, len(parts), 2):
+			parts[i] = pattern.sub(lambda m: '@STACKVAR%d@' % index[m.group(0)], parts[i])
+
+		return ''.join(parts)
+
+	def render(self, script, values):
+		"""
+		Puts the host specific values back into a rendered template.
+		"""
+
+		index = []
+		for value in values:
+			if value and value not in index:
+				index.append(value)
+
+		return re.sub(r'@STACKVAR(\d+)@', lambda m: index[int(m.group(1))], script)
+
+	def generate(self, hosts):
+		"""
+		Returns a dictionary of host to the shell script that writes
+		its network configuration.
+
+		The reports are run once for all of the hosts rather than once
+		per host. Only one script is made for each distinct template
+		(most of the hosts in a rack only differ by their addresses),
+		it is then filled in for each of the hosts sharing it.
+		"""
+
+		reports = { host: '' for host in hosts }
+		for report in [ 'report.host.interface',
+				'report.host.network',
+				'report.host.route' ]:
+			for row in self.call(report, hosts):
+				if row['col-0'] in reports:
+					reports[row['col-0']] += '%s\n' % row['col-1']
+
+		values = { host: [ host ] for host in hosts }
+		for row in self.call('list.host.interface', hosts):
+			if row['host'] in values:
+				values[row['host']].extend([ row['ip'], row['mac'] ])
+
+		templates = {}
+		for host in hosts:
+			t = self.template(reports[host], values[host])
+			templates.setdefault(t, []).append(host)
+
+		scripts = {}
+		for t, members in templates.items():
+			p = subprocess.Popen(['/opt/stack/bin/stack', 'report', 'script'],
+				stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+			o, e = p.communicate(input=t.encode())
+			for host in members:
+				scripts[host] = self.render(o.decode(), values[host])
+
+		return scripts
+
 	def run(self, params, args):
-		restart, = self.fillParams([ ('restart', 'yes') ])
+		restart, threads = self.fillParams([
+			('restart', 'yes'),
+			('threads', self.getAttr('sync.host.threads'))
+			])
 
 		restartit = self.str2bool(restart)
 
+		try:
+			threads = int(threads or 64)
+		except ValueError:
+			raise ParamType(self, 'threads', 'integer')
+		if threads < 1:
+			raise ParamValue(self, 'threads', '> 0')
+
 		hosts = self.getHostnames(args, managed_only=1)
 		run_hosts = self.getRunHosts(hosts)
+		ssh_options = stack.ssh.optionString(self.getAttr('ssh.persist'))
 
 		me = self.db.getHostname('localhost')
 
-		threads = []
+		if hosts:
+			scripts = self.generate(hosts)
+		else:
+			scripts = {}
 
+		cmds = {}
 		for h in run_hosts:
 			host = h['host']
 			hostname = h['name']
 
 			if host == me:
 				self.cleanup()
+				cmd = 'bash > /dev/null 2>&1'
+			else:
+				cmd = 'ssh -T -x %s %s bash > /dev/null 2>&1' % (ssh_options, hostname)
 
-			# Sometimes these return None, in that case, make them an empty string
-			c = str(self.command('report.host.interface',[host]) or '') + \
-				str(self.command('report.host.network',[host]) or '') + \
-				str(self.command('report.host.route',[host]) or '')
+			cmds[host] = (cmd, scripts[host])
 
-			s = subprocess.Popen(['/opt/stack/bin/stack','report','script'],
-				stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-			o, e = s.communicate(input=c.encode())
-			
-			cmd = '( /opt/stack/bin/stack report host interface %s && ' % host
-			cmd += '/opt/stack/bin/stack report host network %s && ' % host
-			cmd += '/opt/stack/bin/stack report host route %s ) | ' % host
-			cmd += '/opt/stack/bin/stack report script | '
-			if host != me:
-				cmd += 'ssh -T -x %s ' % hostname
-			cmd += 'bash > /dev/null 2>&1'
-
-			p = Parallel(cmd, stdin=o.decode())
-			threads.append(p)
-			p.start()
-
-		#
-		# collect the threads
-		#
-		for thread in threads:
-			thread.join(timeout)
+		results = self.runParallel(cmds, threads)
 
 		self.command('sync.host.firewall',
 			[ 'restart=%s' % restart ] + hosts)
@@ -117,7 +193,7 @@ class Command(stack.commands.sync.host.command):
 			# after all the configuration files have been rewritten,
 			# restart the network
 			#
-			threads = []
+			cmds = {}
 			for h in run_hosts:
 				host = h['host']
 				hostname = h['name']
@@ -126,17 +202,11 @@ class Command(stack.commands.sync.host.command):
 				cmd += '/sbin/service ipmi restart > '
 				cmd += '/dev/null 2>&1'
 				if host != me:
-					cmd = 'ssh %s "%s"' % (hostname, cmd)
+					cmd = 'ssh %s %s "%s"' % (ssh_options, hostname, cmd)
 
-				p = Parallel(cmd)
-				threads.append(p)
-				p.start()
+				cmds[host] = (cmd, None)
 
-			#
-			# collect the threads
-			#
-			for thread in threads:
-				thread.join(timeout)
+			self.runParallel(cmds, threads)
 
 		#
 		# if IP addresses change, we'll need to sync the config (e.g.,
@@ -150,3 +220,17 @@ class Command(stack.commands.sync.host.command):
 		if me in hosts and os.path.exists('/etc/ganglia/gmond.conf'):
 			os.system('service gmond restart > /dev/null 2>&1')
 
+		#
+		# list how the configuration push went for each host
+		#
+		self.beginOutput()
+		for host in hosts:
+			rc = results[host]['rc']
+			if rc == 0:
+				status = 'ok'
+			elif rc is None:
+				status = 'timeout'
+			else:
+				status = 'failed (%d)' % rc
+			self.addOutput(host, status)
+		self.endOutput(header=['host', 'status'], trimOwner=False)
@@ -44,6 +44,10 @@ class Command(stack.commands.enable.command):
 	Set to False to prevent installing OS to discovered nodes. Defaults to True.
 	</param>
 
+	<param type='string' name='socket' optional='1'>
+	Path of a UNIX datagram socket to receive the DHCP server's syslog messages on, instead of following /var/log/messages. Syslog needs to be configured to send to it (e.g. the rsyslog omuxsock module).
+	</param>
+
 	<param type='boolean' name='debug' optional='1'>
 	Add more verbose output into the discovery log file. Defaults to False.
 	</param>
@@ -57,7 +61,7 @@ class Command(stack.commands.enable.command):
 	"""		
 
 	def run(self, params, args):
-		(appliance, base_name, rack, rank, box, install_action, install, debug) = self.fillParams([
+		(appliance, base_name, rack, rank, box, install_action, install, socket_path, debug) = self.fillParams([
 			("appliance", None),
 			("basename", None),
 			("rack", None),
@@ -65,6 +69,7 @@ class Command(stack.commands.enable.command):
 			("box", None),
 			("installaction", None),
 			("install", True),
+			("socket", None),
 			("debug", False)
 		])
 		install = self.str2bool(install)
@@ -85,7 +90,8 @@ class Command(stack.commands.enable.command):
 				rank=rank,
 				box=box,
 				install_action=install_action,
-				install=install
+				install=install,
+				socket_path=socket_path
 			)
 			
 			# Wait up to a few seconds for the daemon to start
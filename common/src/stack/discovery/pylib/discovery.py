@@ -6,7 +6,6 @@
 
 import asyncio
 import ipaddress
-from itertools import filterfalse
 import json
 import logging
 from logging.handlers import RotatingFileHandler
@@ -16,13 +15,67 @@ import signal
 import socket
 import subprocess
 import sys
+import time
+
+import pymysql
 
 from stack.api.get import GetAttr
 from stack.commands import Command
 from stack.exception import CommandError
+from stack.logtail import LogTailer, SyslogSocket
 import stack.mq
 
 
+class IPPool:
+    """
+    Bitmap of the allocated IP addresses in a network, with a cursor to the lowest
+    address that might be free. Handing out addresses in order makes allocation
+    amortized O(1) instead of a database scan per candidate address.
+    """
+
+    def __init__(self, ipv4_network, allocated=()):
+        self._network = ipv4_network
+        self._base = int(ipv4_network.network_address)
+        self._bitmap = bytearray(ipv4_network.num_addresses)
+        self._cursor = 0
+
+        # The network and broadcast addresses are never handed out
+        if ipv4_network.num_addresses > 2:
+            self._bitmap[0] = 1
+            self._bitmap[-1] = 1
+
+        for ip_address in allocated:
+            self.allocate(ip_address)
+
+    def allocate(self, ip_address):
+        "Mark an IP address as taken, addresses outside of the network are ignored."
+
+        offset = int(ip_address) - self._base
+        if 0 <= offset < len(self._bitmap):
+            self._bitmap[offset] = 1
+
+    def next(self):
+        "Return the lowest free IP address without allocating it, or None if the network is full."
+
+        # Skip ahead past the taken addresses, the cursor only ever moves forward
+        # until the pool is rebuilt
+        offset = self._bitmap.find(0, self._cursor)
+        if offset == -1:
+            self._cursor = len(self._bitmap)
+            return None
+
+        self._cursor = offset
+        return ipaddress.IPv4Address(self._base + offset)
+
+    def release(self, ip_address):
+        "Mark an IP address as free again."
+
+        offset = int(ip_address) - self._base
+        if 0 < offset < len(self._bitmap) - 1:
+            self._bitmap[offset] = 0
+            self._cursor = min(self._cursor, offset)
+
+
 class Discovery:
     """
     Start or stop a daemon that listens for PXE boots and inserts the new
@@ -32,12 +85,17 @@ class Discovery:
     _PIDFILE = "/var/run/stack-discovery.pid"
     _LOGFILE = "/var/log/stack-discovery.log"
 
-    _get_next_ip_address_cache = {}
+    # Seconds to wait for more nodes before committing a batch
+    _BATCH_WINDOW = 2
+
+    # Seconds between checks for changes others made to the host interfaces,
+    # the addresses of a batch are checked again before it is added anyway
+    _WATERMARK_INTERVAL = 5
+
     _get_ipv4_network_for_interface_cache = {}
 
-    @property
-    def hostname(self):
-        return f"{self._base_name}-{self._rack}-{self._rank}"
+    def _get_hostname(self, rank):
+        return f"{self._base_name}-{self._rack}-{rank}"
 
     def _get_ipv4_network_for_interface(self, interface):
         """
@@ -68,12 +126,119 @@ class Discovery:
         
         return ipv4_network        
 
-    def _get_hosts_for_interface(self, interface):
+    def _get_watermark(self):
+        """
+        Return a cheap fingerprint of the host interfaces table, it changes whenever an
+        interface is added, removed or has its address changed by something other than
+        this daemon.
+        """
+
+        self._command.db.clearCache()
+        for row in self._command.db.select("""
+            count(id), max(id),
+            bit_xor(crc32(concat_ws(',', id, ip, mac, device, subnet)))
+            from networks
+        """):
+            return tuple(row)
+
+        return None
+
+    def _load_index(self):
+        """
+        Load the index of known MAC addresses and allocated IP addresses from the database.
+        The per network IP pools are rebuilt from this index the next time they are needed.
+        """
+
+        self._known_macs = set()
+        self._allocated_ips = set()
+
+        self._command.db.clearCache()
+        for mac, ip, device in self._command.db.select("mac, ip, device from networks"):
+            if mac:
+                self._known_macs.add(mac)
+
+            # IP addresses on vlan interfaces don't count as taken
+            if ip and not (device and device.startswith("vlan")):
+                try:
+                    self._allocated_ips.add(ipaddress.IPv4Address(ip))
+                except ValueError:
+                    pass
+
+        # Nodes waiting to be committed are not in the database yet
+        for node in self._pending:
+            self._known_macs.add(node['mac_address'])
+            self._allocated_ips.add(node['ip_address'])
+
+        self._ip_pools = {}
+        self._watermark = self._get_watermark()
+        self._watermark_checked = time.monotonic()
+
+        self._logger.debug(
+            "loaded %d MAC addresses and %d IP addresses",
+            len(self._known_macs), len(self._allocated_ips)
+        )
+
+    def _refresh_index(self):
+        "Reload the index if the host interfaces changed since it was loaded."
+
+        if time.monotonic() - self._watermark_checked < self._WATERMARK_INTERVAL:
+            return
+
+        self._watermark_checked = time.monotonic()
+        if self._get_watermark() != self._watermark:
+            self._load_index()
+
+    def _release(self, node, ip_address=True):
+        """
+        Give back what a node that couldn't be added was holding: its MAC address so its
+        next DHCP request tries again, its rank for the next node, and its IP address
+        unless somebody else has it.
+        """
+
+        self._known_macs.discard(node['mac_address'])
+        self._free_ranks.add(node['rank'])
+
+        if ip_address:
+            self._allocated_ips.discard(node['ip_address'])
+            pool = self._ip_pools.get(node['interface'])
+            if pool is not None:
+                pool.release(node['ip_address'])
+
+    def _update_index(self, interface, mac_address, ip_address):
+        "Record a host interface the daemon is about to add."
+
+        self._known_macs.add(mac_address)
+        self._allocated_ips.add(ip_address)
+
+        pool = self._ip_pools.get(interface)
+        if pool is not None:
+            pool.allocate(ip_address)
+
+    def _update_watermark(self, count):
+        """
+        Move the watermark past the interfaces the daemon just added. If anything else
+        changed the interfaces at the same time we have to pick that up too.
         """
-        Get a iterator of IPv4Address objects for this interface, if it exists in the database
+
+        watermark = self._get_watermark()
+        if (
+            self._watermark is not None and watermark is not None and
+            watermark[0] == self._watermark[0] + count
+        ):
+            self._watermark = watermark
+        else:
+            self._load_index()
+
+    def _get_ip_pool(self, interface):
+        """
+        Get the IP pool for the network of this interface, if it exists in the database
         and is pxe bootable. If it isn't a valid interface, return None.
         """
 
+        pool = self._ip_pools.get(interface)
+        if pool is not None:
+            return pool
+
         # Get an IPv4Network for this interface passed in
         ipv4_network = self._get_ipv4_network_for_interface(interface)
         
@@ -86,9 +251,14 @@ class Discovery:
                     row['mask'] == str(ipv4_network.netmask)
                 ):
                     if row['pxe'] == True:
+                        pool = IPPool(ipv4_network, self._allocated_ips)
+
                         # Make sure to filter out the gateway IP address
-                        gateway = ipaddress.IPv4Address(row['gateway'])
-                        return filterfalse(lambda x: x == gateway, ipv4_network.hosts())
+                        if row['gateway']:
+                            pool.allocate(ipaddress.IPv4Address(row['gateway']))
+
+                        self._ip_pools[interface] = pool
+                        return pool
                     else:
                         self._logger.warning("pxe not enabled on interface: %s", interface)
                     break
@@ -104,39 +274,20 @@ class Discovery:
         Return None if we are out of IP addresses or if the interface is not valid.
         """
 
-        # See if we need to get the hosts() iterator for this interface
-        if interface not in self._get_next_ip_address_cache:
-            # Get the hosts iterator for this interface, return None if it isn't valid
-            hosts = self._get_hosts_for_interface(interface)
-            if hosts is None:
-                return None
+        # Get the pool for this interface, return None if it isn't valid
+        pool = self._get_ip_pool(interface)
+        if pool is None:
+            return None
 
-            self._get_next_ip_address_cache[interface] = hosts
+        ip_address = pool.next()
+        if ip_address is not None:
+            self._logger.debug("IP address is free: %s", ip_address)
 
-        # Find the next available IP address
-        for ip_address in self._get_next_ip_address_cache[interface]:
-            self._logger.debug("trying IP address: %s", ip_address)
-            
-            # Make sure this IP isn't already taken
-            self._command.db.clearCache()
-            for row in self._command.call("list.host.interface"):
-                if (
-                    row['ip'] == str(ip_address) and
-                    not row['interface'].startswith("vlan")
-                ):
-                    self._logger.debug("IP address already taken: %s", ip_address)
-                    break
-            else:
-                # Looks like it is free
-                self._logger.debug("IP address is free: %s", ip_address)
-                return ip_address
-        
-        # No IP addresses left
-        return None
+        return ip_address
+
+    def _get_network_for_interface(self, interface):
+        "Return the name of the stacki network for an interface, or None if there isn't one."
 
-    def _add_node(self, interface, mac_address, ip_address):
-        # Figure out the network for this interface
-        network = None
         ipv4_network = self._get_ipv4_network_for_interface(interface)
         if ipv4_network is not None:
             self._command.db.clearCache()
@@ -145,133 +296,175 @@ class Discovery:
                     row['address'] == str(ipv4_network.network_address) and 
                     row['mask'] == str(ipv4_network.netmask)
                 ):
-                    network = row['network']
-                    break
-        
+                    return row['network']
+
+        return None
+
+    def _add_nodes(self, nodes):
+        """
+        Add a batch of nodes to the database in a single transaction, running the stack
+        commands in this process. If anything fails the whole batch is rolled back and the
+        nodes are retried one at a time, so one bad node can't hold up the others.
+        Returns the list of nodes that were added.
+        """
+
+        networks = {}
+        for node in nodes:
+            interface = node['interface']
+            if interface not in networks:
+                networks[interface] = self._get_network_for_interface(interface)
+
         # The network should alway be able to be found, unless something deleted it since the 
         # discovery daemon started running
-        if network is not None:
-            # Add our new node
-            result = subprocess.run([
-                "/opt/stack/bin/stack",
-                "add",
-                "host",
-                self.hostname,
-                f"appliance={self._appliance_name}",
-                f"rack={self._rack}",
-                f"rank={self._rank}",
-                f"box={self._box}"
-            ], stdout=subprocess.PIPE, stderr=subprocess.PIPE, encoding="utf-8")
-            
-            if result.returncode != 0:
-                self._logger.error("failed to add host %s:\n%s", self.hostname, result.stderr)
-                return
+        for node in [node for node in nodes if networks[node['interface']] is None]:
+            self._logger.error("no network exists for interface %s", node['interface'])
+            self._release(node)
+            nodes.remove(node)
 
-            # Add the node's interface
-            result = subprocess.run([
-                "/opt/stack/bin/stack",
-                "add",
-                "host",
-                "interface",
-                self.hostname,
-                "interface=NULL",
-                "default=true",
-                f"mac={mac_address}",
-                f"name={self.hostname}",
-                f"ip={ip_address}",
-                f"network={network}"
-            ], stdout=subprocess.PIPE, stderr=subprocess.PIPE, encoding="utf-8")
-            
-            if result.returncode != 0:
-                self._logger.error("failed to add interface for host %s:\n%s", self.hostname, result.stderr)
-                return
-            
-            # Set the new node's install action
-            result = subprocess.run([
-                "/opt/stack/bin/stack",
-                "set",
-                "host",
-                "bootaction",
-                self.hostname,
-				"type=install",
-				"sync=false",
-                f"action={self._install_action}"
-            ], stdout=subprocess.PIPE, stderr=subprocess.PIPE, encoding="utf-8")
-            
-            if result.returncode != 0:
-                self._logger.error("failed to set install action for host %s:\n%s", self.hostname, result.stderr)
-                return
+        if not nodes:
+            return []
 
-            if self._install:
-                # Set the new node to install on boot
-                result = subprocess.run([
-                    "/opt/stack/bin/stack",
-                    "set",
-                    "host",
-                    "boot",
-                    self.hostname,
-                    "action=install"
-                ], stdout=subprocess.PIPE, stderr=subprocess.PIPE, encoding="utf-8")
-                    
-                if result.returncode != 0:
-                    self._logger.error("failed to set boot action for host %s:\n%s", self.hostname, result.stderr)
-                    return
-            else:
-                # Set the new node to OS on boot
-                result = subprocess.run([
-                    "/opt/stack/bin/stack",
-                    "set",
-                    "host",
-                    "boot",
-                    self.hostname,
-                    "action=os"
-                ], stdout=subprocess.PIPE, stderr=subprocess.PIPE, encoding="utf-8")
-                    
-                if result.returncode != 0:
-                    self._logger.error("failed to set boot action for host %s:\n%s", self.hostname, result.stderr)
-                    return
-            
-            # Sync the global config
-            result = subprocess.run([
-                "/opt/stack/bin/stack",
-                "sync",
-                "config"
-            ], stdout=subprocess.PIPE, stderr=subprocess.PIPE, encoding="utf-8")
-            
-            if result.returncode != 0:
-                self._logger.error("unable to sync global config:\n%s", result.stderr)
-                return
+        try:
+            self._command.db.database.begin()
 
-            # Sync the host config
-            result = subprocess.run([
-                "/opt/stack/bin/stack",
-                "sync",
-                "host",
-                "config",
-                self.hostname
-            ], stdout=subprocess.PIPE, stderr=subprocess.PIPE, encoding="utf-8")
-            
-            if result.returncode != 0:
-                self._logger.error("unable to sync host config:\n%s", result.stderr)
-                return
+            # The index only catches up with changes made by others between batches,
+            # make sure nobody took one of the addresses since it was handed out
+            self._command.db.clearCache()
+            taken = {
+                ip for (ip,) in self._command.db.select(
+                    "ip from networks where ip in %s and (device is null or device not like 'vlan%%')",
+                    ([str(node['ip_address']) for node in nodes],)
+                )
+            }
+            for node in [node for node in nodes if str(node['ip_address']) in taken]:
+                self._logger.error("IP address %s is already taken, not adding %s", node['ip_address'], node['hostname'])
+
+                # Let the next DHCP request from the node get a new address
+                self._release(node, ip_address=False)
+                self._watermark = None
+                nodes.remove(node)
+
+            if not nodes:
+                self._command.db.database.rollback()
+                return []
+
+            hostnames = [node['hostname'] for node in nodes]
+
+            for node in nodes:
+                # Add our new node
+                self._command.command("add.host", [
+                    node['hostname'],
+                    f"appliance={self._appliance_name}",
+                    f"rack={self._rack}",
+                    f"rank={node['rank']}",
+                    f"box={self._box}",
+                    f"installaction={self._install_action}"
+                ])
+
+                # Add the node's interface
+                self._command.command("add.host.interface", [
+                    node['hostname'],
+                    "interface=NULL",
+                    "default=true",
+                    f"mac={node['mac_address']}",
+                    f"name={node['hostname']}",
+                    f"ip={node['ip_address']}",
+                    f"network={networks[node['interface']]}"
+                ])
+
+            # Set the new nodes to install or boot the OS, the boot files get
+            # written by the 'sync host config' of the batch
+            self._command.command("set.host.boot", hostnames + [
+                "action=install" if self._install else "action=os",
+                "sync=false"
+            ])
+
+            self._command.db.database.commit()
+        except (CommandError, pymysql.Error) as e:
+            self._command.db.database.rollback()
+            self._command.db.clearCache()
 
-            self._logger.info("successfully added host %s", self.hostname)
-
-            # Post the host added message
-            message = json.dumps({
-                'channel': "discovery",
-                'payload': {
-                    'type': "add",
-                    'interface': interface,
-                    'mac_address': mac_address,
-                    'ip_address': str(ip_address),
-                    'hostname': self.hostname
-                }
-            })
-
-            self._socket.sendto(message.encode(), ("localhost", stack.mq.ports.publish))
-        else:
-            self._logger.error("no network exists for interface %s", interface)
+            if len(nodes) > 1:
+                self._logger.warning("failed to add a batch of %d hosts, adding them one at a time", len(nodes))
+                return [node for node in nodes if self._add_nodes([node])]
+
+            self._logger.error("failed to add host %s:\n%s", nodes[0]['hostname'], e)
+
+            # Let the next DHCP request from the node try again
+            self._release(nodes[0])
+            return []
+
+        return nodes
+
+    async def _sync(self, args):
+        "Run a stack sync command without blocking the event loop."
+
+        process = await asyncio.create_subprocess_exec(
+            "/opt/stack/bin/stack", "sync", *args,
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE
+        )
+        stdout, stderr = await process.communicate()
+
+        if process.returncode != 0:
+            self._logger.error("unable to sync %s:\n%s", " ".join(args), stderr.decode())
+            return False
+
+        return True
+
+    async def _commit_nodes(self):
+        """
+        Commit the discovered nodes in batches. The first node queued starts a short
+        window for the rest of the rack to show up, then the whole batch is added in one
+        transaction followed by a single 'sync config'. Nodes found while a sync is running
+        make up the next batch, so there is never more than one sync in flight.
+        """
+
+        while True:
+            if not self._pending:
+                if self._done:
+                    break
+
+                # Sleep until a node gets queued or we are told to stop
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            # Wait out the batch window, bounding the latency added to a node.
+            # Stopping the daemon cuts it short.
+            if not self._done:
+                try:
+                    await asyncio.wait_for(self._stopped.wait(), self._BATCH_WINDOW)
+                except asyncio.TimeoutError:
+                    pass
+
+            nodes, self._pending = self._pending, []
+            added = self._add_nodes(nodes)
+            self._update_watermark(len(added))
+            if not added:
+                continue
+
+            # Sync the global config and the config of the new hosts
+            if not await self._sync(["config"] + [node['hostname'] for node in added]):
+                continue
+            if not await self._sync(["host", "config"] + [node['hostname'] for node in added]):
+                continue
+
+            for node in added:
+                self._logger.info("successfully added host %s", node['hostname'])
+
+                # Post the host added message
+                message = json.dumps({
+                    'channel': "discovery",
+                    'payload': {
+                        'type': "add",
+                        'interface': node['interface'],
+                        'mac_address': node['mac_address'],
+                        'ip_address': str(node['ip_address']),
+                        'hostname': node['hostname']
+                    }
+                })
+
+                self._socket.sendto(message.encode(), ("localhost", stack.mq.ports.publish))
 
     def _process_dhcp_line(self, line):
         # See if we are a DHCPDISCOVER message
@@ -283,11 +476,9 @@ class Discovery:
             self._logger.info("detected a dhcp request: %s %s", mac_address, interface)
 
             # Is this a new MAC address?
-            self._command.db.clearCache()
-            for row in self._command.call("list.host.interface"):
-                if row['mac'] == mac_address:
-                    self._logger.debug("node is already known: %s %s", mac_address, interface)
-                    break
+            self._refresh_index()
+            if mac_address in self._known_macs:
+                self._logger.debug("node is already known: %s %s", mac_address, interface)
             else:
                 self._logger.info("found a new node: %s %s", mac_address, interface)
 
@@ -296,11 +487,24 @@ class Discovery:
                 if ip_address is None:
                     self._logger.error("no IP addresses available for interface %s", interface)
                 else:
-                    # Add the new node
-                    self._add_node(interface, mac_address, ip_address)
-
-                    # Increment the rank
-                    self._rank += 1                    
+                    # Fill in the ranks of nodes that couldn't be added first
+                    if self._free_ranks:
+                        rank = min(self._free_ranks)
+                        self._free_ranks.remove(rank)
+                    else:
+                        rank = self._rank
+                        self._rank += 1
+
+                    # Queue the new node, it gets added with the rest of its batch
+                    self._pending.append({
+                        'hostname': self._get_hostname(rank),
+                        'rank': rank,
+                        'interface': interface,
+                        'mac_address': mac_address,
+                        'ip_address': ip_address
+                    })
+                    self._update_index(interface, mac_address, ip_address)
+                    self._wakeup.set()
         else:
             if "DHCPDISCOVER" in line:
                 self._logger.warning("DHCPDISCOVER found in line but didn't match regex:\n%s", line)
@@ -327,20 +531,17 @@ class Discovery:
             except ValueError as e:
                 self._logger.error("Invalid Apache log format: %s", line)
 
-    async def _monitor_log(self, log_path, process_line):
-        # Open our log file
-        with open(log_path, 'r') as log:
-            # Move to the end
-            log.seek(0, 2)
+    async def _monitor_log(self, source):
+        """
+        Run a LogTailer or SyslogSocket source on the event loop until the daemon is
+        stopped. The source calls its line handler as soon as a new line shows up.
+        """
 
-            # Start looking for new lines in the log file
-            while not self._done:
-                line = log.readline()
-                
-                if line:
-                    process_line(line)
-                else:
-                    await asyncio.sleep(1)
+        source.start()
+        try:
+            await self._stopped.wait()
+        finally:
+            source.stop()
     
     def _cleanup(self):
         try:
@@ -350,6 +551,8 @@ class Discovery:
 
     def _signal_handler(self):
         self._done = True
+        self._stopped.set()
+        self._wakeup.set()
     
     def _get_pid(self):
         pid = None
@@ -395,9 +598,10 @@ class Discovery:
         return False
 
     def start(self, command, appliance_name=None, base_name=None, 
-        rack=None, rank=None, box=None, install_action=None, install=None):    
+        rack=None, rank=None, box=None, install_action=None, install=None, socket_path=None):    
         """
-        Start the node discovery daemon.
+        Start the node discovery daemon. DHCP requests are read from /var/log/messages,
+        or received directly from syslog on the UNIX datagram socket at socket_path.
         """
 
         # Only start if there isn't already a daemon running
@@ -499,6 +703,11 @@ class Discovery:
             self._command.db.database.connect()
             self._command.db.link = self._command.db.database.cursor()
 
+            # Build the index of known MAC and allocated IP addresses
+            self._pending = []
+            self._free_ranks = set()
+            self._load_index()
+
             # Open the message queue socket
             self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
 
@@ -518,10 +727,19 @@ class Discovery:
             # Start our event loop
             status_code = 0
             self._done = False
+            self._stopped = asyncio.Event()
+            self._wakeup = asyncio.Event()
+
+            if socket_path:
+                dhcp_source = SyslogSocket(socket_path, self._process_dhcp_line)
+            else:
+                dhcp_source = LogTailer("/var/log/messages", self._process_dhcp_line)
+
             try:
                 loop.run_until_complete(asyncio.gather(
-                    self._monitor_log("/var/log/messages", self._process_dhcp_line),
-                    self._monitor_log(kickstart_log, self._process_kickstart_line)
+                    self._monitor_log(dhcp_source),
+                    self._monitor_log(LogTailer(kickstart_log, self._process_kickstart_line)),
+                    self._commit_nodes()
                 ))
             except:
                 self._logger.exception("event loop threw an exception")
@@ -0,0 +1,242 @@
+# @copyright@
+# Copyright (c) 2006 - 2018 Teradata
+# All rights reserved. Stacki(r) v5.x stacki.com
+# https://github.com/Teradata/stacki/blob/master/LICENSE.txt
+# @copyright@
+
+import asyncio
+import ctypes
+import ctypes.util
+import os
+import socket
+import struct
+
+
+class Inotify:
+    """
+    Minimal ctypes wrapper around the Linux inotify API, just enough to watch
+    a directory from an asyncio event loop.
+    """
+
+    IN_MODIFY = 0x00000002
+    IN_MOVED_FROM = 0x00000040
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE = 0x00000200
+
+    _IN_NONBLOCK = os.O_NONBLOCK
+    _IN_CLOEXEC = os.O_CLOEXEC
+    _EVENT = struct.Struct("iIII")
+
+    def __init__(self):
+        self._libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+
+        self.fd = self._libc.inotify_init1(self._IN_NONBLOCK | self._IN_CLOEXEC)
+        if self.fd < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error))
+
+    def add_watch(self, path, mask):
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error), path)
+
+        return wd
+
+    def read(self):
+        "Return a list of (wd, mask, name) tuples for the pending events."
+
+        events = []
+        while True:
+            try:
+                data = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                break
+
+            offset = 0
+            while offset < len(data):
+                wd, mask, cookie, length = self._EVENT.unpack_from(data, offset)
+                offset += self._EVENT.size
+                name = data[offset:offset + length].rstrip(b"\0")
+                offset += length
+
+                events.append((wd, mask, os.fsdecode(name)))
+
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+
+class LogTailer:
+    """
+    Follow a log file on an asyncio event loop, calling callback(line) for each
+    complete line appended to it.
+
+    The directory of the log is watched with inotify so new lines are handled as
+    soon as they are written. Rotation (the log is renamed or removed and a new one
+    created) is handled by reading the rest of the old file and then following the
+    new one from its start, truncation by starting over at the top of the file.
+    If inotify is not available the file is polled once a second instead.
+    """
+
+    _POLL_INTERVAL = 1
+
+    def __init__(self, path, callback, *, loop=None):
+        self._path = os.path.abspath(path)
+        self._callback = callback
+        self._loop = loop or asyncio.get_event_loop()
+
+        self._file = None
+        self._partial = ""
+        self._inotify = None
+        self._poll_handle = None
+
+    def start(self):
+        # Start at the end of the existing log
+        self._open(at_end=True)
+
+        try:
+            self._inotify = Inotify()
+            self._inotify.add_watch(
+                os.path.dirname(self._path),
+                Inotify.IN_MODIFY | Inotify.IN_CREATE | Inotify.IN_DELETE |
+                Inotify.IN_MOVED_FROM | Inotify.IN_MOVED_TO
+            )
+        except (OSError, AttributeError):
+            # No inotify (or no libc with it), fall back on polling
+            if self._inotify is not None:
+                self._inotify.close()
+            self._inotify = None
+
+        if self._inotify is not None:
+            self._loop.add_reader(self._inotify.fd, self._on_event)
+        else:
+            self._poll_handle = self._loop.call_later(self._POLL_INTERVAL, self._poll)
+
+    def stop(self):
+        if self._inotify is not None:
+            self._loop.remove_reader(self._inotify.fd)
+            self._inotify.close()
+            self._inotify = None
+
+        if self._poll_handle is not None:
+            self._poll_handle.cancel()
+            self._poll_handle = None
+
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _open(self, at_end=False):
+        try:
+            self._file = open(self._path, "r", errors="replace")
+        except FileNotFoundError:
+            self._file = None
+            return
+
+        if at_end:
+            self._file.seek(0, os.SEEK_END)
+
+    def _on_event(self):
+        # Reading the pending events is what clears the readable state of
+        # the descriptor. Any change in the directory is worth a look, the
+        # old log keeps getting written under its rotated name for a bit.
+        if self._inotify.read():
+            self._read()
+
+    def _poll(self):
+        self._read()
+        self._poll_handle = self._loop.call_later(self._POLL_INTERVAL, self._poll)
+
+    def _read(self):
+        if self._file is None:
+            # The log didn't exist, maybe it does now
+            self._open()
+            if self._file is None:
+                return
+
+        # Has the log been truncated under us?
+        if os.fstat(self._file.fileno()).st_size < self._file.tell():
+            self._file.seek(0)
+            self._partial = ""
+
+        self._read_lines()
+
+        # Has the log been rotated? Whatever was left in the old file has been
+        # read above, so switch over to the new file from its start. Until the
+        # new file shows up keep following the old one.
+        try:
+            rotated = os.stat(self._path).st_ino != os.fstat(self._file.fileno()).st_ino
+        except FileNotFoundError:
+            rotated = False
+
+        if rotated:
+            self._file.close()
+            self._partial = ""
+            self._open()
+            if self._file is not None:
+                self._read_lines()
+
+    def _read_lines(self):
+        while True:
+            line = self._file.readline()
+            if not line:
+                break
+
+            # Hold on to a partially written line until the rest shows up
+            if not line.endswith("\n"):
+                self._partial += line
+                break
+
+            line = self._partial + line
+            self._partial = ""
+            self._callback(line)
+
+
+class SyslogSocket:
+    """
+    Receive syslog messages on a local UNIX datagram socket and call callback(line)
+    for each one. This lets syslog hand the daemon its messages directly (e.g. with
+    the rsyslog omuxsock module) rather than going through a log file.
+    """
+
+    def __init__(self, path, callback, *, loop=None):
+        self._path = path
+        self._callback = callback
+        self._loop = loop or asyncio.get_event_loop()
+        self._socket = None
+
+    def start(self):
+        try:
+            os.unlink(self._path)
+        except FileNotFoundError:
+            pass
+
+        self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self._socket.bind(self._path)
+        self._socket.setblocking(False)
+
+        self._loop.add_reader(self._socket.fileno(), self._on_message)
+
+    def stop(self):
+        if self._socket is not None:
+            self._loop.remove_reader(self._socket.fileno())
+            self._socket.close()
+            self._socket = None
+
+            try:
+                os.unlink(self._path)
+            except FileNotFoundError:
+                pass
+
+    def _on_message(self):
+        while True:
+            try:
+                data = self._socket.recv(64 * 1024)
+            except (BlockingIOError, InterruptedError):
+                break
+
+            for line in data.decode(errors="replace").splitlines():
+                self._callback(line)
@@ -2,14 +2,20 @@
 
 from flask import Flask, request, jsonify, send_from_directory, render_template, redirect
 from urllib.request import unquote
+from collections import namedtuple
+from xml.etree import ElementTree
+from wsgiref.simple_server import WSGIServer, WSGIRequestHandler, ServerHandler
 import os
 import requests
+import socketserver
+import gzip
 import hashlib
-import subprocess
+import tempfile
+import threading
 import click
 import logging
 from logging import FileHandler
-from time import sleep
+from time import sleep, time
 
 
 app = Flask(__name__)
@@ -29,6 +35,11 @@ client_settings = {
 
 timed_out_hosts = []
 
+# Connections to the tracker, the frontend and the peers are kept open
+# and used again, a lookup or register doesn't wait on a new connection
+session = requests.Session()
+session.mount('http://', requests.adapters.HTTPAdapter(pool_connections=64, pool_maxsize=64))
+
 
 @app.errorhandler(404)
 def four_o_four(error=None):
@@ -43,22 +54,6 @@ def four_o_four(error=None):
 
         return resp
 
-# Returns an md5 hash of a filename
-def hashit(filename):
-	hashcode = hashlib.md5()
-	hashcode.update(filename.encode('utf-8'))
-	return hashcode.hexdigest()
-
-# Save the file locally
-def save_file(content, location, filename):
-	try:
-		subprocess.call(['mkdir', '-p', location])
-		with open(location + filename, 'wb') as f:
-			f.write(content)
-	except:
-		app.logger.info("save_file: Error saving file")
-		raise
-
 # Check if the file exists locally
 def file_exists(local_file):
 	return os.path.isfile(local_file)
@@ -69,32 +64,300 @@ def tracker():
 	return "%s:%s" % (tracker_settings['TRACKER'], tracker_settings['PORT'])
 
 # Lookup a file to see if any hosts have it
-# Input is the md5 of the filename
+# Input is the checksum of the file
 # returns a list of hosts
 def lookup_file(hashcode):
 	try:
 		# timeout=(connect timeout, read timeout).
-		res = requests.get('http://%s/ludicrous/lookup/%s' % (tracker(), hashcode), timeout=(0.1, 5))
+		res = session.get('http://%s/ludicrous/lookup/%s' % (tracker(), hashcode), timeout=(0.1, 5))
 		return res
 	except:
 		raise
 
-# Get a file from a host
-def get_file(peer, remote_file):
-	_counter = 0
-	while _counter < 3:
+# Files are read and written this much at a time
+CHUNK_SIZE = 64 * 1024
+
+# Files sent to other hosts at once, past that they are told to try
+# another peer and the tracker stops handing this host out
+MAX_UPLOADS = 4
+
+# A peer sending slower than this (bytes per second) once it has had
+# SLOW_AFTER seconds to get going is left for the next one
+MIN_RATE   = 256 * 1024
+SLOW_AFTER = 2.0
+
+
+class DownloadError(Exception):
+	pass
+
+
+# Checksum of a package from the repository metadata
+Checksum = namedtuple('Checksum', ('type', 'value', 'size'))
+
+
+# Connect and read timeouts for each host, from how long it took to
+# answer before. Kept like TCP's retransmission timer (RFC 6298), a
+# smoothed response time plus four times its variation, doubled after
+# every failure until the host answers again.
+class Timeouts:
+
+	def __init__(self, initial=(0.5, 5.0), floor=(0.1, 1.0), ceiling=(5.0, 60.0)):
+		self.initial = initial
+		self.floor   = floor
+		self.ceiling = ceiling
+		self.lock    = threading.Lock()
+		self.hosts   = {}
+
+	def get(self, host):
+		with self.lock:
+			(srtt, rttvar, backoff) = self.hosts.get(host, (None, None, 1))
+
+		if srtt is None:
+			(connect, read) = self.initial
+		else:
+			connect = srtt + 4 * rttvar
+			read    = connect * 4
+
+		connect = min(max(connect * backoff, self.floor[0]), self.ceiling[0])
+		read    = min(max(read * backoff, self.floor[1]), self.ceiling[1])
+		return connect, read
+
+	def sample(self, host, elapsed):
+		with self.lock:
+			(srtt, rttvar, backoff) = self.hosts.get(host, (None, None, 1))
+			if srtt is None:
+				srtt   = elapsed
+				rttvar = elapsed / 2
+			else:
+				rttvar = 0.75 * rttvar + 0.25 * abs(srtt - elapsed)
+				srtt   = 0.875 * srtt + 0.125 * elapsed
+			self.hosts[host] = (srtt, rttvar, 1)
+
+	def failure(self, host):
+		with self.lock:
+			(srtt, rttvar, backoff) = self.hosts.get(host, (None, None, 1))
+			self.hosts[host] = (srtt, rttvar, min(backoff * 2, 16))
+
+
+# The checksums of the packages in each repository on the frontend,
+# read from its repodata the first time a file under it is asked for.
+# Files are shared by the checksum of their content, so a bad copy on
+# a peer is caught instead of being passed on.
+class Metadata:
+
+	NS = {
+		'repo':   'http://linux.duke.edu/metadata/repo',
+		'common': 'http://linux.duke.edu/metadata/common'
+	}
+
+	def __init__(self):
+		self.lock  = threading.Lock()
+		self.repos = {}
+
+	# Returns the Checksum of remote_file, or None if it is not a
+	# package in a repository
+	def lookup(self, remote_file):
+		parts = remote_file.split('/')
+		for i in range(len(parts) - 1, 1, -1):
+			packages = self.repo('/'.join(parts[:i]))
+			if packages is not None:
+				return packages.get('/'.join(parts[i:]))
+		return None
+
+	def repo(self, root):
+		with self.lock:
+			if root not in self.repos:
+				try:
+					self.repos[root] = self.load(root)
+				except (requests.RequestException, ElementTree.ParseError, OSError) as e:
+					# Try again next time
+					app.logger.info("metadata: Error reading %s/repodata: %s", root, e)
+					return None
+			return self.repos[root]
+
+	def load(self, root):
+		frontend = tracker_settings['TRACKER']
+		res = session.get('http://%s%s/repodata/repomd.xml' % (frontend, root),
+				  timeout=timeouts.get(frontend))
+		if res.status_code == 404:
+			return None
+		res.raise_for_status()
+
+		location = ElementTree.fromstring(res.content).find(
+				"repo:data[@type='primary']/repo:location", self.NS)
+		if location is None:
+			return None
+		href = location.get('href')
+
+		res = session.get('http://%s%s/%s' % (frontend, root, href),
+				  stream=True, timeout=timeouts.get(frontend))
+		res.raise_for_status()
+		res.raw.decode_content = True
+
+		packages = {}
+		package  = '{%s}package' % self.NS['common']
+		with res, (gzip.GzipFile(fileobj=res.raw) if href.endswith('.gz') else res.raw) as f:
+			for (event, elem) in ElementTree.iterparse(f):
+				if elem.tag != package:
+					continue
+				checksum = elem.find('common:checksum', self.NS)
+				size     = elem.find('common:size', self.NS)
+				location = elem.find('common:location', self.NS)
+				algorithm = checksum.get('type')
+				packages[location.get('href')] = Checksum('sha1' if algorithm == 'sha' else algorithm,
+									  checksum.text.strip(),
+									  int(size.get('package')))
+				elem.clear()
+
+		app.logger.info("metadata: %d packages in %s", len(packages), root)
+		return packages
+
+
+timeouts = Timeouts()
+metadata = Metadata()
+
+
+# A file being saved from peers or the frontend. It is written to a
+# temporary file next to where it goes as it arrives and the checksum
+# is kept up to date along the way, so when one source fails the next
+# carries on from where it stopped with a range request.
+class Download:
+
+	def __init__(self, remote_file, local_file, checksum=None):
+		self.remote_file = remote_file
+		self.local_file  = local_file
+		self.checksum    = checksum
+
+		directory = os.path.dirname(local_file)
+		os.makedirs(directory, exist_ok=True)
+		(fd, self.part) = tempfile.mkstemp(dir=directory,
+						   prefix='.%s.' % os.path.basename(local_file),
+						   suffix='.part')
+		os.close(fd)
+		self.restart()
+
+	def restart(self):
+		self.offset = 0
+		self.digest = hashlib.new(self.checksum.type) if self.checksum else None
+		open(self.part, 'wb').close()
+
+	# Gets the rest of the file from host, a peer sending too slowly
+	# is given up on when min_rate is set
+	def fetch(self, host, min_rate=None):
+		headers = {}
+		if self.offset:
+			headers['Range'] = 'bytes=%d-' % self.offset
+
+		start = time()
+		res = session.get('http://%s%s' % (host, self.remote_file), headers=headers,
+				  stream=True, timeout=timeouts.get(host))
+		with res:
+			timeouts.sample(host, time() - start)
+			res.raise_for_status()
+
+			if res.status_code == 206:
+				if not res.headers.get('Content-Range', '').startswith('bytes %d-' % self.offset):
+					raise DownloadError('%s sent the wrong range' % host)
+			elif self.offset:
+				# Range not supported, the whole file is coming
+				self.restart()
+
+			received = 0
+			start = time()
+			with open(self.part, 'ab') as f:
+				for chunk in res.iter_content(CHUNK_SIZE):
+					f.write(chunk)
+					self.offset += len(chunk)
+					if self.digest:
+						self.digest.update(chunk)
+
+					received += len(chunk)
+					elapsed = time() - start
+					if min_rate and elapsed > SLOW_AFTER and received / elapsed < min_rate:
+						raise DownloadError('%s is too slow (%d bytes/s)' % (host, received / elapsed))
+
+		if self.checksum and self.offset < self.checksum.size:
+			raise DownloadError('%s stopped at %d of %d bytes' % (host, self.offset, self.checksum.size))
+
+	def verify(self):
+		if not self.checksum:
+			return True
+		return self.offset == self.checksum.size and self.digest.hexdigest() == self.checksum.value
+
+	def commit(self):
+		os.chmod(self.part, 0o644)
+		os.rename(self.part, self.local_file)
+
+	def abandon(self):
 		try:
-			# timeout=(connect timeout, read timeout).
-			res = requests.get('http://%s%s' % (peer, remote_file), timeout=(0.1, 5))
-			return res
-		except requests.ConnectTimeout:
-			app.logger.debug('get_file: Connect Timeout. Retrying.')
-		except requests.ConnectionError:
-			app.logger.debug('get_file: Connection Error. Retrying.')
-		except:
-			app.logger.info("get_file: Error getting file from %s." % peer)
+			os.unlink(self.part)
+		except FileNotFoundError:
+			pass
 
-		_counter += 1
+
+# Saves remote_file as local_file from the first of the peers with a
+# good copy, or else from the frontend. Returns True if the file was
+# saved and matched its checksum, only those are shared with others.
+def download(remote_file, local_file, checksum, peers):
+	frontend = tracker_settings['TRACKER']
+	params = {'port': client_settings['PORT'], 'hashcode': checksum.value if checksum else None}
+
+	transfer = Download(remote_file, local_file, checksum)
+	try:
+		for peer in peers:
+			app.logger.info("requesting file: %s from peer: %s", remote_file, peer)
+			try:
+				transfer.fetch(peer, min_rate=MIN_RATE)
+				if transfer.verify():
+					transfer.commit()
+					app.logger.info("  %s from %s was successful", remote_file, peer)
+					return True
+				app.logger.info("  %s from %s does not match its checksum", remote_file, peer)
+				transfer.restart()
+			except (requests.RequestException, DownloadError) as e:
+				# A peer sending as many files as it can still
+				# has this one, try the next
+				if isinstance(e, requests.HTTPError) and e.response.status_code == 503:
+					app.logger.info("  %s is busy", peer)
+					continue
+				app.logger.info("  %s from %s was unsuccessful: %s", remote_file, peer, e)
+				timeouts.failure(peer)
+
+			unregister_params = params.copy()
+			unregister_params["peer"] = peer.split(":")[0]
+			unregister_file(params['hashcode'], unregister_params)
+
+		# Keep trying to get the file from the frontend if there is
+		# a connection error or a timeout, picking up where the last
+		# try stopped.
+		mismatches = 0
+		while True:
+			app.logger.info("requesting %s from frontend (%d bytes so far)", remote_file, transfer.offset)
+			try:
+				transfer.fetch(frontend)
+			except requests.HTTPError as e:
+				app.logger.info("Frontend Request: Error requesting %s from frontend: %s", remote_file, e)
+				return False
+			except (requests.RequestException, DownloadError) as e:
+				app.logger.debug('Frontend Request: %s. Retrying.', e)
+				timeouts.failure(frontend)
+				sleep(1)
+				continue
+
+			if transfer.verify():
+				transfer.commit()
+				return checksum is not None
+
+			# The frontend's copy is the one to use even when the
+			# metadata is out of date, but it isn't handed out
+			mismatches += 1
+			app.logger.info("%s from frontend does not match its checksum", remote_file)
+			if mismatches > 1:
+				transfer.commit()
+				return False
+			transfer.restart()
+	finally:
+		transfer.abandon()
 
 
 # Register a file for a host on the frontend
@@ -102,7 +365,7 @@ def register_file(port, hashcode):
 	_counter = 0
 	while _counter < 3:
 		try:
-			res = requests.post('http://%s/ludicrous/register/%s/%s' % (
+			res = session.post('http://%s/ludicrous/register/%s/%s' % (
 									tracker(),
 									port,
 									hashcode)
@@ -122,7 +385,7 @@ def unregister_file(hashcode, params):
 	_counter = 0
 	while _counter < 3:
 		try:
-			res = requests.delete('http://%s/ludicrous/unregister/hashcode/%s' % (
+			res = session.delete('http://%s/ludicrous/unregister/hashcode/%s' % (
 									tracker(),
 									hashcode),
 									params=params
@@ -142,7 +405,7 @@ def unregister_host(host):
 	_counter = 0
 	while _counter < 3:
 		try:
-			res = requests.delete('http://%s/ludicrous/unregister/host/%s' % (tracker(), host), timeout=(0.1, 5))
+			res = session.delete('http://%s/ludicrous/unregister/host/%s' % (tracker(), host), timeout=(0.1, 5))
 			break
 		except requests.ConnectTimeout:
 			app.logger.debug('unregister_host: Connect Timeout. Retrying.')
@@ -153,13 +416,61 @@ def unregister_host(host):
 
 		_counter += 1
 
+# Tell the tracker how many files are being uploaded to other hosts,
+# and how many can be
+def report_load(uploads, limit):
+	try:
+		session.post('http://%s/ludicrous/load/%d' % (tracker(), uploads),
+			     params={'limit': limit}, timeout=(0.1, 5))
+	except requests.RequestException:
+		app.logger.info("report_load: Error reporting load.")
+
+
+# Files being sent to other hosts right now, no more than limit at once.
+# The tracker hands out the least busy peers, it is told the count when
+# it changes (at most every interval seconds) and every refresh seconds
+# regardless, which is also how it knows this host is still around.
+class Uploads:
+
+	def __init__(self, limit=MAX_UPLOADS, interval=1.0, refresh=30.0):
+		self.limit = limit
+		self.interval = interval
+		self.refresh = refresh
+		self.lock = threading.Lock()
+		self.changed = threading.Event()
+		self.active = 0
+
+	# Returns False when there are too many uploads already
+	def start(self):
+		with self.lock:
+			if self.active >= self.limit:
+				return False
+			self.active += 1
+		self.changed.set()
+		return True
+
+	def finish(self):
+		with self.lock:
+			self.active -= 1
+		self.changed.set()
+
+	def report(self):
+		while True:
+			self.changed.wait(self.refresh)
+			self.changed.clear()
+			report_load(self.active, self.limit)
+			sleep(self.interval)
+
+
+uploads = Uploads()
+
+
 @app.route('/install/<path:path>/<filename>')
 def get_file_locally(path, filename):
 	save_location = client_settings['LOCAL_SAVE_LOCATION']
 	file_location = '%s/install/%s' % (save_location, path)
 	local_file = '%s/%s' % (file_location, filename)
 	remote_file = '/install/%s/%s' % (path, filename)
-	hashcode = hashit(remote_file)
 	im_the_requester = request.remote_addr == "127.0.0.1"
 	environment = client_settings['ENVIRONMENT']
 	port = client_settings['PORT']
@@ -167,65 +478,26 @@ def get_file_locally(path, filename):
 	if not client_settings['SAVE_FILES']:
 		return redirect('http://%s%s' % (tracker_settings['TRACKER'], remote_file))
 
-	# check if file is local
-	if client_settings['SAVE_FILES'] and im_the_requester and not file_exists(local_file):
-
-		params = {'port': port, 'hashcode': hashcode}
-
-		# Check if there are any hosts that have the file
-		try:
-			res = lookup_file(hashcode)
-			payload = res.json()
-			successful = res.status_code == 200 and payload['success']
-		except:
-			successful = False
-
-		if successful and payload['peers']:
-			peers = set(payload['peers'])
-			for peer in peers.difference(timed_out_hosts):
-				peer_ip = peer.split(":")[0]
-				app.logger.info("requesting file: %s from peer: %s", filename, peer)
-				try:
-					peer_res = get_file(peer, remote_file)
-					if peer_res.status_code == 200:
-						save_file(peer_res.content, '%s/' % (file_location), filename)
-						app.logger.info("  %s from %s was successful", filename, peer)
-						register_file(port, hashcode)
-						break
-					else:
-						app.logger.info("  %s from %s was unsuccessful", filename, peer)
-						unregister_params = params.copy()
-						unregister_params["peer"] = peer.split(":")[0]
-						unregister_file(hashcode, unregister_params)
-
-				except:
-					app.logger.info("  %s from %s was unsuccessful", filename, peer)
-					unregister_params = params.copy()
-					unregister_params["peer"] = peer.split(":")[0]
-					unregister_file(hashcode, unregister_params)
-
 	if not file_exists(local_file):
-		# Keep trying to get file from frontend if there is a
-		# connection error or a timeout.
-		while True:
-			app.logger.info("requesting %s from frontend", filename)
+		checksum = metadata.lookup(remote_file)
+		hashcode = checksum.value if checksum else None
+		peers = []
+
+		# Check if there are any hosts that have the file, only
+		# files with a checksum to check them against are shared
+		if im_the_requester and hashcode:
 			try:
-				# timeout=(connect timeout, read timeout).
-				tracker_res = requests.get('http://%s%s' % (tracker_settings['TRACKER'], remote_file), timeout=(0.1, 5))
-				if tracker_res.status_code == 200:
-					save_file(tracker_res.content, '%s/' % (file_location), filename)
-					if client_settings['SAVE_FILES']:
-						register_file(port, hashcode)
-				break
-			except requests.ConnectTimeout:
-				app.logger.debug('Frontend Request: Connect Timeout. Retrying.')
-				sleep(1)
-			except requests.ConnectionError:
-				app.logger.debug('Frontend Request: Connection Error. Retrying.')
-				sleep(1)
+				res = lookup_file(hashcode)
+				payload = res.json()
+				successful = res.status_code == 200 and payload['success']
 			except:
-				app.logger.info("Frontend Request: Error requesting %s from frontend" % filename)
-				sleep(1)
+				successful = False
+
+			if successful and payload['peers']:
+				peers = [ peer for peer in payload['peers'] if peer not in timed_out_hosts ]
+
+		if download(remote_file, local_file, checksum, peers):
+			register_file(port, hashcode)
 
 	if file_exists(local_file):
 		app.logger.info("%s is saved locally", (filename))
@@ -267,7 +539,7 @@ def running():
 
 @app.route('/peerdone')
 def peerdone():
-	peerdone_res = requests.delete('http://%s/ludicrous/peerdone' % tracker())
+	peerdone_res = session.delete('http://%s/ludicrous/peerdone' % tracker())
 	return jsonify({"success": True})
 
 
@@ -276,6 +548,78 @@ def page_not_found(e):
 	return "", 404
 
 
+# Sends files with sendfile(2) straight from the page cache to the
+# socket, instead of reading them into python and writing them out.
+class SendfileHandler(ServerHandler):
+
+	def sendfile(self):
+		try:
+			fd = self.result.filelike.fileno()
+		except (AttributeError, OSError):
+			return False
+
+		if not self.headers_sent:
+			self.send_headers()
+		self._flush()
+
+		sock = self.request_handler.connection.fileno()
+		offset = os.lseek(fd, 0, os.SEEK_CUR)
+		while True:
+			sent = os.sendfile(sock, fd, offset, 1024 * 1024)
+			if not sent:
+				break
+			offset += sent
+			self.bytes_sent += sent
+		return True
+
+
+# Each request gets its own thread. Requests from other hosts for files
+# under /install are uploads, past the limit they are turned away before
+# the application sees them.
+class RequestHandler(WSGIRequestHandler):
+
+	def handle(self):
+		self.raw_requestline = self.rfile.readline(65537)
+		if len(self.raw_requestline) > 65536:
+			self.send_error(414)
+			return
+		if not self.parse_request():
+			return
+
+		upload = self.client_address[0] != '127.0.0.1' and self.path.startswith('/install/')
+		if upload and not uploads.start():
+			self.send_response(503)
+			self.send_header('Retry-After', '1')
+			self.send_header('Content-Length', '0')
+			self.end_headers()
+			return
+
+		try:
+			handler = SendfileHandler(self.rfile, self.wfile, self.get_stderr(), self.get_environ(),
+					  multithread=True)
+			handler.request_handler = self
+			handler.run(self.server.get_app())
+		finally:
+			if upload:
+				uploads.finish()
+
+	def log_message(self, format, *args):
+		app.logger.debug("%s %s", self.address_string(), format % args)
+
+
+class Server(socketserver.ThreadingMixIn, WSGIServer):
+	daemon_threads = True
+	allow_reuse_address = True
+	request_queue_size = 1024
+
+
+def serve():
+	threading.Thread(target=uploads.report, daemon=True).start()
+	server = Server(('0.0.0.0', client_settings['PORT']), RequestHandler)
+	server.set_app(app)
+	server.serve_forever()
+
+
 @click.command()
 @click.option('--environment', default='regular')
 @click.option('--trackerfile', default='/tmp/stack.conf')
@@ -315,13 +659,13 @@ def main(environment, trackerfile, nosavefile, port):
 				os._exit(0)
 
 			try:
-				app.run(host='0.0.0.0', port=client_settings['PORT'])
+				serve()
 			except:
 				pass
 		else:
 			os._exit(0)
 	else:
-		app.run(host='0.0.0.0', port=client_settings['PORT'])
+		serve()
 
 
 if __name__ == "__main__":
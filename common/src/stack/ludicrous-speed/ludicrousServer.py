@@ -2,12 +2,16 @@
 
 from flask import Flask, request, jsonify, send_from_directory, render_template, redirect
 from urllib.request import unquote
-from random import shuffle, randint
+from random import randrange, random
+from time import time
 import os
+import socket
+import threading
 import logging
 from logging import FileHandler
 import redis
 import stack.api
+import stack.mq
 
 ludicredis = redis.StrictRedis()
 
@@ -18,6 +22,223 @@ PEERS = set()
 MAX_PEERS = 3
 ROOT_DIR = "/var/www/html"
 
+# A peer uploading this many files at once is not handed out, the
+# requester is better off going to the frontend than queueing behind
+# the others. One that failed this many times in the last FAILURE_TTL
+# seconds is only handed out when there is nobody else.
+MAX_LOAD = 4
+MAX_FAILURES = 3
+FAILURE_TTL = 300
+
+# Clients report their uploads at least this often while they have any
+LOAD_TTL = 60
+
+# A peer that hasn't been heard from in this long is gone, the peers
+# are checked for that every REAP_INTERVAL seconds
+PEER_TTL = 120
+REAP_INTERVAL = 30
+
+# Hosts are reported as downloading at most this often
+MESSAGE_INTERVAL = 60
+
+# Only this many peers, and this many in the same rack, are looked at
+CANDIDATES = 16
+
+
+# Where each host is, from the racks and networks in the stacki
+# database. Read again every ttl seconds, or sooner (but not more than
+# every retry seconds) when asked about an address it doesn't know.
+# Only one thread reloads it, the others keep using the hosts they have.
+class Topology:
+
+	def __init__(self, ttl=300, retry=30):
+		self.ttl = ttl
+		self.retry = retry
+		self.hosts = {}
+		self.loaded = 0
+		self.lock = threading.Lock()
+
+	def load(self):
+		racks = {}
+		for row in stack.api.Call('list.host'):
+			racks[row['host']] = row['rack']
+
+		hosts = {}
+		for row in stack.api.Call('list.host.interface'):
+			if row['ip']:
+				hosts[row['ip']] = (racks.get(row['host']), row['network'])
+
+		self.hosts = hosts
+		self.loaded = time()
+
+	# Returns the (rack, network) of the address
+	def get(self, ipaddr):
+		hosts = self.hosts
+		age = time() - self.loaded
+		if age > self.ttl or (ipaddr not in hosts and age > self.retry):
+			if self.lock.acquire(blocking=False):
+				try:
+					# Nobody else starts a reload while
+					# this one runs, or after it fails
+					self.loaded = time()
+					self.load()
+				except Exception:
+					app.logger.exception('topology: could not list the hosts')
+				finally:
+					self.lock.release()
+				hosts = self.hosts
+
+		return hosts.get(ipaddr, (None, None))
+
+	# 0 for the same rack, 1 for the same network, else 2
+	def locality(self, here, peer):
+		(rack, network) = here
+		(peer_rack, peer_network) = self.get(peer)
+
+		if rack is not None and rack == peer_rack:
+			return 0
+		if network is not None and network == peer_network:
+			return 1
+		return 2
+
+
+topology = Topology()
+
+
+# Orders the peers for the requester: closest first and the least busy
+# first among those as close, any that keep failing last. Saturated
+# peers are left out, and so are the ones that are gone. stats returns
+# the (uploads, failures, alive) of a list of peers.
+def rank(requester, peers, topology, stats, count=MAX_PEERS):
+	if not peers:
+		return []
+
+	# Start from a random place so everybody isn't handed the same
+	# peers, and stop looking once there are enough of them
+	start = randrange(len(peers))
+	here = topology.get(requester)
+	local = []
+	remote = []
+	for peer in peers[start:] + peers[:start]:
+		locality = topology.locality(here, peer)
+		if locality == 0:
+			local.append((locality, peer))
+		elif len(remote) < CANDIDATES:
+			remote.append((locality, peer))
+		if len(local) == CANDIDATES and len(remote) == CANDIDATES:
+			break
+	candidates = local[:CANDIDATES] + remote
+
+	ranked = []
+	for ((locality, peer), (load, failures, alive)) in zip(candidates, stats([ peer for (_, peer) in candidates ])):
+		if alive and load < MAX_LOAD:
+			ranked.append((failures >= MAX_FAILURES, locality, load + failures, random(), peer))
+	ranked.sort()
+
+	return [ peer for (*_, peer) in ranked[:count] ]
+
+
+# Current uploads, recent failures and heartbeats of the peers
+def peer_stats(peers):
+	pipe = ludicredis.pipeline(transaction=False)
+	for peer in peers:
+		pipe.get('ludicrous:load:%s' % peer)
+		pipe.get('ludicrous:failures:%s' % peer)
+		pipe.exists('ludicrous:alive:%s' % peer)
+	values = pipe.execute()
+	return [ (int(load or 0), int(failures or 0), bool(alive))
+		 for (load, failures, alive) in zip(values[0::3], values[1::3], values[2::3]) ]
+
+
+# Each file has the set of peers with it ("ludicrous:<hashcode>"), one
+# for the peers in each rack ("ludicrous:<hashcode>:rack:<rack>") and
+# each peer the set of files it has ("ludicrous:files:<peer>"), so a
+# peer is taken out by going through its own files instead of every
+# key in redis. Peers heard from in the last PEER_TTL seconds have an
+# "ludicrous:alive:<peer>" key, all of them are in "ludicrous:peers".
+
+# Marks the peer alive for another PEER_TTL seconds
+def heartbeat(pipe, ipaddr):
+	pipe.sadd('ludicrous:peers', ipaddr)
+	pipe.setex('ludicrous:alive:%s' % ipaddr, PEER_TTL, 1)
+
+
+def add_file(pipe, ipaddr, hashcode, rack=None):
+	pipe.sadd('ludicrous:%s' % hashcode, ipaddr)
+	pipe.sadd('ludicrous:files:%s' % ipaddr, hashcode)
+	if rack is not None:
+		pipe.sadd('ludicrous:%s:rack:%s' % (hashcode, rack), ipaddr)
+		pipe.hset('ludicrous:racks', ipaddr, rack)
+
+
+def remove_file(pipe, ipaddr, hashcode, rack=None):
+	pipe.srem('ludicrous:%s' % hashcode, ipaddr)
+	pipe.srem('ludicrous:files:%s' % ipaddr, hashcode)
+	if rack is not None:
+		pipe.srem('ludicrous:%s:rack:%s' % (hashcode, rack), ipaddr)
+
+
+# The rack the peer's files were added under
+def peer_rack(ipaddr):
+	rack = ludicredis.hget('ludicrous:racks', ipaddr)
+	return rack.decode() if rack is not None else None
+
+
+# Takes the peer out of the sets of all the files it has
+def forget(ipaddr):
+	rack = peer_rack(ipaddr)
+	hashcodes = [ hashcode.decode() for hashcode in ludicredis.smembers('ludicrous:files:%s' % ipaddr) ]
+
+	pipe = ludicredis.pipeline(transaction=False)
+	for hashcode in hashcodes:
+		pipe.srem('ludicrous:%s' % hashcode, ipaddr)
+		if rack is not None:
+			pipe.srem('ludicrous:%s:rack:%s' % (hashcode, rack), ipaddr)
+	pipe.delete('ludicrous:files:%s' % ipaddr,
+		    'ludicrous:alive:%s' % ipaddr,
+		    'ludicrous:load:%s' % ipaddr)
+	pipe.srem('ludicrous:peers', ipaddr)
+	pipe.hdel('ludicrous:racks', ipaddr)
+	pipe.execute()
+
+	return len(hashcodes)
+
+
+# Forgets the peers that stopped sending heartbeats without saying
+# they were done. Only one request every REAP_INTERVAL seconds, in
+# whichever process, does the work.
+def reap():
+	if not ludicredis.set('ludicrous:reaped', 1, ex=REAP_INTERVAL, nx=True):
+		return []
+
+	peers = [ peer.decode() for peer in ludicredis.smembers('ludicrous:peers') ]
+	pipe = ludicredis.pipeline(transaction=False)
+	for peer in peers:
+		pipe.exists('ludicrous:alive:%s' % peer)
+
+	gone = [ peer for (peer, alive) in zip(peers, pipe.execute()) if not alive ]
+	for peer in gone:
+		app.logger.info("%s stopped sending heartbeats, removing it from %d files", peer, forget(peer))
+	return gone
+
+
+# Tells the health channel the host is downloading its packages. The
+# message queue takes it over UDP, so nothing waits on it, and redis
+# keeps the hosts to one message every MESSAGE_INTERVAL seconds across
+# all the server processes.
+def report_download(ipaddr):
+	if not ludicredis.set('ludicrous:message:%s' % ipaddr, 1, ex=MESSAGE_INTERVAL, nx=True):
+		return
+
+	msg = stack.mq.Message('{"state": "install download"}', channel='health', ttl=3600, source=ipaddr)
+	tx = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+	try:
+		tx.sendto(str(msg).encode(), ('localhost', stack.mq.ports.publish))
+	except OSError:
+		pass
+	finally:
+		tx.close()
+
 
 @app.errorhandler(404)
 def four_o_four(error=None):
@@ -39,31 +260,48 @@ def lookup(hashcode):
 	res['success'] = True
 	ipaddr = request.remote_addr
 
-	if randint(0, 100) < 10:
-		# throttle the flood of message to only X% of package installs,
-		# not looking for detail just want to know what stage we are in
-		stack.api.Call('add.host.message', [ 'localhost', 
-						     'channel=health',
-						     'ttl=3600',
-						     'message={"state": "install download"}',
-						     'source=%s' % ipaddr ])
+	report_download(ipaddr)
+	reap()
+
+	# Peers that are gone are dropped from the file as they turn up
+	gone = []
+	def stats(peers):
+		values = peer_stats(peers)
+		gone.extend(peer for (peer, (_, _, alive)) in zip(peers, values) if not alive)
+		return values
+
+	# return the closest of the peers with the request hash, never
+	# the requester itself. Only a sample of the peers with it, and
+	# of those in the same rack, is looked at.
+	(rack, network) = topology.get(ipaddr)
+	pipe = ludicredis.pipeline(transaction=False)
+	pipe.srandmember("ludicrous:%s" % hashcode, CANDIDATES)
+	if rack is not None:
+		pipe.srandmember("ludicrous:%s:rack:%s" % (hashcode, rack), CANDIDATES)
+
+	peers = set()
+	for members in pipe.execute():
+		peers.update(peer.decode() for peer in members)
+	peers.discard(ipaddr)
+	peers = rank(ipaddr, list(peers), topology, stats)
+
+	if gone:
+		pipe = ludicredis.pipeline(transaction=False)
+		pipe.srem("ludicrous:%s" % hashcode, *gone)
+		if rack is not None:
+			pipe.srem("ludicrous:%s:rack:%s" % (hashcode, rack), *gone)
+		pipe.execute()
+
+	pipe = ludicredis.pipeline(transaction=False)
+	for peer in peers:
+		pipe.smembers('%s:PORT' % peer)
 
-	# return list of peers with the request hash
 	res['peers'] = []
-	peers = list(ludicredis.smembers("ludicrous:%s" % hashcode))
-	shuffle(peers)
-	for peer in peers:
-		# only append a peer if it is not the requester
-		if ipaddr not in peer.decode():
-                        peer_port = ludicredis.smembers('%s:PORT' % ipaddr)
-                        if peer_port:
-                                res['peers'].append("%s:%s" % (peer.decode(), peer_port.pop().decode()))
-                        else:
-                                res['peers'].append("%s:%s" % (peer.decode(), '80'))		
-
-		# if array of peers is max_peers, break
-		if len(res['peers']) == MAX_PEERS:
-			break
+	for (peer, peer_port) in zip(peers, pipe.execute()):
+		if peer_port:
+			res['peers'].append("%s:%s" % (peer, peer_port.pop().decode()))
+		else:
+			res['peers'].append("%s:%s" % (peer, '80'))
 
 	return jsonify(res)
 
@@ -84,7 +322,11 @@ def register(port=80, hashcode=None):
 			PEERS.add(ipaddr)
 
 	# Register Package
-	ludicredis.sadd("ludicrous:%s" % hashcode, "%s" % ipaddr)
+	(rack, network) = topology.get(ipaddr)
+	pipe = ludicredis.pipeline(transaction=False)
+	add_file(pipe, ipaddr, hashcode, rack)
+	heartbeat(pipe, ipaddr)
+	pipe.execute()
 
 	return jsonify(res)
 
@@ -95,7 +337,14 @@ def unregister(hashcode):
 	res = {}
 	res['success'] = True
 
-	result = ludicredis.srem("ludicrous:%s" % hashcode, ipaddr)
+	# Peers are unregistered by the client that failed to get a
+	# file from them
+	pipe = ludicredis.pipeline()
+	remove_file(pipe, ipaddr, hashcode, peer_rack(ipaddr))
+	pipe.incr("ludicrous:failures:%s" % ipaddr)
+	pipe.expire("ludicrous:failures:%s" % ipaddr, FAILURE_TTL)
+	result = pipe.execute()[0]
+
 	if result:
 		res['message'] = "'%s' was unregistered for hash: %s" % (ipaddr, hashcode)
 	else:
@@ -103,18 +352,36 @@ def unregister(hashcode):
 
 	return jsonify(res)
 
+@app.route('/load/<int:uploads>', methods=['POST'])
+def report_load(uploads):
+	ipaddr = request.remote_addr
+	res = {}
+	res['success'] = True
+
+	# A client turning others away is saturated whatever its limit
+	limit = request.args.get('limit', type=int)
+	if limit and uploads >= limit:
+		uploads = max(uploads, MAX_LOAD)
+
+	# Clients report their load regularly, that is the heartbeat
+	pipe = ludicredis.pipeline(transaction=False)
+	if uploads:
+		pipe.setex("ludicrous:load:%s" % ipaddr, LOAD_TTL, uploads)
+	else:
+		pipe.delete("ludicrous:load:%s" % ipaddr)
+	heartbeat(pipe, ipaddr)
+	pipe.execute()
+
+	return jsonify(res)
+
 @app.route('/peerdone', methods=['DELETE'])
 def peerdone():
 	ipaddr = request.remote_addr
 	res = {}
 	res['success'] = True
 
-	for package in ludicredis.scan_iter():
-		try:
-			ludicredis.srem(package, ipaddr)
-		except:
-			pass	
-		
+	forget(ipaddr)
+
 	return jsonify(res)
 
 @app.route('/status', methods=['GET'])
@@ -129,12 +396,8 @@ def purge_packages():
 	res['sucess'] = True
 	is_from_frontend = request.remote_addr == "127.0.0.1"
 	if is_from_frontend:
-		for package in ludicredis.scan_iter():
-			try:
-				if 'ludicrous' in package.decode():
-					result = ludicredis.delete(package)
-			except:
-				pass
+		for peer in ludicredis.smembers('ludicrous:peers'):
+			forget(peer.decode())
 	else:
 		res['success'] = False
 	
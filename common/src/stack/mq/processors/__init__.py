@@ -49,6 +49,12 @@ class ProcessorBase(stack.mq.Subscriber):
 		if ttl is not None:
 			self.redis.expire(key, ttl)
 
+	def incrKey(self, key):
+		try:
+			self.redis.incr(key)
+		except redis.exceptions.ConnectionError:
+			return
+
 
 	def run(self):
 		if self.isActive():
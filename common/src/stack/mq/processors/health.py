@@ -101,11 +101,20 @@ class Processor(ProcessorBase):
 			except ValueError:
 				health = { 'state': payload }
 
+			changed = False
 			for component, state in health.items():
 				if ttl == -1:
 					ttl = None
-				self.setKey('host:%s:status:%s' % 
-					    (keys['id'], component), state, ttl)
+				key = 'host:%s:status:%s' % (keys['id'], component)
+				if self.getKey(key) != '%s' % state:
+					changed = True
+				self.setKey(key, state, ttl)
+
+			# Lets the REST API tell pollers of 'list host
+			# status' nothing has changed without asking redis
+			# for every host.
+			if changed:
+				self.incrKey('host:status:version')
 
 
 		return None
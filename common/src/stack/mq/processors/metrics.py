@@ -0,0 +1,45 @@
+# @copyright@
+# Copyright (c) 2006 - 2018 Teradata
+# All rights reserved. Stacki(r) v5.x stacki.com
+# https://github.com/Teradata/stacki/blob/master/LICENSE.txt
+# @copyright@
+
+import json
+import time
+try:
+	import redis
+except ModuleNotFoundError:
+	pass
+import stack.mq.rollup
+import stack.mq.processors.health
+
+
+class Processor(stack.mq.processors.health.ProcessorBase):
+	"""
+	Listen for metrics messages and aggregate the samples of each
+	host into the 1 second, 1 minute, and 1 hour rollups kept in
+	the redis database (see stack.mq.rollup).
+	"""
+
+	def channel(self):
+		return 'metrics'
+
+	def process(self, msg):
+		keys    = self.updateHostKeys(msg.getSource())
+		payload = msg.getPayload()
+
+		if keys and payload:
+			try:
+				samples = json.loads(payload)
+			except ValueError:
+				return None
+
+			if isinstance(samples, dict):
+				try:
+					stack.mq.rollup.update(self.redis, keys['id'],
+							       samples, time.time())
+				except redis.exceptions.RedisError:
+					pass
+
+		return None
+
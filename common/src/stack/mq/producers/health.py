@@ -15,29 +15,46 @@ class Producer(stack.mq.producers.ProducerBase):
 	once every 60 seconds.
 	"""
 
+	def __init__(self, scheduler, sock):
+		stack.mq.producers.ProducerBase.__init__(self, scheduler, sock)
+
+		# Cached process handles by name, this lets us skip
+		# walking the process table while the process stays up.
+
+		self.procs = {}
+
 	def schedule(self):
 		return 60
 
+	def isRunning(self, name):
+		"""
+		Returns True if a process called *name* is running.  The
+		cached process handle is checked first and the process table
+		is only walked (reading just the name) when it is gone.
+		"""
+		p = self.procs.get(name)
+		if p and p.is_running():
+			return True
+
+		self.procs.pop(name, None)
+		for p in psutil.process_iter(attrs=['name']):
+			if p.info['name'] == name:
+				self.procs[name] = p
+				return True
+
+		return False
+
 	def produce(self):
 
 		payload = { 'state': 'online' }
 
-		# TODO
-		#
-		# Should we add some simple ganglia like metrics here (psutil
-		# can do this)
-		#
-		# - load
-		# - temp
-		# - diskspace (this sucks because it's an array)
+		# Metrics (load, memory, disk, ...) are shipped on the
+		# "metrics" channel, see producers/metrics.py.
 
-		for p in psutil.process_iter(attrs=['name']):
-			if p.info['name'] == 'sshd':
-				payload['ssh'] = 'up'
+		if self.isRunning('sshd'):
+			payload['ssh'] = 'up'
 
 		return stack.mq.Message(json.dumps(payload),
 					channel='health', 
 					ttl=self.schedule() * 2)
 
-
-
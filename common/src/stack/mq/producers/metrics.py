@@ -0,0 +1,48 @@
+# @copyright@
+# Copyright (c) 2006 - 2018 Teradata
+# All rights reserved. Stacki(r) v5.x stacki.com
+# https://github.com/Teradata/stacki/blob/master/LICENSE.txt
+# @copyright@
+
+import os
+import json
+import stack.mq
+import psutil
+
+
+class Producer(stack.mq.producers.ProducerBase):
+	"""
+	Produces a sample of the basic host metrics on the "metrics"
+	channel every 10 seconds.
+
+	Only cheap system wide counters are read (no process table
+	walk) to keep the overhead on the compute nodes down.
+	"""
+
+	def __init__(self, scheduler, sock):
+		stack.mq.producers.ProducerBase.__init__(self, scheduler, sock)
+
+		# The first call primes the counters and returns a
+		# meaningless 0.0, after that it is the utilization since
+		# the previous call.
+
+		psutil.cpu_percent(interval=None)
+
+	def schedule(self):
+		return 10
+
+	def produce(self):
+		(load1, load5, load15) = os.getloadavg()
+
+		payload = {
+			'load' : load1,
+			'cpu'  : psutil.cpu_percent(interval=None),
+			'mem'  : psutil.virtual_memory().percent,
+			'swap' : psutil.swap_memory().percent,
+			'disk' : psutil.disk_usage('/').percent
+			}
+
+		return stack.mq.Message(json.dumps(payload),
+					channel='metrics',
+					ttl=self.schedule() * 2)
+
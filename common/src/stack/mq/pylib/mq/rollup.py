@@ -0,0 +1,173 @@
+# @copyright@
+# Copyright (c) 2006 - 2018 Teradata
+# All rights reserved. Stacki(r) v5.x stacki.com
+# https://github.com/Teradata/stacki/blob/master/LICENSE.txt
+# @copyright@
+
+"""
+Fixed resolution time-series rollups stored in Redis.
+
+Each host metric is kept in one ring buffer per resolution.  A ring
+buffer is a single Redis hash where the field is the slot number and
+the value is the encoded bucket (start count sum min max).  Slots are
+reused once the buffer wraps, so the storage for a metric is bounded
+no matter how long the host has been reporting.
+
+The following Redis keys are defined::
+
+	host:ID:metrics			set of metric names
+	host:ID:metrics:NAME:RES	ring buffer for NAME at RES seconds
+"""
+
+import time
+
+
+# (seconds per slot, number of slots)
+#
+# 10 seconds for 1 hour (the metrics producer samples every 10 seconds)
+# 1 minute   for 1 day
+# 1 hour     for 30 days
+
+RESOLUTIONS = ((10, 360), (60, 1440), (3600, 720))
+
+
+# Folds a sample into each bucket inside of Redis, so two processors
+# updating the same host can't lose each other's samples.
+#
+# KEYS are the ring buffers, ARGV has the slot, bucket start, and
+# sample value for each of them.
+
+UPDATE = """
+for i, key in ipairs(KEYS) do
+	local slot  = ARGV[i * 3 - 2]
+	local start = tonumber(ARGV[i * 3 - 1])
+	local value = tonumber(ARGV[i * 3])
+
+	local bucket = nil
+	local old = redis.call('HGET', key, slot)
+	if old then
+		local s, c, t, lo, hi = string.match(old, '(%S+) (%S+) (%S+) (%S+) (%S+)')
+		if tonumber(s) == start then
+			bucket = { start, tonumber(c) + 1, tonumber(t) + value,
+				   math.min(tonumber(lo), value), math.max(tonumber(hi), value) }
+		end
+	end
+	if not bucket then
+		bucket = { start, 1, value, value, value }
+	end
+
+	redis.call('HSET', key, slot, string.format('%d %d %.17g %.17g %.17g', unpack(bucket)))
+end
+"""
+
+
+def metricsKey(id):
+	return 'host:%s:metrics' % id
+
+def bufferKey(id, metric, resolution):
+	return 'host:%s:metrics:%s:%d' % (id, metric, resolution)
+
+
+def encode(bucket):
+	return '%d %d %r %r %r' % bucket
+
+def decode(value):
+	if isinstance(value, bytes):
+		value = value.decode()
+	(start, count, total, lo, hi) = value.split()
+	return (int(start), int(count), float(total), float(lo), float(hi))
+
+
+def update(redis, id, samples, now=None):
+	"""
+	Add a set of samples for a host to every rollup resolution.
+
+	The buckets are updated by a script run inside of Redis, so the
+	cost of an update is one round trip regardless of the number of
+	metrics, and concurrent updates of a host are never lost.
+
+	:param redis: redis.StrictRedis connection
+	:param id: host id
+	:type id: int
+	:param samples: metric name to numeric value
+	:type samples: dict
+	:param now: sample timestamp (default is the current time)
+	:type now: float
+	"""
+	if now is None:
+		now = time.time()
+
+	metrics = set()
+	keys    = []
+	args    = []
+	for metric, value in samples.items():
+		try:
+			value = float(value)
+		except (TypeError, ValueError):
+			continue
+		metrics.add(metric)
+		for resolution, size in RESOLUTIONS:
+			start = int(now) - int(now) % resolution
+			slot  = (start // resolution) % size
+			keys.append(bufferKey(id, metric, resolution))
+			args.extend([ slot, start, repr(value) ])
+
+	if not keys:
+		return
+
+	pipe = redis.pipeline(transaction=False)
+	pipe.sadd(metricsKey(id), *metrics)
+	redis.register_script(UPDATE)(keys=keys, args=args, client=pipe)
+	pipe.execute()
+
+
+def resolution(window):
+	"""
+	Return the finest resolution that covers the requested window.
+
+	:param window: number of seconds of history
+	:type window: int
+	:returns: resolution in seconds
+	"""
+	for resolution, size in RESOLUTIONS:
+		if resolution * size >= window:
+			return resolution
+	return RESOLUTIONS[-1][0]
+
+
+def fetch(redis, id, metrics, resolution, start, end):
+	"""
+	Read the buckets of one or more metrics for a host.
+
+	Each ring buffer is read with a single HGETALL in one pipeline and
+	the buckets outside of [start, end] (including stale slots from
+	a previous wrap of the buffer) are dropped.
+
+	:param redis: redis.StrictRedis connection
+	:param id: host id
+	:type id: int
+	:param metrics: list of metric names
+	:type metrics: list
+	:param resolution: bucket size in seconds
+	:type resolution: int
+	:param start: first timestamp
+	:type start: int
+	:param end: last timestamp
+	:type end: int
+	:returns: dictionary of metric name to a time ordered list of \
+	(start, count, sum, min, max) tuples
+	"""
+	pipe = redis.pipeline(transaction=False)
+	for metric in metrics:
+		pipe.hgetall(bufferKey(id, metric, resolution))
+
+	result = {}
+	for metric, buffer in zip(metrics, pipe.execute()):
+		buckets = []
+		for value in buffer.values():
+			bucket = decode(value)
+			if start <= bucket[0] <= end:
+				buckets.append(bucket)
+		result[metric] = sorted(buckets)
+
+	return result
@@ -0,0 +1,196 @@
+# @copyright@
+# Copyright (c) 2006 - 2018 Teradata
+# All rights reserved. Stacki(r) v5.x stacki.com
+# https://github.com/Teradata/stacki/blob/master/LICENSE.txt
+# @copyright@
+
+import base64
+import os
+import re
+import subprocess
+import sys
+
+
+# dhcpd.conf includes the key file so the secret never goes through
+# the database (or the output of report dhcpd).
+
+PORT	 = 7911
+KEY_NAME = 'omapi_key'
+KEY_FILE = '/etc/dhcp/omapi.key'
+OMSHELL	 = '/usr/bin/omshell'
+
+
+def createKey(path=KEY_FILE):
+	"""
+	Writes a new OMAPI key file for dhcpd unless there already is one.
+	"""
+	if os.path.exists(path):
+		return
+
+	secret = base64.b64encode(os.urandom(64)).decode()
+
+	fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+	with os.fdopen(fd, 'w') as f:
+		f.write('key %s {\n' % KEY_NAME)
+		f.write('\talgorithm hmac-md5;\n')
+		f.write('\tsecret "%s";\n' % secret)
+		f.write('}\n')
+
+
+def readKey(path=KEY_FILE):
+	"""
+	Returns the secret from the OMAPI key file, or None if there
+	isn't one.
+	"""
+	try:
+		with open(path) as f:
+			m = re.search(r'secret\s+"([^"]+)"', f.read())
+	except FileNotFoundError:
+		return None
+
+	if m:
+		return m.group(1)
+	return None
+
+
+def stripLeases(path):
+	"""
+	Drops the host objects dhcpd was given through OMAPI from its
+	leases file. dhcpd.conf has all of the hosts, the ones in the
+	leases file are only stale copies once dhcpd restarts.
+	"""
+	try:
+		with open(path) as f:
+			text = f.read()
+	except FileNotFoundError:
+		return
+
+	stripped = re.sub(r'^host \S+ \{\n.*?^\}\n', '', text, flags=re.M | re.S)
+	if stripped != text:
+		with open(path, 'w') as f:
+			f.write(stripped)
+
+
+class OMAPIError(Exception):
+	pass
+
+
+class OMAPI:
+	"""
+	Changes the host objects of a running dhcpd through omshell.
+
+	Changes are queued with add() and remove() and sent to dhcpd in
+	a single omshell session by commit().
+	"""
+
+	def __init__(self, secret, server='127.0.0.1', port=PORT, omshell=OMSHELL):
+		self.secret  = secret
+		self.server  = server
+		self.port    = port
+		self.omshell = omshell
+		self.script  = []
+
+	def _quote(self, value):
+		return '"%s"' % value.replace('\\', '\\\\').replace('"', '\\"')
+
+	def _open(self, name):
+		self.script.append('new host')
+		self.script.append('set name = %s' % self._quote(name))
+
+	def remove(self, name):
+		"""
+		Removes the host called name (if dhcpd has it).
+		"""
+		self._open(name)
+		self.script.append('open')
+		self.script.append('remove')
+
+	def add(self, name, mac, ip, statements=None):
+		"""
+		Adds a host called name, replacing any host of the same name.
+		The statements are dhcpd.conf statements for the host (e.g.
+		filename and next-server).
+		"""
+		self.remove(name)
+		self._open(name)
+		self.script.append('set hardware-address = %s' % mac)
+		self.script.append('set hardware-type = 1')
+		self.script.append('set ip-address = %s' % ip)
+		if statements:
+			self.script.append('set statements = %s' % self._quote(statements))
+		self.script.append('create')
+
+	def lookup(self, names):
+		"""
+		Returns a dictionary of name to (mac, ip) for the names dhcpd
+		has a host for.
+		"""
+		script = []
+		for name in names:
+			script.append('new host')
+			script.append('set name = %s' % self._quote(name))
+			script.append('open')
+
+		hosts = {}
+		name = mac = ip = None
+		for line in self._run(script).split('\n'):
+			line = line.strip()
+			if line.startswith('name = '):
+				if name:
+					hosts[name] = (mac, ip)
+				name = line[len('name = '):].strip('"')
+				mac = ip = None
+			elif line.startswith('hardware-address = '):
+				mac = line[len('hardware-address = '):].lower()
+			elif line.startswith('ip-address = '):
+				ip = '.'.join(str(int(x, 16)) for x in
+					      line[len('ip-address = '):].split(':'))
+		if name:
+			hosts[name] = (mac, ip)
+
+		# Only names dhcpd answered for count, omshell echoes the
+		# name we set before an open that fails.
+		return { n: v for n, v in hosts.items() if v[0] }
+
+	def commit(self):
+		"""
+		Sends the queued changes to dhcpd. Removing a host dhcpd doesn't
+		have is not an error, anything else that fails raises an
+		OMAPIError.
+		"""
+		script, self.script = self.script, []
+		if not script:
+			return
+
+		output = self._run(script)
+		for line in output.split('\n'):
+			if line.startswith("can't") and 'not found' not in line:
+				raise OMAPIError(line.strip())
+
+	def _run(self, script):
+		lines = [ 'server %s' % self.server,
+			  'port %d' % self.port,
+			  'key %s %s' % (KEY_NAME, self.secret),
+			  'connect' ]
+		lines.extend(script)
+
+		try:
+			p = subprocess.run([ self.omshell ],
+					   input='\n'.join(lines + [ '' ]).encode(),
+					   stdout=subprocess.PIPE,
+					   stderr=subprocess.STDOUT)
+		except OSError as e:
+			raise OMAPIError(str(e))
+
+		output = p.stdout.decode(errors='replace')
+		for line in output.split('\n'):
+			if line.startswith("can't") and 'connect' in line:
+				raise OMAPIError(line.strip())
+
+		return output
+
+
+if __name__ == '__main__':
+	# Called from the ExecStartPre of dhcpd with the leases file
+	for path in sys.argv[1:]:
+		stripLeases(path)
@@ -0,0 +1,176 @@
+# @copyright@
+# Copyright (c) 2006 - 2018 Teradata
+# All rights reserved. Stacki(r) v5.x stacki.com
+# https://github.com/Teradata/stacki/blob/master/LICENSE.txt
+# @copyright@
+
+import subprocess
+import syslog
+import threading
+import time
+
+import pymysql
+
+
+STACK	  = '/opt/stack/bin/stack'
+MY_CNF	  = '/etc/apache.my.cnf'
+
+# Attributes that only apply to the next install
+RESET	  = [ 'nukedisks', 'nukecontroller', 'secureerase' ]
+
+
+class Batch:
+	"""
+	Addresses of the nodes committed together. The requests of the
+	nodes wait on done, ok says whether the commit and sync worked.
+	"""
+
+	def __init__(self):
+		self.addrs = set()
+		self.done  = threading.Event()
+		self.ok	   = False
+
+
+class InstallComplete:
+	"""
+	WSGI application nodes call when they are done installing, so
+	they boot the OS from now on.
+
+	A request queues the address of the node in the current batch.
+	The first node queued starts a short window for the rest of its
+	rack to finish, then the whole batch is set to boot the OS in one
+	transaction followed by a single 'sync host boot'. Nodes done
+	while a batch is being committed make up the next batch.
+
+	A request only gets its 200 once its batch is committed and the
+	boot files are written. If that fails the node gets a 503, so it
+	calls again rather than installing on its next boot.
+	"""
+
+	# Seconds to wait for more nodes before committing a batch
+	WINDOW = 2
+
+	# Seconds a request waits for its batch
+	TIMEOUT = 120
+
+	def __init__(self, window=WINDOW, timeout=TIMEOUT):
+		self.window  = window
+		self.timeout = timeout
+		self.batch   = Batch()
+		self.cv	     = threading.Condition()
+		self.thread  = None
+
+	def __call__(self, environ, start_response):
+		addr = environ.get('REMOTE_ADDR')
+		if addr:
+			batch = self.queue(addr)
+			if batch.done.wait(self.timeout) and batch.ok:
+				status = '200 OK'
+			else:
+				status = '503 Service Unavailable'
+		else:
+			status = '200 OK'
+
+		start_response(status, [ ('Content-Type', 'text/plain'),
+					 ('Content-Length', '0') ])
+		return [ b'' ]
+
+	def queue(self, addr):
+		"""
+		Adds the address to the current batch and returns the batch.
+		"""
+		with self.cv:
+			self.batch.addrs.add(addr)
+			if not self.thread:
+				self.thread = threading.Thread(target=self.run,
+							       daemon=True)
+				self.thread.start()
+			self.cv.notify()
+			return self.batch
+
+	def run(self):
+		while True:
+			with self.cv:
+				while not self.batch.addrs:
+					self.cv.wait()
+
+			time.sleep(self.window)
+
+			with self.cv:
+				batch, self.batch = self.batch, Batch()
+
+			try:
+				hosts = self.commit(sorted(batch.addrs))
+				batch.ok = not hosts or self.sync(hosts)
+			except Exception as e:
+				syslog.syslog(syslog.LOG_ERR,
+					      'install complete of %d hosts failed: %s' %
+					      (len(batch.addrs), e))
+			finally:
+				batch.done.set()
+
+	def connect(self):
+		return pymysql.connect(db='cluster', read_default_file=MY_CNF)
+
+	def commit(self, addrs):
+		"""
+		Sets the hosts with the addresses to boot the OS and clears
+		their install only attributes, all in one transaction.
+		Returns the names of the hosts.
+		"""
+
+		db = self.connect()
+		try:
+			with db.cursor() as cursor:
+				cursor.execute("""
+					select distinct n.id, n.name from nodes n, networks nt
+					where nt.node = n.id and nt.ip in %s
+					""", (addrs,))
+				nodes = dict(cursor.fetchall())
+				if not nodes:
+					return []
+				ids = list(nodes)
+
+				cursor.execute("""
+					update boot set action = 'os' where node in %s
+					""", (ids,))
+				cursor.execute("""
+					insert into boot (node, action)
+					select n.id, 'os' from nodes n
+					left join boot b on b.node = n.id
+					where n.id in %s and b.node is null
+					""", (ids,))
+
+				cursor.execute("""
+					delete from attributes where scope = 'host'
+					and scopeid in %s and attr in %s
+					""", (ids, RESET))
+				cursor.executemany("""
+					insert into attributes (scope, attr, value, scopeid)
+					values ('host', %s, 'false', %s)
+					""", [ (attr, id) for id in ids for attr in RESET ])
+			db.commit()
+		except BaseException:
+			db.rollback()
+			raise
+		finally:
+			db.close()
+
+		syslog.syslog(syslog.LOG_INFO, 'install complete: %s' %
+			      ' '.join(sorted(nodes.values())))
+
+		return sorted(nodes.values())
+
+	def sync(self, hosts):
+		"""
+		Writes the boot files of the hosts. Returns False if that
+		failed.
+		"""
+		p = subprocess.run([ STACK, 'sync', 'host', 'boot' ] + hosts,
+				   stdout=subprocess.DEVNULL,
+				   stderr=subprocess.PIPE)
+		if p.returncode != 0:
+			syslog.syslog(syslog.LOG_ERR, 'sync host boot failed: %s' %
+				      p.stderr.decode(errors='replace'))
+			return False
+		return True
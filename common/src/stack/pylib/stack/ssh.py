@@ -0,0 +1,119 @@
+# @copyright@
+# Copyright (c) 2006 - 2018 Teradata
+# All rights reserved. Stacki(r) v5.x stacki.com
+# https://github.com/Teradata/stacki/blob/master/LICENSE.txt
+# @copyright@
+
+import os
+import json
+import shlex
+
+
+# Control sockets of the shared ssh connections, one per host (%C is
+# a hash of the local host, remote host, port and user).
+
+CONTROL_DIR = '/run/stack/ssh'
+
+
+def options(persist=None):
+	"""
+	Returns the list of ssh options to use for a connection.
+
+	If persist is a number of seconds greater than zero the
+	connection is shared (ControlMaster) and kept open for that long
+	after its last session ends, so running more commands on the
+	same host skips the key exchange and authentication.
+
+	:param persist: seconds to keep an idle connection open
+	:type persist: int or string
+	:returns: list of ssh arguments
+	"""
+	try:
+		persist = int(persist)
+	except (TypeError, ValueError):
+		persist = 0
+
+	if persist <= 0:
+		return []
+
+	os.makedirs(CONTROL_DIR, mode=0o700, exist_ok=True)
+
+	return [ '-o', 'ControlMaster=auto',
+		 '-o', 'ControlPath=%s/%%C' % CONTROL_DIR,
+		 '-o', 'ControlPersist=%d' % persist ]
+
+
+def optionString(persist=None):
+	"""
+	Same as options() but as a string for shell command lines.
+	"""
+	return ' '.join(options(persist))
+
+
+# The relay script is fed to python on a relay host over ssh's stdin.
+# It runs the command on each of its hosts (itself locally, the others
+# over ssh) and writes one JSON line per host back as each one
+# finishes.
+
+RELAY = r'''
+import concurrent.futures
+import json
+import os
+import subprocess
+import sys
+
+args = json.loads(sys.argv[1])
+if args['options']:
+	os.makedirs(args['control'], mode=0o700, exist_ok=True)
+
+def run(host):
+	if host == args['self']:
+		cmd = [ 'sh', '-c', args['cmd'] ]
+	else:
+		cmd = [ 'ssh', '-T', '-x', '-o', 'BatchMode=yes',
+			'-o', 'ConnectTimeout=2' ] + args['options'] + [ host, args['cmd'] ]
+	try:
+		p = subprocess.run(cmd, stdin=subprocess.DEVNULL,
+				   stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+				   timeout=args['timeout'] or None)
+		return (p.returncode, p.stdout)
+	except subprocess.TimeoutExpired as e:
+		return (-1, e.output or b'')
+
+with concurrent.futures.ThreadPoolExecutor(args['threads']) as pool:
+	futures = { pool.submit(run, host): host for host in args['hosts'] }
+	for future in concurrent.futures.as_completed(futures):
+		retval, output = future.result()
+		if retval == 255 and futures[future] != args['self']:
+			output = b'down'
+		print(json.dumps({ 'host'  : futures[future],
+				   'retval': retval,
+				   'output': output.decode(errors='replace').strip() }))
+		sys.stdout.flush()
+'''
+
+
+def relayCommand(relay, hosts, cmd, timeout=0, threads=32, persist=None):
+	"""
+	Returns the command line to run on a relay host so it runs cmd
+	on all of the hosts and streams the results back as JSON lines
+	of host, retval, and output. The relay script itself has to be
+	written to the stdin of the command.
+
+	:param relay: name of the relay host (as it knows itself)
+	:param hosts: list of host names for the relay to run cmd on
+	:param cmd: command to run
+	:param timeout: per host timeout in seconds (0 is none)
+	:param threads: number of hosts the relay works on at once
+	:param persist: see options()
+	:returns: shell command string
+	"""
+	args = json.dumps({ 'self'   : relay,
+			    'hosts'  : hosts,
+			    'cmd'    : cmd,
+			    'timeout': timeout,
+			    'threads': threads,
+			    'control': CONTROL_DIR,
+			    'options': options(persist) })
+
+	return '/opt/stack/bin/python3 - %s' % shlex.quote(args)
@@ -5,6 +5,7 @@
 # @copyright@
 
 
+import codecs
 import os
 import sys
 import requests
@@ -31,6 +32,7 @@ class StackWSClient:
 		self.url      = "http://%s/stack" % self.hostname
 		self.session  = None
 		self.logged_in= False
+		self.queued   = []
 
 	def login(self):
 		if not self.logged_in:
@@ -75,6 +77,102 @@ class StackWSClient:
 			out = resp.text
 			return out
 
+	def queue(self, cmd):
+		"""
+		Queues the command to be run by the next flush() instead
+		of running it now.
+		"""
+		if not self.logged_in:
+			self.login()
+		if cmd.startswith('load ') or \
+			cmd.startswith('unload '):
+			cmd = self.loadFile(cmd)
+		self.queued.append(cmd)
+
+	def flush(self, transaction=False):
+		"""
+		Runs the queued commands in a single request and returns a
+		list with the result of each one, in order. A result is a
+		dict with the command, its HTTP status and its output.
+
+		With transaction=True the commands are run as one database
+		transaction that stops and rolls back at the first failed
+		command, the results end with that command.
+		"""
+		if not self.logged_in:
+			self.login()
+
+		cmds = self.queued
+		self.queued = []
+		if not cmds:
+			return []
+
+		self.session.headers.update({"Content-Type": "application/json"})
+		js = json.dumps({"cmds":cmds, "transaction":transaction})
+		resp = self.session.post("%s/batch" % self.url, data = js)
+		resp.raise_for_status()
+
+		results = resp.json()
+		for result in results:
+			# Output of the commands run as root is
+			# still encoded, like run() gets it
+			if isinstance(result['output'], str):
+				try:
+					result['output'] = json.loads(result['output'])
+				except ValueError:
+					pass
+		return results
+
+	def submit(self, cmd):
+		"""
+		Queues the command as a job on the frontend and returns the
+		job, see job(), log() and cancel().
+		"""
+		if not self.logged_in:
+			self.login()
+		if cmd.startswith('load ') or \
+			cmd.startswith('unload '):
+			cmd = self.loadFile(cmd)
+
+		self.session.headers.update({"Content-Type": "application/json"})
+		js = json.dumps({"cmd":cmd, "async":True})
+		resp = self.session.post(self.url, data = js)
+		resp.raise_for_status()
+		return resp.json()
+
+	def job(self, job):
+		if not self.logged_in:
+			self.login()
+		resp = self.session.get("%s/jobs/%d" % (self.url, job))
+		resp.raise_for_status()
+		return resp.json()
+
+	def log(self, job):
+		"""
+		Yields the output of the job as it runs.
+		"""
+		if not self.logged_in:
+			self.login()
+		resp = self.session.get("%s/jobs/%d/log" % (self.url, job), stream=True)
+		resp.raise_for_status()
+
+		# A character can be split across chunks
+		decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+		for chunk in resp.iter_content(chunk_size=None):
+			text = decoder.decode(chunk)
+			if text:
+				yield text
+		text = decoder.decode(b'', final=True)
+		if text:
+			yield text
+
+	def cancel(self, job):
+		if not self.logged_in:
+			self.login()
+		resp = self.session.post("%s/jobs/%d/cancel" % (self.url, job))
+		resp.raise_for_status()
+		return resp.json()
+
 	def loadFile(self, cmd):
 		c = cmd.split()
 		filename = None
@@ -0,0 +1,154 @@
+#
+# @copyright@
+# Copyright (c) 2006 - 2018 Teradata
+# All rights reserved. Stacki(r) v5.x stacki.com
+# https://github.com/Teradata/stacki/blob/master/LICENSE.txt
+# @copyright@
+#
+
+"""
+ETags for the read-only commands the dashboards poll. The tag is made
+from the command line and a watermark of the database, so a poller
+sending it back in If-None-Match gets a 304 without the command being
+run as long as nothing has been written since.
+"""
+
+import collections
+import hashlib
+import json
+import time
+
+import pymysql
+
+# Commands whose output only changes when the database does. The
+# host status comes from redis, the health processor bumps a version
+# key there when a status changes.
+CACHEABLE = {
+	'list.appliance',
+	'list.host',
+	'list.host.attr',
+	'list.host.group',
+	'list.host.interface',
+	'list.host.status',
+	'list.network',
+}
+
+STATUS = {
+	'list.host.status',
+}
+
+
+def etag(db_conn, cmd_module, args, admin):
+	"""
+	Returns the ETag for the command, or None if its output can't be
+	cached.
+	"""
+
+	if cmd_module not in CACHEABLE:
+		return None
+
+	# list host hash=true also reads the install hashes in redis
+	if [ arg for arg in args if arg.startswith('hash=') ]:
+		return None
+
+	try:
+		version = [ watermark(db_conn) ]
+	except pymysql.Error:
+		return None
+
+	if cmd_module in STATUS:
+		status = status_version()
+		if status is None:
+			return None
+		version.append(status)
+
+	m = hashlib.md5()
+	m.update(json.dumps([ cmd_module, args, bool(admin), version ]).encode())
+	return '"%s"' % m.hexdigest()
+
+
+def watermark(db_conn):
+	"""
+	Returns the server counters of changed rows and commits. They go
+	up on every write to any table (Com_commit catches writes made
+	inside a transaction becoming visible), and start over when the
+	server restarts so its start time is part of the watermark.
+	"""
+
+	with db_conn.cursor() as cursor:
+		cursor.execute("""
+			show global status where variable_name in
+			('Uptime', 'Com_commit', 'Innodb_rows_inserted',
+			 'Innodb_rows_updated', 'Innodb_rows_deleted')
+			""")
+		status = { name.lower(): int(value) for (name, value) in cursor.fetchall() }
+
+	started = (int(time.time()) - status.pop('uptime', 0)) // 60
+
+	return [ started ] + [ status[name] for name in sorted(status) ]
+
+
+def status_version():
+	import redis
+
+	try:
+		r = redis.StrictRedis(host='localhost')
+		version = r.get('host:status:version')
+		# Status keys expiring changes the number of keys
+		size = r.dbsize()
+	except redis.exceptions.ConnectionError:
+		return None
+
+	if version is not None:
+		version = version.decode()
+
+	return [ version, size ]
+
+
+def ifNoneMatch(request):
+	"""
+	Returns the ETags in the If-None-Match header of the request.
+	"""
+
+	tags = []
+	for tag in request.META.get('HTTP_IF_NONE_MATCH', '').split(','):
+		tag = tag.strip()
+		if tag.startswith('W/'):
+			tag = tag[2:]
+		if tag:
+			tags.append(tag)
+	return tags
+
+
+class OutputStream:
+	"""
+	What a command writes as it produces its output, handed to the
+	HTTP response in chunks as it is sent.
+	"""
+
+	size = 64 * 1024
+
+	def __init__(self):
+		self.chunks = collections.deque()
+		self.buffer = []
+		self.length = 0
+
+	def write(self, s):
+		self.buffer.append(s)
+		self.length += len(s)
+		if self.length >= self.size:
+			self.flush()
+
+	def flush(self):
+		if self.buffer:
+			self.chunks.append(''.join(self.buffer))
+			self.buffer = []
+			self.length = 0
+
+	def __bool__(self):
+		return bool(self.chunks or self.buffer)
+
+	def __iter__(self):
+		self.flush()
+		while self.chunks:
+			yield self.chunks.popleft()
@@ -0,0 +1,109 @@
+#
+# @copyright@
+# Copyright (c) 2006 - 2018 Teradata
+# All rights reserved. Stacki(r) v5.x stacki.com
+# https://github.com/Teradata/stacki/blob/master/LICENSE.txt
+# @copyright@
+#
+
+import contextlib
+import threading
+
+import pymysql
+from pymysql.constants import SERVER_STATUS
+
+
+# Create Connections to the database, and return
+# connection based on the administrative privilege.
+# Use this instead of Django's internal database
+# management. Django's internal DB management
+# creates a layer between the user and the DB
+# and wraps up certain functions. We need direct
+# access to the database layer.
+
+def connect(admin=False):
+	if admin is True:
+		username = 'apache'
+		# Get Cluster username and password
+		cluster_conf = open("/etc/apache.my.cnf", 'r')
+		password = ''
+		for line in cluster_conf:
+			l = line.split("=")
+			if len(l) == 2:
+				if l[0].strip() == 'password':
+					password = l[1].strip()
+		cluster_conf.close()
+	else:
+		username = 'nobody'
+		password = ''
+
+	link = pymysql.connect(user=username,
+			       passwd=password,
+			       unix_socket='/var/run/mysql/mysql.sock',
+			       db='cluster',
+			       autocommit=True)
+	return link
+
+
+class Pool:
+	"""
+	Database connections kept open between requests by each web
+	server process, one set for the admin users and one for
+	everyone else. Connecting costs more than most of the commands
+	run through the API.
+	"""
+
+	def __init__(self, size=8):
+		self.size = size
+		self.lock = threading.Lock()
+		self.idle = {True: [], False: []}
+
+	@contextlib.contextmanager
+	def connection(self, admin=False):
+		"""
+		Lends out a connection for the length of the with block.
+		"""
+
+		admin = bool(admin)
+		link  = None
+
+		with self.lock:
+			if self.idle[admin]:
+				link = self.idle[admin].pop()
+
+		# Idle connections may have been dropped by the server
+		# (wait_timeout, restart), ping brings them back.
+		if link:
+			try:
+				link.ping(reconnect=True)
+			except pymysql.Error:
+				link = None
+		if not link:
+			link = connect(admin=admin)
+
+		try:
+			yield link
+		finally:
+			self.release(link, admin)
+
+	def release(self, link, admin):
+		try:
+			# Never hand out a connection in the middle of
+			# somebody else's transaction.
+			if link.server_status & SERVER_STATUS.SERVER_STATUS_IN_TRANS:
+				link.rollback()
+		except pymysql.Error:
+			self.close(link)
+			return
+
+		with self.lock:
+			if len(self.idle[admin]) < self.size:
+				self.idle[admin].append(link)
+				return
+		self.close(link)
+
+	def close(self, link):
+		try:
+			link.close()
+		except pymysql.Error:
+			pass
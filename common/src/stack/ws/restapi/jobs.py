@@ -0,0 +1,303 @@
+#
+# @copyright@
+# Copyright (c) 2006 - 2018 Teradata
+# All rights reserved. Stacki(r) v5.x stacki.com
+# https://github.com/Teradata/stacki/blob/master/LICENSE.txt
+# @copyright@
+#
+
+"""
+Background jobs for the REST API. A command posted with "async" is
+queued in the Job table and the request returns right away with the
+job id, the worker run by the stack-ws-jobs service picks it up and
+runs it with the stack command line, writing its output to a log.
+
+A command submitted while an identical one is still queued becomes
+that job, so five "sync config" requests in a row make one run.
+"""
+
+import hashlib
+import json
+import os
+import pwd
+import signal
+import subprocess
+import sys
+import syslog
+import time
+
+STACK  = '/opt/stack/bin/stack'
+LOGDIR = '/var/log/stack/ws-jobs'
+USER   = 'apache'
+
+QUEUED    = 'queued'
+RUNNING   = 'running'
+DONE      = 'done'
+FAILED    = 'failed'
+CANCELLED = 'cancelled'
+
+FINISHED  = (DONE, FAILED, CANCELLED)
+
+
+def key(user, cmd_module, args, admin, root):
+	"""
+	Jobs with the same key are the same work. Admin jobs are shared
+	by all the admins, everyone else only shares with themselves.
+	"""
+
+	m = hashlib.sha256()
+	m.update(json.dumps([ cmd_module, args, admin, root,
+			      None if admin else user ]).encode())
+	return m.hexdigest()
+
+
+def submit(user, cmd_module, args, admin=False, root=False):
+	"""
+	Queues the command and returns the job, and whether it was
+	folded into a job already queued.
+	"""
+
+	from django.db import IntegrityError, transaction
+	from stack.restapi.models import Job
+
+	k = key(user, cmd_module, args, admin, root)
+
+	while True:
+		try:
+			with transaction.atomic():
+				job = Job.objects.create(user=user,
+							 command=cmd_module,
+							 args=json.dumps(args),
+							 admin=admin,
+							 root=root,
+							 key=k)
+			return job, False
+		except IntegrityError:
+			pass
+
+		# The key is only unique while the job is queued, if
+		# the worker took it in the meantime try again
+		try:
+			return Job.objects.get(key=k), True
+		except Job.DoesNotExist:
+			continue
+
+
+def cancel(job):
+	"""
+	Cancels a queued job right away, a running one is stopped by
+	its worker.
+	"""
+
+	from django.utils import timezone
+	from stack.restapi.models import Job
+
+	if Job.objects.filter(id=job.id, status=QUEUED).update(status=CANCELLED,
+								key=None,
+								finished=timezone.now()):
+		return
+	Job.objects.filter(id=job.id, status=RUNNING).update(cancel=True)
+
+
+def logfile(job, logdir=None):
+	return os.path.join(logdir or LOGDIR, '%d.log' % job.id)
+
+
+def follow(job, logdir=None, interval=0.5):
+	"""
+	Yields the log of the job as it is written until the job is
+	finished.
+	"""
+
+	from stack.restapi.models import Job
+
+	path   = logfile(job, logdir)
+	offset = 0
+	while True:
+		# Check before reading so the last of the output
+		# isn't missed
+		finished = Job.objects.filter(id=job.id, status__in=FINISHED).exists()
+
+		if os.path.exists(path):
+			with open(path, 'rb') as f:
+				f.seek(offset)
+				data = f.read()
+			if data:
+				offset += len(data)
+				yield data
+
+		if finished:
+			return
+		time.sleep(interval)
+
+
+def describe(job):
+	def isoformat(t):
+		return t.isoformat() if t else None
+
+	return {
+		'job':       job.id,
+		'user':      job.user,
+		'cmd':       job.command.replace('.', ' '),
+		'args':      json.loads(job.args),
+		'status':    job.status,
+		'rc':        job.rc,
+		'submitted': isoformat(job.submitted),
+		'started':   isoformat(job.started),
+		'finished':  isoformat(job.finished)
+		}
+
+
+class Worker:
+	"""
+	Runs the queued jobs one at a time, oldest first. More than one
+	worker can share the queue, a job is claimed with an update only
+	one of them can win.
+	"""
+
+	def __init__(self, stack=None, logdir=None, interval=1.0):
+		self.stack    = stack or STACK
+		self.logdir   = logdir or LOGDIR
+		self.interval = interval
+
+	def serve(self):
+		from django.db import close_old_connections
+
+		self.recover()
+		while True:
+			close_old_connections()
+			job = self.claim()
+			if job:
+				self.run(job)
+			else:
+				time.sleep(self.interval)
+
+	def recover(self):
+		"""
+		Jobs left running by a worker that went away have failed.
+		Until its command starts a job has the pid of the worker
+		that claimed it, so one that died before starting the
+		command is caught too.
+		"""
+
+		from django.utils import timezone
+		from stack.restapi.models import Job
+
+		for job in Job.objects.filter(status=RUNNING):
+			if job.pid is not None:
+				try:
+					os.kill(job.pid, 0)
+					continue
+				except ProcessLookupError:
+					pass
+			Job.objects.filter(id=job.id, status=RUNNING).update(status=FAILED,
+									     finished=timezone.now())
+
+	def claim(self):
+		from django.utils import timezone
+		from stack.restapi.models import Job
+
+		for job in Job.objects.filter(status=QUEUED).order_by('id')[:10]:
+			if Job.objects.filter(id=job.id, status=QUEUED).update(status=RUNNING,
+									       key=None,
+									       pid=os.getpid(),
+									       started=timezone.now()):
+				return Job.objects.get(id=job.id)
+		return None
+
+	def run(self, job):
+		from django.utils import timezone
+		from stack.restapi.models import Job
+
+		argv = [ self.stack ]
+		argv.extend(job.command.split('.'))
+		argv.extend(json.loads(job.args))
+
+		# Commands from the sudo list run as root, the rest
+		# with the database access the API would have given
+		if job.root:
+			user = 'root'
+		elif job.admin:
+			user = 'apache'
+		else:
+			user = 'nobody'
+
+		log = self.openLog(job)
+		syslog.syslog(syslog.LOG_INFO, f'job {job.id}: {argv} as {user}')
+		try:
+			p = subprocess.Popen(argv,
+					     stdin=subprocess.DEVNULL,
+					     stdout=log,
+					     stderr=subprocess.STDOUT,
+					     preexec_fn=self.demote(user),
+					     start_new_session=True)
+		except OSError as e:
+			log.write(('%s\n' % e).encode())
+			log.close()
+			Job.objects.filter(id=job.id).update(status=FAILED,
+							     finished=timezone.now())
+			return
+		log.close()
+
+		Job.objects.filter(id=job.id).update(pid=p.pid)
+
+		cancelled = False
+		while True:
+			try:
+				rc = p.wait(timeout=self.interval)
+				break
+			except subprocess.TimeoutExpired:
+				pass
+			if not cancelled and Job.objects.filter(id=job.id, cancel=True).exists():
+				cancelled = True
+				try:
+					os.killpg(p.pid, signal.SIGTERM)
+				except ProcessLookupError:
+					pass
+
+		if cancelled:
+			status = CANCELLED
+		elif rc == 0:
+			status = DONE
+		else:
+			status = FAILED
+
+		Job.objects.filter(id=job.id).update(status=status,
+						     rc=rc,
+						     finished=timezone.now())
+
+	def openLog(self, job):
+		os.makedirs(self.logdir, mode=0o750, exist_ok=True)
+		log = open(logfile(job, self.logdir), 'wb')
+
+		# The web server streams the log back to the client
+		if os.geteuid() == 0:
+			gid = pwd.getpwnam(USER).pw_gid
+			os.chown(self.logdir, 0, gid)
+			os.fchown(log.fileno(), 0, gid)
+			os.fchmod(log.fileno(), 0o640)
+
+		return log
+
+	def demote(self, user):
+		if user == 'root' or os.geteuid() != 0:
+			return None
+
+		pw = pwd.getpwnam(user)
+		def preexec():
+			os.setgroups([])
+			os.setgid(pw.pw_gid)
+			os.setuid(pw.pw_uid)
+		return preexec
+
+
+def main():
+	syslog.openlog('stack-ws-jobs', syslog.LOG_PID, syslog.LOG_LOCAL2)
+
+	import stack.django_env
+
+	Worker().serve()
+
+
+if __name__ == '__main__':
+	sys.exit(main())
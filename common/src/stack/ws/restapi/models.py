@@ -38,3 +38,24 @@ class SudoList(models.Model):
 	is required when run.
 	"""
 	command = models.CharField(max_length=1024)
+
+class Job(models.Model):
+	"""
+	Model that stores the commands run in the
+	background by the job worker (stack.restapi.jobs).
+	"""
+	user = models.CharField(max_length=150)
+	command = models.CharField(max_length=1024)
+	args = models.TextField()
+	admin = models.BooleanField(default=False)
+	root = models.BooleanField(default=False)
+	# Set while the job is queued, identical commands
+	# submitted meanwhile become this job
+	key = models.CharField(max_length=64, null=True, unique=True)
+	status = models.CharField(max_length=16, default='queued')
+	rc = models.IntegerField(null=True)
+	pid = models.IntegerField(null=True)
+	cancel = models.BooleanField(default=False)
+	submitted = models.DateTimeField(auto_now_add=True)
+	started = models.DateTimeField(null=True)
+	finished = models.DateTimeField(null=True)
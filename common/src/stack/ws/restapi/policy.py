@@ -0,0 +1,70 @@
+#
+# @copyright@
+# Copyright (c) 2006 - 2018 Teradata
+# All rights reserved. Stacki(r) v5.x stacki.com
+# https://github.com/Teradata/stacki/blob/master/LICENSE.txt
+# @copyright@
+#
+
+import re
+import threading
+
+from django.db import connection
+
+from stack.restapi.models import BlackList
+from stack.restapi.models import SudoList
+
+
+class Policy:
+	"""
+	The blacklisted and sudo commands of the REST API as compiled
+	regular expressions. The lists are changed by other processes
+	(the add/remove api commands) so each check asks the database for
+	a checksum of both tables and only reads and compiles them again
+	when it is different.
+	"""
+
+	def __init__(self):
+		self.lock      = threading.Lock()
+		self.checksum  = None
+		self.blacklist = []
+		self.sudolist  = []
+
+	def refresh(self):
+		checksum = self.version()
+		if checksum == self.checksum:
+			return
+
+		with self.lock:
+			self.blacklist = self.load(BlackList)
+			self.sudolist  = self.load(SudoList)
+			self.checksum  = checksum
+
+	def version(self):
+		with connection.cursor() as cursor:
+			cursor.execute(' union all '.join([
+				'select count(*), max(id), bit_xor(crc32(command)) from %s' % model._meta.db_table
+				for model in (BlackList, SudoList) ]))
+			return tuple(cursor.fetchall())
+
+	def load(self, model):
+		patterns = []
+		for cmd in model.objects.values_list('command', flat=True):
+			# Make sure to match the module names
+			cmd = re.sub('[ \t]+', '.', cmd)
+			patterns.append(re.compile(str(cmd)))
+		return patterns
+
+	def matches(self, patterns, mod):
+		for r in patterns:
+			m = r.match(mod)
+			# Match the exact command
+			if m and m.group() == mod:
+				return True
+		return False
+
+	def blacklisted(self, mod):
+		return self.matches(self.blacklist, mod)
+
+	def sudo(self, mod):
+		return self.matches(self.sudolist, mod)
@@ -0,0 +1,208 @@
+#
+# @copyright@
+# Copyright (c) 2006 - 2018 Teradata
+# All rights reserved. Stacki(r) v5.x stacki.com
+# https://github.com/Teradata/stacki/blob/master/LICENSE.txt
+# @copyright@
+#
+
+"""
+Runs the REST API commands that need root (the sudo list) for the
+web server, instead of starting "sudo stack ..." for every request.
+
+The server runs as root and listens on a unix socket only the apache
+user can connect to. Each request is run by a child forked from the
+server, the interpreter, Django and the stack command modules are
+already loaded so the command starts right away.
+"""
+
+import contextlib
+import importlib
+import io
+import json
+import os
+import pwd
+import socket
+import socketserver
+import struct
+import sys
+import syslog
+import tempfile
+import traceback
+
+SOCKET = '/var/run/stack/ws-privileged.sock'
+USER   = 'apache'
+
+
+def run(cmd_module, args):
+	"""
+	Runs the command in the privileged server and returns the exit
+	code, output and error text like the stack command line would.
+	Raises FileNotFoundError or ConnectionRefusedError when the server
+	is not running.
+	"""
+
+	request = json.dumps({'cmd': cmd_module, 'args': args})
+
+	with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+		s.connect(SOCKET)
+		s.sendall(request.encode() + b'\n')
+		s.shutdown(socket.SHUT_WR)
+		response = b''.join(iter(lambda: s.recv(65536), b''))
+
+	if not response:
+		return -1, '', 'error - privileged server closed the connection\n'
+
+	response = json.loads(response)
+	return response['rc'], response['output'], response['error']
+
+
+@contextlib.contextmanager
+def captured():
+	"""
+	Sends everything written to stdout and stderr in the block to
+	temporary files, including what subprocesses write. Yields a
+	list that has the stdout and stderr text once the block is done.
+	"""
+
+	files	= [ tempfile.TemporaryFile(), tempfile.TemporaryFile() ]
+	saved	= [ os.dup(1), os.dup(2) ]
+	streams = (sys.stdout, sys.stderr)
+	text	= []
+
+	sys.stdout.flush()
+	sys.stderr.flush()
+	os.dup2(files[0].fileno(), 1)
+	os.dup2(files[1].fileno(), 2)
+
+	# Unbuffered, so the text stays in order with what
+	# subprocesses write
+	(sys.stdout, sys.stderr) = [ io.TextIOWrapper(open(fd, 'wb', buffering=0, closefd=False),
+						      write_through=True) for fd in (1, 2) ]
+	try:
+		yield text
+	finally:
+		(sys.stdout, sys.stderr) = streams
+		for fd in (1, 2):
+			os.dup2(saved[fd - 1], fd)
+			os.close(saved[fd - 1])
+		for f in files:
+			f.seek(0)
+			text.append(f.read().decode(errors='replace'))
+			f.close()
+
+
+class Handler(socketserver.StreamRequestHandler):
+
+	def handle(self):
+		creds = self.request.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED,
+						struct.calcsize('3i'))
+		(pid, uid, gid) = struct.unpack('3i', creds)
+		if uid not in self.server.uids:
+			syslog.syslog(syslog.LOG_WARNING, f'refused request from uid {uid}')
+			return
+
+		request = json.loads(self.rfile.readline())
+		(rc, output, error) = self.server.execute(request['cmd'], request['args'])
+
+		self.wfile.write(json.dumps({
+			'rc':     rc,
+			'output': output,
+			'error':  error
+			}).encode())
+
+
+class Server(socketserver.ForkingMixIn, socketserver.UnixStreamServer):
+
+	def __init__(self, path=SOCKET, user=USER):
+		from stack.restapi.policy import Policy
+
+		self.policy = Policy()
+		self.user   = pwd.getpwnam(user)
+		self.uids   = (0, self.user.pw_uid)
+
+		os.makedirs(os.path.dirname(path), exist_ok=True)
+		if os.path.exists(path):
+			os.unlink(path)
+
+		super().__init__(path, Handler)
+
+		# Only the web server may talk to us
+		os.chown(path, self.user.pw_uid, 0)
+		os.chmod(path, 0o600)
+
+	def execute(self, cmd_module, args):
+		"""
+		Runs in the forked child. The sudo list is checked again
+		here, the web server is not trusted to have done it.
+
+		What the command prints itself (or its subprocesses do) comes
+		before its text in the output, and what it writes to stderr
+		before the error, the same as "sudo stack ..." had them.
+		"""
+
+		cmd = cmd_module.replace('.', ' ')
+
+		self.policy.refresh()
+		if cmd_module == 'run.host' or self.policy.blacklisted(cmd_module) \
+		   or not self.policy.sudo(cmd_module):
+			return -1, '', f'error - command "{cmd}" is not permitted\n'
+
+		with captured() as printed:
+			(rc, output, error) = self.command(cmd_module, cmd, args)
+
+		return rc, printed[0] + output, printed[1] + error
+
+	def command(self, cmd_module, cmd, args):
+		"""
+		Runs the command and returns its exit code, text and error.
+		"""
+
+		from stack.restapi.db import connect
+		from stack.exception import CommandError
+
+		try:
+			module  = importlib.import_module(f'stack.commands.{cmd_module}')
+			command = module.Command(connect(admin=True))
+			rc      = command.runWrapper(cmd, args)
+		except CommandError as e:
+			syslog.syslog(syslog.LOG_ERR, '%s' % e)
+			return -1, '', '%s\n' % e
+		except Exception:
+			error = traceback.format_exc()
+			syslog.syslog(syslog.LOG_ERR, error)
+			return -1, '', error
+
+		text = command.getText()
+		if text and not text.endswith('\n'):
+			text += '\n'
+
+		return (0 if rc is True else -1), text, ''
+
+
+def main():
+	syslog.openlog('stack-ws-privileged', syslog.LOG_PID, syslog.LOG_LOCAL2)
+
+	import stack.django_env
+	import stack.commands
+
+	# Load the command verbs in the sudo list up front so the
+	# children do not all have to
+	from stack.restapi.models import SudoList
+	for cmd in SudoList.objects.values_list('command', flat=True):
+		try:
+			importlib.import_module('stack.commands.%s' % cmd.split()[0])
+		except ImportError:
+			pass
+
+	# Children open their own connection, they cannot share ours
+	from django.db import connections
+	connections.close_all()
+
+	server = Server()
+	syslog.syslog(syslog.LOG_INFO, f'listening on {SOCKET}')
+	server.serve_forever()
+
+
+if __name__ == '__main__':
+	sys.exit(main())
@@ -12,6 +12,9 @@ ftoken = '[A-Za-z0-9_\-\.\/]*'
 
 urlpatterns = [
     url(r'^$', StackWS.as_view()),
+    url(r'^batch$', StackBatchWS.as_view()),
+    url(r'^jobs/(?P<job>[0-9]+)$', StackJobWS.as_view()),
+    url(r'^jobs/(?P<job>[0-9]+)/(?P<action>[a-z]+)$', StackJobWS.as_view()),
     url(r'^login$',log_in),
     url(r'^logout$',log_out),
     url(r'^user$',check_user),
@@ -8,13 +8,19 @@
 
 from django.views.generic import View
 from django.http import HttpResponse, HttpResponseForbidden
+from django.http import HttpResponseNotModified, StreamingHttpResponse
 from django.utils.decorators import method_decorator
 from django.views.decorators.csrf import ensure_csrf_cookie
 from django.contrib.auth import authenticate, login, logout
 
-from stack.restapi.models import BlackList
-from stack.restapi.models import SudoList
+from stack.restapi.db import Pool
+from stack.restapi.policy import Policy
+from stack.restapi.cache import OutputStream
+from stack.restapi.models import Job
+import stack.restapi.cache
+import stack.restapi.jobs
 from stack.exception import CommandError
+import stack.restapi.privileged
 import stack.commands
 
 import pymysql
@@ -26,7 +32,6 @@ import subprocess
 
 import logging
 import shlex
-import re
 
 import traceback
 
@@ -37,9 +42,17 @@ log = logging.getLogger("stack-ws")
 # from: https://mariadb.com/kb/en/mariadb/mariadb-error-codes/
 MYSQL_EX = [1044, 1045, 1142, 1143, 1227]
 
+# Database connections and the blacklist / sudo list are kept
+# by each web server process across requests.
+pool   = Pool()
+policy = Policy()
+
 
 class StackWS(View):
 
+	# Answer If-None-Match for the read-only commands
+	cacheable = True
+
 	# Decorator Function to check if a user is logged in
 	def _check_login_(func):
 		def runner(inst, *args, **kwargs):
@@ -63,10 +76,29 @@ class StackWS(View):
 	# Main POST Function. Runs the actual Stacki Command Line
 	@_check_login_
 	def post(self, request):
+		# Check to see if the user is a superuser
+		admin = request.user.is_superuser
+
+		# Borrow a database connection for the request
+		with pool.connection(admin=admin) as db_conn:
+			return self._run(request, db_conn)
+
+	def _run(self, request, db_conn):
 		body = json.loads(request.body)
 
 		# Get the command being used
 		cmd = str(body['cmd'])
+
+		# Long running commands can be queued for the
+		# job worker instead
+		background = bool(body.get('async', False))
+
+		return self._execute(request, db_conn, cmd, background=background)
+
+	# Run a single command and return its HTTP response. Commands
+	# run as root are refused when privileged is False, and with
+	# background the command is queued as a job.
+	def _execute(self, request, db_conn, cmd, privileged=True, background=False):
 		args = shlex.split(cmd)
 
 		# Log to file
@@ -82,15 +114,12 @@ class StackWS(View):
 		command = None
 		cmd_arg_list = []
 
-		# Check to see if the user is a superuser
-		admin = request.user.is_superuser
-
-		# Get the database connection
-		db_conn = _get_db_conn_(admin=admin)
-
 		# Get the command module to execute
 		mod_name = '.'.join(args)
 
+		# Pick up any changes to the blacklist and sudo list
+		policy.refresh()
+
 		log.info(f'user {request.user.username} called "{mod_name}" {params}')
 
 		# Check if command is blacklisted
@@ -166,21 +195,17 @@ class StackWS(View):
 				cmd_str = cmd_module.replace('.', ' ')
 				return HttpResponseForbidden(f"Command \"{cmd_str}\" requires Admin Privileges" ,
 							     content_type="text/plain")
-			# Run the sync command using sudo
+			# Commands run as root use their own database
+			# connection and can't be part of a transaction
+			elif not privileged:
+				cmd_str = cmd_module.replace('.', ' ')
+				return HttpResponseForbidden(f"Command \"{cmd_str}\" cannot run inside a transaction",
+							     content_type="text/plain")
+			elif background:
+				return self._submit(request, cmd_module, cmd_arg_list, root=True)
+			# Run the sync command as root
 			else:
-				c = [
-					"/usr/bin/sudo",
-					"/opt/stack/bin/stack",
-				]
-				c.extend(cmd_module.split('.'))
-				c.extend(cmd_arg_list)
-				log.info(f'{c}')
-				p = subprocess.Popen(c, 
-						     stdout=subprocess.PIPE,
-						     stderr=subprocess.PIPE,
-						     encoding='utf-8')
-				o, e = p.communicate()
-				rc = p.wait()
+				rc, o, e = self._runPrivileged(cmd_module, cmd_arg_list)
 				if rc:
 					j = {"API Error": e, "Output": o}
 					return HttpResponse(str(json.dumps(j)),
@@ -194,7 +219,25 @@ class StackWS(View):
 							    status=200)
 		# If it's not the sync command, run the
 		# command module wrapper directly.
+		elif background:
+			return self._submit(request, cmd_module, cmd_arg_list, root=False)
 		else:
+			# Pollers get a 304 without the command being
+			# run while nothing it reads has changed
+			etag = None
+			if self.cacheable:
+				etag = stack.restapi.cache.etag(db_conn, cmd_module, cmd_arg_list,
+								request.user.is_superuser)
+			if etag and etag in stack.restapi.cache.ifNoneMatch(request):
+				response = HttpResponseNotModified()
+				response['ETag'] = etag
+				return response
+
+			# Json output is sent as the command writes it
+			# instead of being read back in and encoded again
+			stream = OutputStream()
+			command.stream = stream
+
 			try:
 				rc = command.runWrapper(cmd_module, cmd_arg_list)
 			# If we hit a database error, check if it's an access
@@ -225,80 +268,183 @@ class StackWS(View):
 						    content_type='application/json',
 						    status=500)
 
-			# Get output from command
-			text = command.getText()
-			
-			if not text:
-				text = {}
-
-			# Check to see if text is json
-			try:
-				j = json.loads(text)
-			except:
-				j = {"Output": text}
-			return HttpResponse(str(json.dumps(j)),
-					    content_type="application/json")
+			if stream:
+				response = StreamingHttpResponse(stream,
+								 content_type="application/json")
+			else:
+				# Get output from command
+				text = command.getText()
+
+				if not text:
+					text = {}
+
+				# Check to see if text is json
+				try:
+					j = json.loads(text)
+				except (TypeError, ValueError):
+					j = {"Output": text}
+				response = HttpResponse(str(json.dumps(j)),
+							content_type="application/json")
+
+			if etag:
+				response['ETag'] = etag
+			return response
+
+	# Queue the command for the job worker and return the job
+	def _submit(self, request, cmd_module, cmd_arg_list, root):
+		job, coalesced = stack.restapi.jobs.submit(request.user.username,
+							   cmd_module, cmd_arg_list,
+							   admin=request.user.is_superuser,
+							   root=root)
+		log.info(f'job {job.id} for "{cmd_module}" {cmd_arg_list}')
+
+		j = stack.restapi.jobs.describe(job)
+		j['coalesced'] = coalesced
+		return HttpResponse(str(json.dumps(j)),
+				    content_type="application/json",
+				    status=202)
+
+	# Run a sudo command in the privileged server, or
+	# through sudo if the server isn't running
+	def _runPrivileged(self, cmd_module, cmd_arg_list):
+		try:
+			return stack.restapi.privileged.run(cmd_module, cmd_arg_list)
+		except (FileNotFoundError, ConnectionRefusedError) as e:
+			log.warning(f'privileged server unavailable ({e}), using sudo')
+
+		c = [
+			"/usr/bin/sudo",
+			"/opt/stack/bin/stack",
+		]
+		c.extend(cmd_module.split('.'))
+		c.extend(cmd_arg_list)
+		log.info(f'{c}')
+		p = subprocess.Popen(c,
+				     stdout=subprocess.PIPE,
+				     stderr=subprocess.PIPE,
+				     encoding='utf-8')
+		o, e = p.communicate()
+		rc = p.wait()
+		return rc, o, e
 
 	# Check if command is blacklisted
 	def _blacklisted(self, mod):
-		# Get all blacklisted commands
-		c = BlackList.objects.values("command")
-		# Get actual command values
-		bl = map(lambda x: x['command'], c)
-		for cmd in bl:
-			# Make sure to match the module names
-			cmd = re.sub('[ \t]+', '.', cmd)
-			r = re.compile(str(cmd))
-			m = r.match(mod)
-			if m:
-				# Match the exact blacklisted command
-				if m.group() == mod:
-					return True
-		return False
+		return policy.blacklisted(mod)
 
 	def _isSudoCommand(self, mod):
-		# Get a list of all sudo commands
-		c = SudoList.objects.values("command")
-		sl = [ i['command'] for i in c ]
-		for cmd in sl:
-			cmd = re.sub('[ \t]+', '.', cmd)
-			r = re.compile(str(cmd))
-			m = r.match(mod)
-			if m and m.group() == mod:
-				return True
-
-		return False
-	
-# Create Connections to the database, and return
-# connection based on the administrative privilege.
-# Use this instead of Django's internal database
-# management. Django's internal DB management
-# creates a layer between the user and the DB
-# and wraps up certain functions. We need direct
-# access to the database layer.
-
-
-def _get_db_conn_(admin=False):
-	if admin is True:
-		username = 'apache'
-		# Get Cluster username and password
-		cluster_conf = open("/etc/apache.my.cnf", 'r')
-		password = ''
-		for line in cluster_conf:
-			l = line.split("=")
-			if len(l) == 2:
-				if l[0].strip() == 'password':
-					password = l[1].strip()
-	else:
-		username = 'nobody'
-		password = ''
-
-	link = pymysql.connect(user=username,
-			       passwd=password,
-			       unix_socket='/var/run/mysql/mysql.sock',
-			       db='cluster', 
-			       autocommit=True)
-	return link
+		return policy.sudo(mod)
+
+
+
+class Rollback(Exception):
+	pass
+
+
+class StackBatchWS(StackWS):
+	"""
+	Runs a list of commands in one request, on one database
+	connection, and returns the result of each. The body is
+
+		{"cmds": ["set host attr ...", ...], "transaction": false}
+
+	With "transaction" set the commands run as one database
+	transaction, the first failed command rolls back the ones
+	before it and the rest are not run. Each result has the command,
+	the HTTP status it would have had on its own and its output.
+	"""
+
+	# The ETags would be for the batch, not the commands
+	cacheable = False
+
+	def _run(self, request, db_conn):
+		body = json.loads(request.body)
+
+		cmds = [ str(cmd) for cmd in body['cmds'] ]
+		transaction = bool(body.get('transaction', False))
+
+		results = []
+		if not transaction:
+			for cmd in cmds:
+				results.append(self._result(request, db_conn, cmd))
+		else:
+			db = stack.commands.DatabaseConnection(db_conn)
+			try:
+				with db.transaction():
+					for cmd in cmds:
+						result = self._result(request, db_conn, cmd,
+								      privileged=False)
+						results.append(result)
+						if result['status'] != 200:
+							raise Rollback()
+			except Rollback:
+				pass
+
+		return HttpResponse(str(json.dumps(results)),
+				    content_type="application/json")
+
+	def _result(self, request, db_conn, cmd, privileged=True):
+		response = self._execute(request, db_conn, cmd, privileged)
+		if response.streaming:
+			content = b''.join(response.streaming_content)
+		else:
+			content = response.content
+		if response['Content-Type'] == 'application/json':
+			output = json.loads(content)
+		else:
+			output = content.decode()
+		return {'cmd': cmd, 'status': response.status_code, 'output': output}
+
+
+class StackJobWS(View):
+	"""
+	The jobs queued with "async".
+
+		GET  jobs/<id>		status of the job
+		GET  jobs/<id>/log	its output, followed until it is done
+		POST jobs/<id>/cancel	cancel it
+
+	Users see their own jobs, admins see all of them.
+	"""
+
+	def _job(self, request, job):
+		try:
+			job = Job.objects.get(id=job)
+		except Job.DoesNotExist:
+			return None
+		if request.user.is_superuser or job.user == request.user.username:
+			return job
+		return None
+
+	def _notFound(self):
+		output = {"API Error": "Job Not Found"}
+		return HttpResponse(str(json.dumps(output)),
+				    content_type="application/json",
+				    status=404)
+
+	@StackWS._check_login_
+	def get(self, request, job, action=None):
+		job = self._job(request, job)
+		if not job or action not in (None, 'log'):
+			return self._notFound()
+
+		if action == 'log':
+			return StreamingHttpResponse(stack.restapi.jobs.follow(job),
+						     content_type="text/plain")
+
+		return HttpResponse(str(json.dumps(stack.restapi.jobs.describe(job))),
+				    content_type="application/json")
+
+	@StackWS._check_login_
+	def post(self, request, job, action=None):
+		job = self._job(request, job)
+		if not job or action != 'cancel':
+			return self._notFound()
+
+		stack.restapi.jobs.cancel(job)
+		job.refresh_from_db()
+
+		return HttpResponse(str(json.dumps(stack.restapi.jobs.describe(job))),
+				    content_type="application/json")
 
 
 # Function to log in the user
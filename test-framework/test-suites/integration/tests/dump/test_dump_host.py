@@ -94,3 +94,116 @@ class TestDumpHost:
 				assert host['controller'][0]['raidlevel'] == '4'
 				assert host['controller'][0]['arrayid'] == 2
 
+
+	def test_dump_host_many(self, host):
+		# a dozen hosts with a bit of everything, plus global, os,
+		# and appliance rules the host rules replace
+		results = host.run('stack list host localhost output-format=json')
+		assert results.rc == 0
+		os = json.loads(results.stdout)[0]['os']
+
+		commands = [
+			'stack add global firewall action=accept chain=input protocol=tcp service=ssh network=all rulename=shared table=filter',
+			f'stack add os firewall {os} action=accept chain=input protocol=tcp service=https network=all rulename=os table=filter',
+			f'stack add os firewall {os} action=accept chain=input protocol=tcp service=3825 network=all rulename=os-only table=filter',
+			'stack add appliance firewall backend action=reject chain=input protocol=tcp service=www network=all rulename=appliance table=filter',
+		]
+		for i in range(12):
+			name = f'backend-0-{i}'
+			commands.extend([
+				f'stack add host {name} appliance=backend box=default rack=0 rank={i}',
+				f'stack set host metadata {name} metadata=test-{i}',
+				f'stack add host attr {name} attr=test value=test-{i}',
+				f'stack add host attr {name} attr=secret value=test-{i} shadow=true',
+				f'stack add host interface {name} interface=eth0 ip=192.168.1.{i + 10} mac=00:11:22:33:44:{i:02x} network=private default=true',
+				f'stack add host interface {name} interface=eth1 mac=00:11:22:33:45:{i:02x}',
+				f'stack add host alias {name} interface=eth0 alias=test-{i}',
+				f'stack add host alias {name} interface=eth0 alias=other-{i}',
+				f'stack add host route {name} address=10.{i}.0.0 gateway=192.168.1.1 netmask=255.255.0.0 interface=private',
+				f'stack add host route {name} address=10.1{i}.0.0 gateway=192.168.1.1 netmask=255.255.0.0 interface=eth1',
+				f'stack add host firewall {name} action=reject chain=input protocol=udp service=www network=private rulename=reject-{i} table=filter',
+				f'stack add host firewall {name} action=accept chain=input protocol=tcp service=ssh network=all rulename=shared table=filter',
+				f'stack add host firewall {name} action=drop chain=output protocol=tcp service=www network=private output-network=private rulename=appliance table=filter',
+				f'stack add host firewall {name} action=accept chain=input protocol=tcp service=https network=private rulename=os table=filter',
+				f'stack add host firewall {name} action=accept chain=input protocol=tcp service=8080 network=private rulename=accept-{i} table=filter',
+				f'stack add host group {name} group=test',
+				f'stack add storage partition {name} device=sda mountpoint=/ size=10 type=ext4',
+				f'stack add storage partition {name} device=sda mountpoint=swap size=1 type=swap',
+				f'stack add storage controller {name} arrayid=1 raidlevel=1 slot=1,2',
+				f'stack add storage controller {name} arrayid=2 raidlevel=0 slot=3',
+			])
+		results = host.run('stack add group test')
+		assert results.rc == 0
+		for command in commands:
+			results = host.run(command)
+			assert results.rc == 0
+
+		def call(command):
+			results = host.run(f'{command} output-format=json')
+			assert results.rc == 0
+			return json.loads(results.stdout) if results.stdout.strip() else []
+
+		# the document listing everything host by host
+		attrs = call('stack list host attr')
+		hosts = []
+		for row in call('stack list host'):
+			name = row['host']
+
+			interfaces = []
+			for interface in call(f'stack list host interface {name}'):
+				alias = call(f'stack list host alias {name} interface={interface["interface"]}')
+				interfaces.append({
+					'interface': interface['interface'],
+					'default': interface['default'],
+					'mac': interface['mac'],
+					'ip': interface['ip'],
+					'network': interface['network'],
+					'name': interface['name'],
+					'module': interface['module'],
+					'vlan': interface['vlan'],
+					'options': interface['options'],
+					'channel': interface['channel'],
+					'alias': alias
+				})
+
+			metadata = None
+			host_attrs = []
+			for attr in attrs:
+				if attr['host'] != name or attr['scope'] != 'host':
+					continue
+				if attr['attr'] == 'metadata':
+					metadata = attr['value']
+					continue
+				host_attrs.append({
+					'name': attr['attr'],
+					'value': attr['value'],
+					'shadow': attr['type'] == 'shadow'
+				})
+
+			groups = []
+			for group in call(f'stack list host group {name}'):
+				groups.extend(group['groups'].split())
+
+			hosts.append({
+				'name': name,
+				'rack': row['rack'],
+				'rank': row['rank'],
+				'interface': interfaces,
+				'attrs': host_attrs,
+				'firewall': [ rule for rule in call(f'stack list host firewall {name}') if rule['source'] == 'H' ],
+				'box': row['box'],
+				'appliance': row['appliance'],
+				'comment': row['comment'],
+				'metadata': metadata,
+				'environment': row['environment'],
+				'osaction': row['osaction'],
+				'installaction': row['installaction'],
+				'route': [ route for route in call(f'stack list host route {name}') if route['source'] == 'H' ],
+				'group': groups,
+				'partition': [ p for p in call(f'stack list storage partition {name}') if p['scope'] == name ],
+				'controller': call(f'stack list storage controller {name}')
+			})
+
+		results = host.run('stack dump host')
+		assert results.rc == 0
+		assert results.stdout == json.dumps({'host': hosts}, indent=2) + '\n'
@@ -215,7 +215,9 @@ class TestEnableDiscovery:
 		log_file = host.file("/var/log/stack-discovery.log")
 		assert log_file.exists
 
-		# Does the log file contain all the expected messages?
+		# Does the log file contain all the expected messages? Both
+		# nodes show up inside one batch window, so they are added
+		# together after all the DHCP requests have been seen.
 		lines = [
 			line[20:]
 			for line in log_file.content_string.strip().split('\n')
@@ -225,14 +227,14 @@ class TestEnableDiscovery:
 			"INFO: discovery daemon started",
 			"INFO: detected a dhcp request: 52:54:00:00:00:03 eth1",
 			"INFO: found a new node: 52:54:00:00:00:03 eth1",
-			"INFO: successfully added host backend-0-0",
 			"INFO: detected a dhcp request: 52:54:00:00:00:03 eth1",
 			"INFO: detected a dhcp request: 52:54:00:00:00:04 eth1",
 			"INFO: found a new node: 52:54:00:00:00:04 eth1",
-			"INFO: successfully added host backend-0-1",
 			"INFO: detected a dhcp request: 52:54:00:00:00:04 eth1",
 			"INFO: detected a dhcp request: 52:54:00:00:00:03 eth1",
 			"INFO: detected a dhcp request: 52:54:00:00:00:04 eth1",
+			"INFO: successfully added host backend-0-0",
+			"INFO: successfully added host backend-0-1",
 			"INFO: discovery daemon stopped"
 		]
 
@@ -269,3 +271,46 @@ class TestEnableDiscovery:
 			"installaction": "default",
 			"comment": None
 		}
+
+	def test_daemon_discovery_simulation(self, host):
+		"""
+		Feed 2,000 DHCP log lines from 50 new nodes at the daemon and
+		time how long it takes for all of them to be discovered.
+		"""
+
+		# Start the deamon
+		result = host.run("stack enable discovery")
+		assert result.rc == 0
+
+		# Set up a listener to capture discovery messages
+		listener = DiscoveryListener()
+
+		# Every node retries its DHCP request a bunch of times, so
+		# most of the lines are for already known MAC addresses
+		macs = [f"52:54:00:00:01:{i:02x}" for i in range(50)]
+
+		start = time.time()
+		with open("/var/log/messages", "a") as f:
+			for _ in range(40):
+				for mac in macs:
+					f.write(f"DHCPDISCOVER from {mac} via eth1\n")
+
+		# Listen for the add messages on the queue
+		messages = listener.listen(50, 600)
+		elapsed = time.time() - start
+
+		print(f"discovered {len(messages)} nodes from 2000 DHCP lines in {elapsed:.1f}s")
+
+		# Each node was added exactly once with a unique IP
+		assert len(messages) == 50
+		assert sorted(m.getPayload()['mac_address'] for m in messages) == macs
+		assert len({m.getPayload()['ip_address'] for m in messages}) == 50
+
+		# Stop discovery to put the system back to the initial state
+		result = host.run("stack disable discovery")
+		assert result.rc == 0
+
+		# And the database agrees
+		result = host.run("stack list host a:backend output-format=json")
+		assert result.rc == 0
+		assert len(json.loads(result.stdout)) == 50
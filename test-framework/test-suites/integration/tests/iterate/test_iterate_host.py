@@ -0,0 +1,61 @@
+import json
+import time
+
+
+class TestIterateHost:
+	def add_hosts(self, add_host, count):
+		for rank in range(1, count):
+			add_host(f'backend-0-{rank}', '0', str(rank), 'backend')
+
+	def test_iterate_host_threads(self, host, add_host):
+		"""
+		A slow command on 8 hosts, one at a time and then all at
+		once, should scale close to linearly.
+		"""
+
+		self.add_hosts(add_host, 8)
+
+		timings = {}
+		for threads in [1, 8]:
+			start = time.time()
+			result = host.run(
+				f'stack iterate host a:backend command="sleep 1; echo %" threads={threads}'
+			)
+			timings[threads] = time.time() - start
+			assert result.rc == 0
+			assert result.stdout == ''.join(f'backend-0-{rank}\n' for rank in range(8))
+
+		print(f"iterate host on 8 hosts: {timings[1]:.1f}s serial, {timings[8]:.1f}s with 8 threads")
+		assert timings[1] / timings[8] > 4
+
+	def test_iterate_host_ordered(self, host, add_host):
+		self.add_hosts(add_host, 4)
+
+		# The first hosts take the longest, the output is still
+		# in host order
+		result = host.run(
+			'stack iterate host a:backend threads=4 collate=y output-format=json '
+			'command="case % in *0) sleep 0.9;; *1) sleep 0.6;; *2) sleep 0.3;; esac; echo %"'
+		)
+		assert result.rc == 0
+		assert json.loads(result.stdout) == [
+			{'host': f'backend-0-{rank}', 'output': f'backend-0-{rank}'}
+			for rank in range(4)
+		]
+
+	def test_iterate_host_timeout(self, host, add_host):
+		self.add_hosts(add_host, 2)
+
+		start = time.time()
+		result = host.run(
+			'stack iterate host a:backend threads=2 timeout=1 collate=y '
+			'output-format=json command="echo %; sleep 10"'
+		)
+		assert result.rc == 0
+		assert time.time() - start < 5
+		assert json.loads(result.stdout) == [
+			{'host': 'backend-0-0', 'output': 'backend-0-0'},
+			{'host': 'backend-0-0', 'output': 'timeout after 1 seconds'},
+			{'host': 'backend-0-1', 'output': 'backend-0-1'},
+			{'host': 'backend-0-1', 'output': 'timeout after 1 seconds'}
+		]
@@ -1,3 +1,5 @@
+import json
+
 import pytest
 
 class TestLoadJsonHost:
@@ -61,3 +63,100 @@ class TestLoadJsonHost:
 		# make sure that they are the same
 		value = set(initial_host_data) - set(final_host_data)
 		assert not value
+
+	def test_load_json_host_bulk(self, host, add_host_with_interface, tmpdir):
+		results = host.run('stack add group test')
+		assert results.rc == 0
+		results = host.run('stack set host interface network backend-0-0 interface=eth0 network=private')
+		assert results.rc == 0
+		results = host.run('stack set host interface default backend-0-0 interface=eth0 default=true')
+		assert results.rc == 0
+		results = host.run('stack add host alias backend-0-0 interface=eth0 alias=test')
+		assert results.rc == 0
+		results = host.run('stack set host attr backend-0-0 attr=test value=test')
+		assert results.rc == 0
+		results = host.run('stack add host group backend-0-0 group=test')
+		assert results.rc == 0
+
+		results = host.run('stack dump host')
+		assert results.rc == 0
+		dumped = json.loads(results.stdout)
+		template = [ h for h in dumped['host'] if h['name'] == 'backend-0-0' ][0]
+		results = host.run('stack remove host backend-0-0')
+		assert results.rc == 0
+
+		# the same hosts, each with its own mac and alias
+		def document(count, name='hosts.json'):
+			hosts = []
+			for i in range(count):
+				h = json.loads(json.dumps(template))
+				h['name'] = f'backend-1-{i}'
+				h['rank'] = str(i)
+				h['interface'][0]['mac'] = f'00:11:22:33:{i // 256:02x}:{i % 256:02x}'
+				h['interface'][0]['alias'] = [ { 'alias': f'test-{i}' } ]
+				hosts.append(h)
+			filename = tmpdir.join(name)
+			filename.write(json.dumps({ 'host': hosts }))
+			return filename, hosts
+
+		def load(filename, bulk=True):
+			return host.run(f'stack load json host file={filename} bulk={bulk}')
+
+		def dump():
+			results = host.run('stack dump host')
+			assert results.rc == 0
+			return json.loads(results.stdout)
+
+		def rows():
+			"""
+			Counts what the test hosts have in each table
+			"""
+			counts = {}
+			for (what, command) in (
+				('hosts',      'list host a:backend'),
+				('interfaces', 'list host interface a:backend'),
+				('aliases',    'list host alias a:backend'),
+				('attrs',      'list host attr a:backend attr=test'),
+				('groups',     'list host group a:backend')):
+				results = host.run(f'stack {command} output-format=json')
+				assert results.rc == 0
+				counts[what] = len(json.loads(results.stdout or '[]'))
+			return counts
+
+		# a handful of hosts one command at a time and in bulk
+		# end up the same
+		filename, hosts = document(50)
+		assert load(filename, bulk=False).rc == 0
+		expected = dump()
+
+		results = host.run('stack remove host a:backend')
+		assert results.rc == 0
+
+		assert load(filename).rc == 0
+		assert dump() == expected
+		assert rows() == { 'hosts': 50, 'interfaces': 50, 'aliases': 50, 'attrs': 50, 'groups': 50 }
+
+		# loading them again changes nothing
+		assert load(filename).rc == 0
+		assert dump() == expected
+		assert rows() == { 'hosts': 50, 'interfaces': 50, 'aliases': 50, 'attrs': 50, 'groups': 50 }
+
+		# a few thousand hosts load in one transaction
+		filename, hosts = document(3000)
+		assert load(filename).rc == 0
+		assert len(dump()['host']) == len(expected['host']) - 50 + 3000
+		assert rows() == { 'hosts': 3000, 'interfaces': 3000, 'aliases': 3000, 'attrs': 3000, 'groups': 3000 }
+
+		# a document whose second host can't be loaded changes nothing,
+		# not even the first host
+		results = host.run('stack remove host a:backend')
+		assert results.rc == 0
+		before = dump()
+
+		filename, hosts = document(2, 'bad.json')
+		hosts[1]['group'] = [ 'no-such-group' ]
+		filename.write(json.dumps({ 'host': hosts }))
+
+		assert load(filename).rc != 0
+		assert dump() == before
+		assert rows() == { 'hosts': 0, 'interfaces': 0, 'aliases': 0, 'attrs': 0, 'groups': 0 }
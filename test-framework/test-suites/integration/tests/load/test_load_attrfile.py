@@ -0,0 +1,49 @@
+import json
+
+
+class TestLoadAttrfile:
+	def test_load_attrfile_bulk(self, host, add_host, tmpdir):
+		attrfile = tmpdir.join('attrs.csv')
+		attrfile.write('\n'.join([
+			'target,foo,bar,baz.qux',
+			'global,global-foo,,',
+			'backend,,backend-bar,',
+			'backend-0-0,host-foo,host-bar,host-baz',
+		]) + '\n')
+
+		def load(bulk):
+			result = host.run(f'stack load attrfile file={attrfile} bulk={bulk}')
+			assert result.rc == 0
+
+			result = host.run('stack list attr attr=foo output-format=json')
+			assert result.rc == 0
+			attrs = json.loads(result.stdout)
+			for attr in [ 'bar', 'baz.qux' ]:
+				result = host.run(f'stack list attr attr={attr} output-format=json')
+				assert result.rc == 0
+				attrs.extend(json.loads(result.stdout))
+
+			result = host.run('stack list host attr backend-0-0 output-format=json')
+			assert result.rc == 0
+			return attrs, json.loads(result.stdout)
+
+		# one command at a time and in bulk load the same attrs
+		expected = load(False)
+		for attr in [ 'foo', 'bar', 'baz.qux' ]:
+			host.run(f'stack remove attr attr={attr}')
+			host.run(f'stack remove appliance attr backend attr={attr}')
+			host.run(f'stack remove host attr backend-0-0 attr={attr}')
+
+		assert load(True) == expected
+
+		# an empty cell removes the attr
+		attrfile.write('\n'.join([
+			'target,foo',
+			'backend-0-0,',
+		]) + '\n')
+		result = host.run(f'stack load attrfile file={attrfile}')
+		assert result.rc == 0
+
+		result = host.run('stack list host attr backend-0-0 attr=foo output-format=json')
+		assert result.rc == 0
+		assert [ attr['value'] for attr in json.loads(result.stdout) if attr['scope'] == 'host' ] == []
@@ -2,6 +2,7 @@ import json
 import pytest
 import re
 import tempfile
+import time
 
 
 @pytest.mark.usefixtures("revert_database")
@@ -85,3 +86,91 @@ class TestLoadHostfile:
 		assert result.rc != 0
 		assert re.search(r'interface ".+" already specified for host', result.stderr) is not None
 
+
+	@pytest.fixture
+	def large_hostfile(self, host, tmpdir):
+		"""A 5,000 row spreadsheet of backends on their own network."""
+
+		result = host.run('stack add network bulk address=10.8.0.0 mask=255.255.0.0')
+		assert result.rc == 0
+		result = host.run('stack add group bulk')
+		assert result.rc == 0
+
+		def _inner(count):
+			hostfile = tmpdir.join(f'hosts-{count}.csv')
+			lines = [ 'NAME,APPLIANCE,RACK,RANK,IP,MAC,INTERFACE,NETWORK,GROUPS,COMMENT' ]
+			for i in range(count):
+				rack, rank = divmod(i, 100)
+				lines.append(
+					f'backend-{rack}-{rank},backend,{rack},{rank},'
+					f'10.8.{i // 250}.{i % 250 + 1},00:01:02:03:{i // 256:02x}:{i % 256:02x},'
+					f'eth0,bulk,bulk,rack {rack}'
+				)
+			hostfile.write('\n'.join(lines) + '\n')
+			return str(hostfile)
+
+		return _inner
+
+	def test_load_hostfile_bulk(self, host, large_hostfile):
+		def load(hostfile, bulk):
+			start = time.time()
+			result = host.run(f'stack load hostfile file={hostfile} bulk={bulk}')
+			assert result.rc == 0
+			return time.time() - start
+
+		def report():
+			result = host.run('stack report hostfile')
+			assert result.rc == 0
+			return result.stdout
+
+		# a couple hundred hosts load the same either way
+		hostfile = large_hostfile(200)
+		slow = load(hostfile, False)
+		expected = report()
+
+		result = host.run('stack remove host a:backend')
+		assert result.rc == 0
+
+		fast = load(hostfile, True)
+		assert report() == expected
+		assert fast < slow
+
+		# reloading the spreadsheet changes nothing
+		load(hostfile, True)
+		assert report() == expected
+
+		# and the whole 5,000 take less time per host than one
+		# command at a time did
+		elapsed = load(large_hostfile(5000), True)
+		assert elapsed / 5000 < slow / 200
+
+		result = host.run('stack list host a:backend output-format=json')
+		assert result.rc == 0
+		assert len(json.loads(result.stdout)) == 5000
+
+	def test_load_hostfile_bulk_rollback(self, host, large_hostfile):
+		result = host.run('stack list host interface output-format=json')
+		assert result.rc == 0
+		before = json.loads(result.stdout)
+
+		# only two addresses to hand out, the third host with
+		# ip=auto fails after everything else is loaded
+		result = host.run('stack add network tiny address=10.9.0.0 mask=255.255.255.252')
+		assert result.rc == 0
+
+		lines = open(large_hostfile(100)).read().splitlines()
+		for i in range(3):
+			lines.append(f'backend-9-{i},backend,9,{i},auto,00:01:02:03:09:{i:02x},eth0,tiny,bulk,')
+
+		hostfile = large_hostfile(0)
+		with open(hostfile, 'w') as f:
+			f.write('\n'.join(lines) + '\n')
+
+		result = host.run(f'stack load hostfile file={hostfile}')
+		assert result.rc != 0
+		assert 'No free ip host addresses left in network' in result.stderr
+
+		# none of the hosts were loaded
+		result = host.run('stack list host interface output-format=json')
+		assert result.rc == 0
+		assert json.loads(result.stdout) == before
@@ -0,0 +1,46 @@
+import shlex
+
+
+# Runs as apache like the pxeboot WSGI application
+INSTALL_COMPLETE = '''
+from stack.pxeboot import InstallComplete
+
+app = InstallComplete(window=0)
+status = []
+app({ 'REMOTE_ADDR': '192.168.0.204' }, lambda s, headers: status.append(s))
+print(status[0])
+'''
+
+
+class TestPxeboot:
+	def test_install_complete(self, host, add_host_with_interface, revert_filesystem):
+		result = host.run('stack set host interface ip backend-0-0 interface=eth0 ip=192.168.0.204')
+		assert result.rc == 0
+		result = host.run('stack set host interface network backend-0-0 interface=eth0 network=private')
+		assert result.rc == 0
+		result = host.run('stack set host attr backend-0-0 attr=nukedisks value=true')
+		assert result.rc == 0
+		result = host.run('stack set host boot backend-0-0 action=install')
+		assert result.rc == 0
+
+		uefi = '/tftpboot/pxelinux/uefi/grub.cfg-192.168.0.204'
+		install = host.file(uefi).content_string
+
+		cmd = '/opt/stack/bin/python3 -c %s' % shlex.quote(INSTALL_COMPLETE)
+		result = host.run('su -s /bin/sh apache -c %s' % shlex.quote(cmd))
+		assert result.rc == 0
+		assert result.stdout.strip() == '200 OK'
+
+		# The answer came after the commit
+		result = host.run('stack list host boot backend-0-0 output-format=json')
+		assert '"action": "os"' in result.stdout
+		result = host.run('stack list host attr backend-0-0 attr=nukedisks output-format=json')
+		assert '"value": "false"' in result.stdout
+
+		# and after the UEFI boot file was rewritten, the same way
+		# root would have
+		assert host.file(uefi).content_string != install
+		mtime = host.file(uefi).mtime
+		result = host.run('stack sync host boot backend-0-0')
+		assert result.rc == 0
+		assert host.file(uefi).mtime == mtime
@@ -1,4 +1,5 @@
 import json
+import time
 from textwrap import dedent
 
 
@@ -121,3 +122,94 @@ class TestRemoveHost:
 				'rank': '2'
 			}
 		]
+
+	def test_remove_host_many(self, host, tmpdir):
+		"""
+		Removing a set of hosts at once leaves the same database as
+		removing them one at a time, on a database of 500 hosts.
+		"""
+
+		mysql = 'mysql --defaults-file=/opt/stack/etc/root.my.cnf'
+
+		result = host.run('stack add network test address=10.0.0.0 mask=255.255.0.0')
+		assert result.rc == 0
+
+		hostfile = tmpdir.join('hosts.csv')
+		with open(hostfile, 'w') as f:
+			f.write('NAME,APPLIANCE,RACK,RANK,IP,INTERFACE,NETWORK,DEFAULT\n')
+			for rank in range(500):
+				f.write(f'backend-{rank // 100}-{rank % 100},backend,{rank // 100},{rank % 100},'
+					f'10.0.{rank // 250}.{rank % 250 + 1},eth0,test,True\n')
+
+		result = host.run(f'stack load hostfile file={hostfile}')
+		assert result.rc == 0
+
+		for cmd in [
+			'stack set host attr a:backend attr=test value=true',
+			'stack set host boot a:backend action=os sync=false',
+			'stack add group test',
+			'stack add host group a:backend group=test',
+			'stack add host firewall a:backend service=1234 chain=INPUT '
+			'action=ACCEPT protocol=TCP network=test rulename=test'
+		]:
+			result = host.run(cmd)
+			assert result.rc == 0
+
+		# The rest go straight into the database
+		for sql in [
+			"insert into aliases (name, network) select concat('www-', n.name), nt.id "
+			"from networks nt, nodes n where nt.node = n.id and n.name like 'backend-%'",
+			"insert into partitions (node, device, mountpoint) "
+			"select id, 'sda1', '/' from nodes where name like 'backend-%'",
+			"insert into node_routes (node, network, netmask, gateway) "
+			"select id, '1.2.3.4', '255.255.255.255', '10.0.0.1' from nodes where name like 'backend-%'",
+			"insert into public_keys (node, public_key) "
+			"select id, 'foo' from nodes where name like 'backend-%'"
+		]:
+			result = host.run(f'{mysql} cluster -e "{sql}"')
+			assert result.rc == 0
+
+		def tables():
+			contents = {}
+			for table in [
+				'nodes', 'networks', 'aliases', 'attributes', 'boot', 'memberships',
+				'node_firewall', 'node_routes', 'partitions', 'public_keys'
+			]:
+				result = host.run(f'{mysql} cluster -N -e "select * from {table}"')
+				assert result.rc == 0
+				contents[table] = sorted(result.stdout.splitlines())
+			return contents
+
+		before = tmpdir.join('before.sql')
+		result = host.run(f'mysqldump --defaults-file=/opt/stack/etc/root.my.cnf '
+				  f'--add-drop-database --databases cluster > {before}')
+		assert result.rc == 0
+
+		removed = [f'backend-0-{rank}' for rank in range(10)]
+
+		for name in removed:
+			result = host.run(f'stack remove host {name}')
+			assert result.rc == 0
+		one_at_a_time = tables()
+
+		result = host.run(f'{mysql} < {before}')
+		assert result.rc == 0
+
+		result = host.run(f'stack remove host {" ".join(removed)}')
+		assert result.rc == 0
+		assert tables() == one_at_a_time
+
+		# Nothing is left behind for the removed hosts
+		for table in ['aliases', 'memberships', 'node_firewall', 'node_routes',
+			      'partitions', 'public_keys']:
+			assert len(one_at_a_time[table]) == 490
+
+		# And a big set in one go
+		start = time.time()
+		result = host.run('stack remove host a:backend')
+		print(f'remove host of 490 hosts: {time.time() - start:.1f}s')
+		assert result.rc == 0
+
+		result = host.run('stack list host output-format=json')
+		assert result.rc == 0
+		assert [h for h in json.loads(result.stdout) if h['appliance'] == 'backend'] == []
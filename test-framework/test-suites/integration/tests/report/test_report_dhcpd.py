@@ -1,5 +1,10 @@
+import json
+import time
+
 import pytest
 
+from stack.commands.report.dhcpd import filename
+
 class TestReportDhcpd:
 	def test_duplicate_interface(self, host):
 		result = host.run('stack add host interface frontend-0-0 interface=eth0 mac=00:11:22:33:44:55 ip=1.2.3.4 network=private')
@@ -30,3 +35,59 @@ class TestReportDhcpd:
 		assert result.rc == 0
 		assert 'eth0' not in result.stdout
 
+
+	def test_many_hosts(self, host, tmpdir):
+		"""
+		Report the dhcpd.conf of 5,000 hosts, every tenth one with its
+		PXE interface in a bond, and check the host sections are
+		exactly what they should be.
+		"""
+
+		result = host.run('stack add network test address=10.0.0.0 mask=255.255.0.0 pxe=true')
+		assert result.rc == 0
+
+		names = [ f'backend-{rank // 100}-{rank % 100}' for rank in range(5000) ]
+
+		hostfile = tmpdir.join('hosts.csv')
+		with open(hostfile, 'w') as f:
+			f.write('NAME,APPLIANCE,RACK,RANK,IP,MAC,INTERFACE,NETWORK,CHANNEL,DEFAULT\n')
+			for rank, name in enumerate(names):
+				ip = f'10.0.{rank // 250}.{rank % 250 + 1}'
+				mac = f'52:54:00:00:{rank // 256:02x}:{rank % 256:02x}'
+				rack = rank // 100
+				if rank % 10:
+					f.write(f'{name},backend,{rack},{rank % 100},{ip},{mac},eth0,test,,True\n')
+				else:
+					f.write(f'{name},backend,{rack},{rank % 100},{ip},,bond0,test,,True\n')
+					f.write(f'{name},backend,{rack},{rank % 100},,{mac},eth0,,bond0,\n')
+
+		result = host.run(f'stack load hostfile file={hostfile}')
+		assert result.rc == 0
+
+		# Rack 1 isn't kickstartable
+		result = host.run(f'stack set host attr {" ".join(names[100:200])} attr=kickstartable value=false')
+		assert result.rc == 0
+
+		result = host.run('stack list host interface a:frontend output-format=json')
+		assert result.rc == 0
+		server = [ row['ip'] for row in json.loads(result.stdout) if row['network'] == 'private' ][0]
+
+		expected = ''
+		for rank, name in enumerate(names):
+			expected += f'\nhost {name}.test.eth0 {{\n'
+			expected += f'\toption host-name\t"{name}";\n'
+			expected += f'\thardware ethernet\t52:54:00:00:{rank // 256:02x}:{rank % 256:02x};\n'
+			expected += f'\tfixed-address\t\t10.0.{rank // 250}.{rank % 250 + 1};\n'
+			if not 100 <= rank < 200:
+				expected += f'{filename}\n'
+				expected += f'\tserver-name\t\t"{server}";\n'
+				expected += f'\tnext-server\t\t{server};\n'
+			expected += '}\n'
+
+		start = time.time()
+		result = host.run('stack report dhcpd')
+		print(f'report dhcpd on 5000 hosts: {time.time() - start:.1f}s')
+		assert result.rc == 0
+
+		assert expected in result.stdout
+		assert result.stdout.count('.test.') == 5000
@@ -0,0 +1,42 @@
+import re
+import time
+
+
+class TestReportZones:
+	def test_many_hosts(self, host, tmpdir):
+		"""
+		Generate the zones of 10,000 hosts with two aliases each.
+		"""
+
+		result = host.run('stack add network test address=10.0.0.0 mask=255.255.0.0 zone=test dns=true')
+		assert result.rc == 0
+
+		hostfile = tmpdir.join('hosts.csv')
+		with open(hostfile, 'w') as f:
+			f.write('NAME,APPLIANCE,RACK,RANK,IP,INTERFACE,NETWORK,DEFAULT\n')
+			for rank in range(10000):
+				f.write(f'backend-{rank // 100}-{rank % 100},backend,{rank // 100},{rank % 100},'
+					f'10.0.{rank // 250}.{rank % 250 + 1},eth0,test,True\n')
+
+		result = host.run(f'stack load hostfile file={hostfile}')
+		assert result.rc == 0
+
+		# Adding 20,000 aliases one command at a time takes a while,
+		# put them straight in the database
+		for prefix in ['www', 'ftp']:
+			result = host.run(
+				'mysql --defaults-file=/opt/stack/etc/root.my.cnf cluster -e "'
+				f"insert into aliases (name, network) select concat('{prefix}-', n.name), nt.id "
+				'from networks nt, nodes n, subnets s '
+				"where nt.node = n.id and nt.subnet = s.id and s.name = 'test'\""
+			)
+			assert result.rc == 0
+
+		start = time.time()
+		result = host.run('stack report zones')
+		print(f'report zones on 10000 hosts: {time.time() - start:.1f}s')
+		assert result.rc == 0
+
+		assert len(re.findall(r'^backend-\S+ A 10\.0\.', result.stdout, re.M)) == 10000
+		assert len(re.findall(r'^(www|ftp)-backend-\S+ CNAME backend-', result.stdout, re.M)) == 20000
+		assert len(re.findall(r'^\S+ PTR backend-\S+\.test\.$', result.stdout, re.M)) == 10000
@@ -0,0 +1,116 @@
+import json
+import time
+
+
+class TestRunHost:
+	def test_run_host_many_hosts(self, host, tmpdir):
+		"""
+		Run a command on 2,000 hosts, using a fake ssh that runs the
+		command locally as the stand-in for each host's sshd, and
+		report the wall-clock and CPU time of the frontend.
+		"""
+
+		# Add the hosts in one go
+		hostfile = tmpdir.join("hosts.csv")
+		with open(hostfile, "w") as f:
+			f.write("NAME,APPLIANCE,RACK,RANK\n")
+			for rank in range(2000):
+				f.write(f"backend-0-{rank},backend,0,{rank}\n")
+
+		result = host.run(f"stack load hostfile file={hostfile}")
+		assert result.rc == 0
+
+		# Every host resolves to us, so the port 22 probe hits our sshd
+		with open("/etc/hosts", "a") as f:
+			for rank in range(2000):
+				f.write(f"127.0.0.1 backend-0-{rank}\n")
+
+		# The ssh stand-in just runs the command
+		ssh = tmpdir.join("ssh")
+		ssh.write('#!/bin/sh\nshift\nexec sh -c "$*"\n')
+		ssh.chmod(0o755)
+
+		start = time.time()
+		result = host.run(
+			f'PATH={tmpdir}:$PATH /usr/bin/time -f "%U %S" '
+			'stack run host a:backend command="uptime" threads=256 '
+			'output-format=json'
+		)
+		elapsed = time.time() - start
+		assert result.rc == 0
+
+		user, system = result.stderr.strip().split('\n')[-1].split()
+		print(f"run host on 2000 hosts: {elapsed:.1f}s wall, {user}s user, {system}s system")
+
+		output = json.loads(result.stdout)
+		assert len(output) == 2000
+		assert all('load average' in row['output'] for row in output)
+
+	def test_run_host_collapse(self, host, add_host, tmpdir):
+		add_host('backend-0-1', '0', '1', 'backend')
+
+		with open("/etc/hosts", "a") as f:
+			f.write("127.0.0.1 backend-0-0\n")
+			f.write("127.0.0.1 backend-0-1\n")
+
+		ssh = tmpdir.join("ssh")
+		ssh.write('#!/bin/sh\nshift\nexec sh -c "$*"\n')
+		ssh.chmod(0o755)
+
+		result = host.run(
+			f'PATH={tmpdir}:$PATH stack run host a:backend '
+			'command="echo hello" collapse=y collate=n'
+		)
+		assert result.rc == 0
+		assert result.stdout == "backend-0-0,backend-0-1:\nhello\n"
+
+	def test_run_host_fanout_tree(self, host, tmpdir):
+		"""
+		Run a command on 2,000 hosts in 20 racks, once with the
+		frontend connecting to every host and once through a relay
+		per rack, and compare the timings and output.
+		"""
+
+		hostfile = tmpdir.join("hosts.csv")
+		with open(hostfile, "w") as f:
+			f.write("NAME,APPLIANCE,RACK,RANK\n")
+			for rank in range(2000):
+				f.write(f"backend-{rank // 100}-{rank % 100},backend,{rank // 100},{rank % 100}\n")
+
+		result = host.run(f"stack load hostfile file={hostfile}")
+		assert result.rc == 0
+
+		with open("/etc/hosts", "a") as f:
+			for rank in range(2000):
+				f.write(f"127.0.0.1 backend-{rank // 100}-{rank % 100}\n")
+
+		# The ssh stand-in skips the options and runs the command,
+		# passing stdin along for the relay script
+		ssh = tmpdir.join("ssh")
+		ssh.write(
+			'#!/bin/sh\n'
+			'while [ "${1#-}" != "$1" ]; do\n'
+			'\tcase "$1" in -o) shift ;; esac\n'
+			'\tshift\n'
+			'done\n'
+			'shift\n'
+			'exec sh -c "$*"\n'
+		)
+		ssh.chmod(0o755)
+
+		output = {}
+		for fanout in ['flat', 'tree']:
+			start = time.time()
+			result = host.run(
+				f'PATH={tmpdir}:$PATH stack run host a:backend '
+				f'command="echo hello" fanout={fanout} threads=256 '
+				'output-format=json'
+			)
+			elapsed = time.time() - start
+			assert result.rc == 0
+
+			print(f"run host fanout={fanout} on 2000 hosts: {elapsed:.1f}s")
+			output[fanout] = json.loads(result.stdout)
+
+		assert len(output['tree']) == 2000
+		assert output['tree'] == output['flat']
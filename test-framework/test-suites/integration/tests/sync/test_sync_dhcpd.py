@@ -0,0 +1,51 @@
+from stack.omapi import OMAPI, readKey
+
+
+class TestSyncDhcpd:
+	def dhcpd_pid(self, host):
+		result = host.run('systemctl show dhcpd --property=MainPID')
+		assert result.rc == 0
+		return result.stdout.strip()
+
+	def test_omapi(self, host, add_host_with_interface, revert_filesystem):
+		result = host.run('stack set attr attr=dhcpd.omapi value=true')
+		assert result.rc == 0
+
+		# The first sync has to restart dhcpd to turn on OMAPI
+		result = host.run('stack sync dhcpd')
+		assert result.rc == 0
+		pid = self.dhcpd_pid(host)
+
+		result = host.run(
+			'stack set host interface ip backend-0-0 interface=eth0 ip=192.168.0.200 && '
+			'stack set host interface mac backend-0-0 interface=eth0 mac=52:54:00:00:00:42 && '
+			'stack set host interface network backend-0-0 interface=eth0 network=private'
+		)
+		assert result.rc == 0
+
+		# A host change goes through OMAPI, dhcpd keeps running
+		result = host.run('stack sync dhcpd')
+		assert result.rc == 0
+		assert self.dhcpd_pid(host) == pid
+
+		api = OMAPI(readKey())
+		assert api.lookup(['backend-0-0.private.eth0']) == {
+			'backend-0-0.private.eth0': ('52:54:00:00:00:42', '192.168.0.200')
+		}
+
+		# Reconciling puts back a host dhcpd lost
+		api.remove('backend-0-0.private.eth0')
+		api.commit()
+		assert api.lookup(['backend-0-0.private.eth0']) == {}
+
+		result = host.run('stack sync dhcpd reconcile=yes')
+		assert result.rc == 0
+		assert self.dhcpd_pid(host) == pid
+		assert api.lookup(['backend-0-0.private.eth0']) == {
+			'backend-0-0.private.eth0': ('52:54:00:00:00:42', '192.168.0.200')
+		}
+
+		result = host.run('stack set attr attr=dhcpd.omapi value=false')
+		assert result.rc == 0
+		result = host.run('stack sync dhcpd')
+		assert result.rc == 0
@@ -0,0 +1,91 @@
+import re
+import time
+
+
+class TestSyncDns:
+	def serial(self, host, path):
+		return re.search(r'(\d+) ; Serial', host.file(path).content_string).group(1)
+
+	def test_serial(self, host, add_host_with_interface, revert_filesystem):
+		result = host.run('stack set network dns private dns=true')
+		assert result.rc == 0
+
+		result = host.run('stack sync dns')
+		assert result.rc == 0
+
+		# Twice, the first sync creates the local stub files the
+		# second one includes
+		result = host.run('stack sync dns')
+		assert result.rc == 0
+		serial = self.serial(host, '/var/named/private.domain')
+
+		# Nothing changed, neither did the serial
+		time.sleep(1)
+		result = host.run('stack sync dns')
+		assert result.rc == 0
+		assert self.serial(host, '/var/named/private.domain') == serial
+
+		result = host.run('stack set host interface ip backend-0-0 interface=eth0 ip=192.168.0.201')
+		assert result.rc == 0
+		result = host.run('stack set host interface network backend-0-0 interface=eth0 network=private')
+		assert result.rc == 0
+
+		result = host.run('stack sync dns')
+		assert result.rc == 0
+		assert int(self.serial(host, '/var/named/private.domain')) > int(serial)
+
+	def test_dynamic(self, host, add_host_with_interface, revert_filesystem):
+		result = host.run('stack set network dns private dns=true')
+		assert result.rc == 0
+
+		result = host.run('stack set attr attr=dns.dynamic value=true')
+		assert result.rc == 0
+		result = host.run('stack sync dns')
+		assert result.rc == 0
+
+		result = host.run('stack set host interface ip backend-0-0 interface=eth0 ip=192.168.0.202')
+		assert result.rc == 0
+		result = host.run('stack set host interface network backend-0-0 interface=eth0 network=private')
+		assert result.rc == 0
+		result = host.run('stack add host alias backend-0-0 alias=web interface=eth0')
+		assert result.rc == 0
+
+		# Only backend-0-0 is sent to named
+		result = host.run('stack sync dns backend-0-0')
+		assert result.rc == 0
+
+		zone = host.run('stack list network private output-format=json')
+		zone = re.search(r'"zone": "([^"]+)"', zone.stdout).group(1)
+
+		result = host.run(f'dig @127.0.0.1 +short backend-0-0.{zone} A')
+		assert result.stdout.strip() == '192.168.0.202'
+		result = host.run(f'dig @127.0.0.1 +short web.{zone} CNAME')
+		assert result.stdout.strip() == f'backend-0-0.{zone}.'
+		result = host.run('dig @127.0.0.1 +short -x 192.168.0.202')
+		assert result.stdout.strip() == f'backend-0-0.{zone}.'
+
+		# A removed alias goes away with the next update, sync config
+		# passes the hosts it is given on to sync dns
+		result = host.run('stack remove host alias backend-0-0 alias=web')
+		assert result.rc == 0
+		result = host.run('stack sync config backend-0-0')
+		assert result.rc == 0
+
+		result = host.run(f'dig @127.0.0.1 +short web.{zone} CNAME')
+		assert result.stdout.strip() == ''
+		result = host.run(f'dig @127.0.0.1 +short backend-0-0.{zone} A')
+		assert result.stdout.strip() == '192.168.0.202'
+
+		# So do the records of a removed host
+		result = host.run('stack remove host backend-0-0')
+		assert result.rc == 0
+
+		result = host.run(f'dig @127.0.0.1 +short backend-0-0.{zone} A')
+		assert result.stdout.strip() == ''
+		result = host.run('dig @127.0.0.1 +short -x 192.168.0.202')
+		assert result.stdout.strip() == ''
+
+		result = host.run('stack set attr attr=dns.dynamic value=false')
+		assert result.rc == 0
+		result = host.run('stack sync dns')
+		assert result.rc == 0
@@ -0,0 +1,98 @@
+import os
+import time
+
+
+class TestSyncHostBoot:
+	def test_many_hosts(self, host, tmpdir):
+		"""
+		Set 5,000 hosts to install and write their boot files to a
+		temporary tftpboot, then check only changed files get written.
+		"""
+
+		result = host.run('stack add network test address=10.0.0.0 mask=255.255.0.0 pxe=true')
+		assert result.rc == 0
+
+		hostfile = tmpdir.join('hosts.csv')
+		with open(hostfile, 'w') as f:
+			f.write('NAME,APPLIANCE,RACK,RANK,IP,MAC,INTERFACE,NETWORK,DEFAULT\n')
+			for rank in range(5000):
+				f.write(
+					f'backend-{rank // 100}-{rank % 100},backend,{rank // 100},{rank % 100},'
+					f'10.0.{rank // 250}.{rank % 250 + 1},52:54:00:00:{rank // 256:02x}:{rank % 256:02x},'
+					'eth0,test,True\n'
+				)
+
+		result = host.run(f'stack load hostfile file={hostfile}')
+		assert result.rc == 0
+
+		start = time.time()
+		result = host.run('stack set host boot a:backend action=install sync=false')
+		print(f'set host boot on 5000 hosts: {time.time() - start:.1f}s')
+		assert result.rc == 0
+
+		root = tmpdir.join('root')
+		start = time.time()
+		result = host.run(f'stack sync host boot a:backend root={root}')
+		print(f'sync host boot on 5000 hosts: {time.time() - start:.1f}s')
+		assert result.rc == 0
+
+		pxe = root.join('tftpboot', 'pxelinux', 'pxelinux.cfg')
+		uefi = root.join('tftpboot', 'pxelinux', 'uefi')
+		assert len(pxe.listdir()) == 5000
+		assert len(uefi.listdir()) == 5000
+
+		# 10.0.0.1 is backend-0-0
+		assert 'ipappend 2' in pxe.join('0A000001').read()
+
+		mtimes = { str(f): os.stat(f).st_mtime_ns for f in pxe.listdir() + uefi.listdir() }
+
+		# Nothing changed, so nothing gets written
+		start = time.time()
+		result = host.run(f'stack sync host boot a:backend root={root}')
+		print(f'sync host boot on 5000 unchanged hosts: {time.time() - start:.1f}s')
+		assert result.rc == 0
+
+		assert mtimes == { str(f): os.stat(f).st_mtime_ns for f in pxe.listdir() + uefi.listdir() }
+
+		# Only the files of the one host that changed get written
+		result = host.run('stack set host boot backend-0-0 action=os sync=false')
+		assert result.rc == 0
+
+		result = host.run(f'stack sync host boot a:backend root={root}')
+		assert result.rc == 0
+
+		changed = [ f for f in pxe.listdir() + uefi.listdir()
+			    if os.stat(f).st_mtime_ns != mtimes[str(f)] ]
+		assert sorted(os.path.basename(f) for f in changed) == [ '0A000001', 'grub.cfg-10.0.0.1' ]
+		assert 'ipappend 2' not in pxe.join('0A000001').read()
+
+	def test_directory_not_writable(self, host, add_host_with_interface, revert_filesystem):
+		"""
+		The install complete endpoint syncs boot files as apache, which
+		can't create files in a UEFI directory that only root can write.
+		"""
+
+		result = host.run('stack set host interface ip backend-0-0 interface=eth0 ip=192.168.0.203')
+		assert result.rc == 0
+		result = host.run('stack set host interface network backend-0-0 interface=eth0 network=private')
+		assert result.rc == 0
+		result = host.run('stack set host boot backend-0-0 action=install')
+		assert result.rc == 0
+
+		uefi = '/tftpboot/pxelinux/uefi'
+		cfg = f'{uefi}/grub.cfg-192.168.0.203'
+		assert host.file(cfg).exists
+
+		# How frontends installed before the directory was group
+		# writable have it
+		result = host.run(f'chown root.root {uefi} && chmod 755 {uefi} && chown apache {cfg}')
+		assert result.rc == 0
+		before = host.file(cfg).content_string
+
+		result = host.run('stack set host boot backend-0-0 action=os sync=false')
+		assert result.rc == 0
+		result = host.run("su -s /bin/sh apache -c '/opt/stack/bin/stack sync host boot backend-0-0'")
+		assert result.rc == 0
+
+		assert host.file(cfg).content_string != before
+		assert not [ f for f in host.file(uefi).listdir() if f.startswith('grub.cfg-192.168.0.203.') ]
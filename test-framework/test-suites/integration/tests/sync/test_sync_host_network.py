@@ -1,3 +1,6 @@
+import json
+import time
+
 import pytest
 
 @pytest.mark.usefixtures("add_host")
@@ -8,3 +11,44 @@ def test_sync_host_network_backend(host):
 def test_sync_host_network_frontend_only(host):
 	result = host.run('stack sync host network')
 	assert result.rc == 0
+
+def test_sync_host_network_many_hosts(host, tmpdir):
+	"""
+	Sync the network of 2,000 hosts with an ssh stand-in that just
+	takes the script, so only the generation is being timed.
+	"""
+
+	result = host.run('stack add network test address=10.0.0.0 mask=255.255.0.0')
+	assert result.rc == 0
+
+	hostfile = tmpdir.join("hosts.csv")
+	with open(hostfile, "w") as f:
+		f.write("NAME,APPLIANCE,RACK,RANK,IP,MAC,INTERFACE,NETWORK,DEFAULT\n")
+		for rank in range(2000):
+			f.write(
+				f"backend-{rank // 100}-{rank % 100},backend,{rank // 100},{rank % 100},"
+				f"10.0.{rank // 250}.{rank % 250 + 1},52:54:00:00:{rank // 256:02x}:{rank % 256:02x},"
+				"eth0,test,True\n"
+			)
+
+	result = host.run(f"stack load hostfile file={hostfile}")
+	assert result.rc == 0
+
+	ssh = tmpdir.join("ssh")
+	ssh.write('#!/bin/sh\ncat > /dev/null\n')
+	ssh.chmod(0o755)
+
+	start = time.time()
+	result = host.run(
+		f'PATH={tmpdir}:$PATH stack sync host network a:backend restart=no '
+		'output-format=json'
+	)
+	elapsed = time.time() - start
+	assert result.rc == 0
+
+	print(f"sync host network on 2000 hosts: {elapsed:.1f}s")
+	assert elapsed < 60
+
+	status = json.loads(result.stdout)
+	assert len(status) == 2000
+	assert all(row['status'] == 'ok' for row in status)
@@ -1,6 +1,9 @@
+import multiprocessing
 import os
+import signal
 import sys
 import subprocess
+import time
 import pytest
 import json
 
@@ -216,3 +219,248 @@ class TestWSAPI_Group:
 		# Try the remove again. This should fail
 		op = host.run(f"stack remove api group testgroup") 
 		assert op.rc == 255 and op.stderr.startswith(f"error - Cannot find group testgroup")
+
+class TestWSAPI_Throughput:
+	"""
+	Requests per second for "list host" through the Django test
+	client, opening a database connection for every request like
+	before against the connection pool.
+	"""
+	def rate(self, client, count):
+		start = time.time()
+		for _ in range(count):
+			response = client.post('/', json.dumps({'cmd': 'list host'}),
+					       content_type='application/json')
+			assert response.status_code == 200
+		return count / (time.time() - start)
+
+	def test_api_list_host_rate(self, monkeypatch):
+		import stack.django_env
+		from django.contrib.auth.models import User
+		from django.test import Client
+		from stack.restapi.models import BlackList
+		import stack.restapi.db
+		import stack.restapi.policy
+		from stack.restapi import views
+
+		client = Client()
+		client.force_login(User.objects.get(username='admin'))
+
+		# Count the connections and the compiles of the policy
+		connects = []
+		connect = stack.restapi.db.connect
+		def counted_connect(admin=False):
+			connects.append(admin)
+			return connect(admin)
+		monkeypatch.setattr(stack.restapi.db, 'connect', counted_connect)
+
+		loads = []
+		load = stack.restapi.policy.Policy.load
+		def counted_load(policy, model):
+			loads.append(model)
+			return load(policy, model)
+		monkeypatch.setattr(stack.restapi.policy.Policy, 'load', counted_load)
+		monkeypatch.setattr(views, 'policy', stack.restapi.policy.Policy())
+
+		monkeypatch.setattr(views, 'pool', stack.restapi.db.Pool(size=0))
+		unpooled = self.rate(client, 200)
+		assert len(connects) == 200
+
+		del connects[:]
+		monkeypatch.setattr(views, 'pool', stack.restapi.db.Pool())
+		pooled = self.rate(client, 200)
+		assert len(connects) == 1
+
+		print(f'list host: {unpooled:.1f} requests/sec unpooled, {pooled:.1f} pooled')
+
+		# The blacklist and sudo list were read once
+		assert len(loads) == 2
+
+		# and again only once they change
+		b = BlackList.objects.create(command='list host')
+		try:
+			response = client.post('/', json.dumps({'cmd': 'list host'}),
+					       content_type='application/json')
+			assert response.status_code == 403
+			assert len(loads) == 4
+		finally:
+			b.delete()
+
+		response = client.post('/', json.dumps({'cmd': 'list host'}),
+				       content_type='application/json')
+		assert response.status_code == 200
+		assert len(loads) == 6
+
+class TestWSAPI_Cache:
+	"""
+	Read-only commands stream their json and answer If-None-Match
+	from the database watermark.
+	"""
+	def post(self, client, cmd, **headers):
+		return client.post('/', json.dumps({'cmd': cmd}),
+				   content_type='application/json', **headers)
+
+	def test_api_list_host_etag(self, host, monkeypatch):
+		import stack.django_env
+		from django.contrib.auth.models import User
+		from django.test import Client
+		import stack.commands.list.host
+
+		client = Client()
+		client.force_login(User.objects.get(username='admin'))
+
+		runs = []
+		runWrapper = stack.commands.list.host.Command.runWrapper
+		def counted_runWrapper(command, *args, **kwargs):
+			runs.append(args)
+			return runWrapper(command, *args, **kwargs)
+		monkeypatch.setattr(stack.commands.list.host.Command, 'runWrapper', counted_runWrapper)
+
+		response = self.post(client, 'list host')
+		assert response.status_code == 200
+		assert response.streaming
+
+		result = host.run('stack list host output-format=json')
+		assert result.rc == 0
+		assert json.loads(b''.join(response.streaming_content)) == json.loads(result.stdout)
+		assert len(runs) == 1
+
+		# Nothing changed, the command isn't run
+		etag = response['ETag']
+		response = self.post(client, 'list host', HTTP_IF_NONE_MATCH=etag)
+		assert response.status_code == 304
+		assert response['ETag'] == etag
+		assert len(runs) == 1
+
+		# Other commands have their own tag
+		response = self.post(client, 'list host frontend-0-0', HTTP_IF_NONE_MATCH=etag)
+		assert response.status_code == 200
+		assert len(runs) == 2
+
+		# A change to the database runs it again
+		result = host.run('stack set host comment frontend-0-0 comment=etag')
+		assert result.rc == 0
+
+		response = self.post(client, 'list host', HTTP_IF_NONE_MATCH=etag)
+		assert response.status_code == 200
+		assert response['ETag'] != etag
+		assert len(runs) == 3
+		assert json.loads(b''.join(response.streaming_content))[0]['comment'] == 'etag'
+
+
+class TestWSAPI_Jobs:
+	"""
+	Commands posted with "async" are queued and run by a local job
+	worker.
+	"""
+	@pytest.fixture
+	def client(self):
+		import stack.django_env
+		from django.contrib.auth.models import User
+		from django.test import Client
+		from stack.restapi.models import Job
+
+		# Start with an empty queue
+		Job.objects.all().delete()
+
+		client = Client()
+		client.force_login(User.objects.get(username='admin'))
+		return client
+
+	@pytest.fixture
+	def worker(self, tmpdir, monkeypatch):
+		from django.db import connections
+		import stack.restapi.jobs
+
+		monkeypatch.setattr(stack.restapi.jobs, 'LOGDIR', str(tmpdir.join('jobs')))
+
+		processes = []
+		def start(command=None):
+			# The worker can't share our database connection
+			connections.close_all()
+
+			worker = stack.restapi.jobs.Worker(stack=command, interval=0.2)
+			process = multiprocessing.Process(target=worker.serve)
+			process.daemon = True
+			process.start()
+			processes.append(process)
+
+		yield start
+
+		for process in processes:
+			os.kill(process.pid, signal.SIGTERM)
+			process.join()
+
+	def submit(self, client, cmd):
+		response = client.post('/', json.dumps({'cmd': cmd, 'async': True}),
+				       content_type='application/json')
+		assert response.status_code == 202
+		return json.loads(response.content)
+
+	def wait(self, client, job, status):
+		for _ in range(300):
+			response = client.get(f'/jobs/{job}')
+			assert response.status_code == 200
+			j = json.loads(response.content)
+			if j['status'] == status:
+				return j
+			time.sleep(0.1)
+		assert j['status'] == status
+
+	def test_api_job_coalesce(self, host, client, worker):
+		# Five requests before the worker is running are one job
+		jobs = [ self.submit(client, 'list host') for _ in range(5) ]
+		assert len({ j['job'] for j in jobs }) == 1
+		assert [ j['coalesced'] for j in jobs ] == [ False, True, True, True, True ]
+
+		worker()
+		j = self.wait(client, jobs[0]['job'], 'done')
+		assert j['rc'] == 0
+
+		# The log has the output of the command
+		response = client.get(f'/jobs/{j["job"]}/log')
+		assert response.status_code == 200
+		result = host.run('stack list host output-format=json')
+		assert result.rc == 0
+		assert json.loads(b''.join(response.streaming_content)) == json.loads(result.stdout)
+
+		# Once it ran the same command is a new job
+		again = self.submit(client, 'list host')
+		assert again['job'] != j['job']
+		assert not again['coalesced']
+		self.wait(client, again['job'], 'done')
+
+	def test_api_job_cancel_queued(self, client):
+		j = self.submit(client, 'list host')
+		assert j['status'] == 'queued'
+
+		response = client.post(f'/jobs/{j["job"]}/cancel')
+		assert response.status_code == 200
+		assert json.loads(response.content)['status'] == 'cancelled'
+
+	@pytest.fixture
+	def slow(self):
+		# A command that takes its time, where apache can run it
+		path = '/tmp/stack-ws-slow-job'
+		with open(path, 'w') as f:
+			f.write('#!/bin/sh\necho started\nsleep 60\n')
+		os.chmod(path, 0o755)
+
+		yield path
+
+		os.unlink(path)
+
+	def test_api_job_cancel_running(self, client, worker, slow):
+		j = self.submit(client, 'list host')
+		worker(command=slow)
+		self.wait(client, j['job'], 'running')
+
+		response = client.post(f'/jobs/{j["job"]}/cancel')
+		assert response.status_code == 200
+
+		j = self.wait(client, j['job'], 'cancelled')
+		assert j['rc'] != 0
+
+	def test_api_job_not_found(self, client):
+		response = client.get('/jobs/999999')
+		assert response.status_code == 404
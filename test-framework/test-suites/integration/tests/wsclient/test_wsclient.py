@@ -1,6 +1,7 @@
 import json
 import os
 import re
+import time
 
 import wsclient
 
@@ -90,3 +91,78 @@ class TestWSClient:
 		result = host.run("stack list network output-format=json")
 		assert result.rc == 0
 		assert networks == json.loads(result.stdout)
+
+	def client(self):
+		with open('/root/stacki-ws.cred', 'r') as f:
+			credentials = json.load(f)
+
+		client = wsclient.StackWSClient(
+			'127.0.0.1',
+			'admin',
+			credentials[0]['key']
+		)
+		client.url = 'http://127.0.0.1:8000'
+		client.login()
+
+		return client
+
+	def attrs(self, host, prefix):
+		result = host.run("stack list host attr frontend-0-0 output-format=json")
+		assert result.rc == 0
+		return {
+			attr['attr']: attr['value']
+			for attr in json.loads(result.stdout)
+			if attr['scope'] == 'host' and attr['attr'].startswith(f'{prefix}.')
+		}
+
+	def test_wsclient_batch(self, host, run_django_server):
+		"Time 1000 set host attr calls one request each against one batch"
+
+		client = self.client()
+
+		start = time.time()
+		for i in range(1000):
+			client.run(f"set host attr frontend-0-0 attr=single.{i} value={i}")
+		single = time.time() - start
+
+		start = time.time()
+		for i in range(1000):
+			client.queue(f"set host attr frontend-0-0 attr=batch.{i} value={i}")
+		results = client.flush(transaction=True)
+		batched = time.time() - start
+
+		print(f'1000 set host attr: {single:.2f}s single, {batched:.2f}s batched')
+
+		assert len(results) == 1000
+		assert all(result['status'] == 200 for result in results)
+		assert results[0]['cmd'] == 'set host attr frontend-0-0 attr=batch.0 value=0'
+
+		expected = { f'{i}': f'{i}' for i in range(1000) }
+		assert { k.split('.')[1]: v for k, v in self.attrs(host, 'single').items() } == expected
+		assert { k.split('.')[1]: v for k, v in self.attrs(host, 'batch').items() } == expected
+
+		assert batched < single
+
+	def test_wsclient_batch_rollback(self, host, run_django_server):
+		"A failed command rolls back the batch and stops it"
+
+		client = self.client()
+
+		client.queue("set host attr frontend-0-0 attr=rollback.0 value=0")
+		client.queue("set host attr frontend-0-0 attr=rollback.1 value=1")
+		client.queue("set host attr no-such-host attr=rollback.2 value=2")
+		client.queue("set host attr frontend-0-0 attr=rollback.3 value=3")
+		results = client.flush(transaction=True)
+
+		assert [ result['status'] for result in results ] == [ 200, 200, 500 ]
+		assert 'no-such-host' in results[2]['output']['API Error']
+		assert self.attrs(host, 'rollback') == {}
+
+		# Without a transaction every command is run
+		client.queue("set host attr frontend-0-0 attr=rollback.0 value=0")
+		client.queue("set host attr no-such-host attr=rollback.1 value=1")
+		client.queue("set host attr frontend-0-0 attr=rollback.2 value=2")
+		results = client.flush()
+
+		assert [ result['status'] for result in results ] == [ 200, 500, 200 ]
+		assert self.attrs(host, 'rollback') == { 'rollback.0': '0', 'rollback.2': '2' }
@@ -0,0 +1,119 @@
+import asyncio
+import os
+import socket
+
+import pytest
+
+from stack.logtail import LogTailer, SyslogSocket
+
+
+class TestLogTailer:
+	@pytest.fixture
+	def loop(self):
+		loop = asyncio.new_event_loop()
+		asyncio.set_event_loop(loop)
+		yield loop
+		loop.close()
+
+	def run(self, loop, seconds=0.2):
+		"Let the event loop handle whatever is pending."
+		loop.run_until_complete(asyncio.sleep(seconds))
+
+	@pytest.fixture(params=[True, False], ids=["inotify", "polling"])
+	def tailer(self, request, loop, tmpdir, monkeypatch):
+		if not request.param:
+			# Force the polling fallback
+			def no_inotify(self):
+				raise OSError("inotify not available")
+
+			monkeypatch.setattr("stack.logtail.Inotify.__init__", no_inotify)
+			monkeypatch.setattr(LogTailer, "_POLL_INTERVAL", 0.05)
+
+		path = tmpdir.join("messages")
+		path.write("old line\n")
+
+		lines = []
+		tailer = LogTailer(str(path), lines.append, loop=loop)
+		tailer.start()
+
+		yield path, lines
+
+		tailer.stop()
+
+	def test_new_lines(self, loop, tailer):
+		path, lines = tailer
+
+		with open(path, "a") as f:
+			f.write("line 1\nline 2\n")
+		self.run(loop)
+
+		# Existing lines are skipped, new ones show up
+		assert lines == ["line 1\n", "line 2\n"]
+
+	def test_partial_line(self, loop, tailer):
+		path, lines = tailer
+
+		with open(path, "a") as f:
+			f.write("DHCPDISCOVER from ")
+		self.run(loop)
+		assert lines == []
+
+		with open(path, "a") as f:
+			f.write("52:54:00:00:00:03 via eth1\n")
+		self.run(loop)
+		assert lines == ["DHCPDISCOVER from 52:54:00:00:00:03 via eth1\n"]
+
+	def test_rotation(self, loop, tailer):
+		path, lines = tailer
+
+		with open(path, "a") as f:
+			f.write("before\n")
+		self.run(loop)
+
+		# Rotate the log, the writer finishes up in the old file
+		# before moving on to a new one
+		os.rename(path, str(path) + ".1")
+		with open(str(path) + ".1", "a") as f:
+			f.write("late\n")
+		self.run(loop)
+
+		with open(path, "w") as f:
+			f.write("after 1\nafter 2\n")
+		self.run(loop)
+
+		assert lines == ["before\n", "late\n", "after 1\n", "after 2\n"]
+
+	def test_truncation(self, loop, tailer):
+		path, lines = tailer
+
+		with open(path, "a") as f:
+			f.write("before\n")
+		self.run(loop)
+
+		with open(path, "w") as f:
+			f.write("after\n")
+		self.run(loop)
+
+		assert lines == ["before\n", "after\n"]
+
+
+class TestSyslogSocket:
+	def test_messages(self, tmpdir):
+		loop = asyncio.new_event_loop()
+		asyncio.set_event_loop(loop)
+		path = str(tmpdir.join("discovery.sock"))
+
+		lines = []
+		source = SyslogSocket(path, lines.append, loop=loop)
+		source.start()
+
+		client = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+		client.sendto(b"<30>dhcpd: DHCPDISCOVER from 52:54:00:00:00:03 via eth1", path)
+		client.close()
+
+		loop.run_until_complete(asyncio.sleep(0.1))
+		source.stop()
+		loop.close()
+
+		assert lines == ["<30>dhcpd: DHCPDISCOVER from 52:54:00:00:00:03 via eth1"]
+		assert not os.path.exists(path)
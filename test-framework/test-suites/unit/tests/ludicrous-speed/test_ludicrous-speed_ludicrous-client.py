@@ -0,0 +1,352 @@
+import gzip
+import hashlib
+import importlib.util
+import os
+import socket
+import socketserver
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import pytest
+import requests
+
+
+REPO    = '/install/pallets/test/1.0/redhat7/x86_64'
+PACKAGE = 'RedHat/RPMS/test-1.0-1.x86_64.rpm'
+
+
+def load_client():
+	spec = importlib.util.spec_from_file_location('ludicrous_client', '/opt/stack/bin/ludicrous-client.py')
+	module = importlib.util.module_from_spec(spec)
+	spec.loader.exec_module(module)
+	return module
+
+
+class Handler(BaseHTTPRequestHandler):
+	"""
+	Serves files from memory with range requests. How the peer
+	misbehaves is up to its server.
+	"""
+
+	def log_message(self, *args):
+		pass
+
+	def do_GET(self):
+		self.server.requests.append((self.path, self.headers.get('Range')))
+
+		content = self.server.files.get(self.path)
+		if content is None:
+			self.send_error(404)
+			return
+
+		start = 0
+		if self.headers.get('Range'):
+			start = int(self.headers['Range'].split('=')[1].split('-')[0])
+			self.send_response(206)
+			self.send_header('Content-Range', 'bytes %d-%d/%d' % (start, len(content) - 1, len(content)))
+		else:
+			self.send_response(200)
+		body = content[start:]
+		self.send_header('Content-Length', str(len(body)))
+		self.end_headers()
+
+		behavior = self.server.behavior
+		if behavior == 'corrupt':
+			body = bytes([ body[0] ^ 0xff ]) + body[1:]
+		if behavior == 'dying':
+			body = body[:len(body) // 2]
+
+		for i in range(0, len(body), 16 * 1024):
+			self.wfile.write(body[i:i + 16 * 1024])
+			if behavior == 'slow':
+				time.sleep(0.1)
+
+
+class Peer(socketserver.ThreadingMixIn, HTTPServer):
+	daemon_threads = True
+
+	def __init__(self, files, behavior='good'):
+		super().__init__(('127.0.0.1', 0), Handler)
+		self.files    = files
+		self.behavior = behavior
+		self.requests = []
+		threading.Thread(target=self.serve_forever, daemon=True).start()
+
+	def handle_error(self, request, client_address):
+		# Clients hang up on slow peers
+		pass
+
+	@property
+	def address(self):
+		return '127.0.0.1:%d' % self.server_address[1]
+
+
+def repodata(content):
+	primary = """<?xml version="1.0" encoding="UTF-8"?>
+<metadata xmlns="http://linux.duke.edu/metadata/common" packages="1">
+<package type="rpm">
+  <name>test</name>
+  <checksum type="sha256" pkgid="YES">%s</checksum>
+  <size package="%d" installed="0" archive="0"/>
+  <location href="%s"/>
+</package>
+</metadata>
+""" % (hashlib.sha256(content).hexdigest(), len(content), PACKAGE)
+
+	repomd = """<?xml version="1.0" encoding="UTF-8"?>
+<repomd xmlns="http://linux.duke.edu/metadata/repo">
+  <data type="primary">
+    <location href="repodata/primary.xml.gz"/>
+  </data>
+</repomd>
+"""
+
+	return {
+		'%s/repodata/repomd.xml' % REPO: repomd.encode(),
+		'%s/repodata/primary.xml.gz' % REPO: gzip.compress(primary.encode())
+	}
+
+
+class TestSwarm:
+	@pytest.fixture
+	def content(self):
+		return os.urandom(4 * 1024 * 1024)
+
+	@pytest.fixture
+	def client(self, monkeypatch):
+		client = load_client()
+
+		# Give up on slow peers sooner than a real install would
+		monkeypatch.setattr(client, 'SLOW_AFTER', 0.2)
+
+		unregistered = []
+		monkeypatch.setattr(client, 'unregister_file',
+				    lambda hashcode, params: unregistered.append(params['peer']))
+		client.unregistered = unregistered
+		return client
+
+	@pytest.fixture
+	def frontend(self, client, content):
+		files = repodata(content)
+		files['%s/%s' % (REPO, PACKAGE)] = content
+
+		server = Peer(files)
+		client.tracker_settings['TRACKER'] = server.address
+		yield server
+		server.shutdown()
+
+	def peers(self, content, behaviors):
+		return [ Peer({ '%s/%s' % (REPO, PACKAGE): content }, behavior) for behavior in behaviors ]
+
+	def unused_port(self):
+		with socket.socket() as s:
+			s.bind(('127.0.0.1', 0))
+			return '127.0.0.1:%d' % s.getsockname()[1]
+
+	def test_metadata(self, client, frontend, content):
+		checksum = client.metadata.lookup('%s/%s' % (REPO, PACKAGE))
+		assert checksum == client.Checksum('sha256', hashlib.sha256(content).hexdigest(), len(content))
+
+		# Not a package, and read from the metadata already loaded
+		assert client.metadata.lookup('%s/images/install.img' % REPO) is None
+		assert len([ path for (path, _) in frontend.requests if 'primary' in path ]) == 1
+
+	def test_swarm(self, client, frontend, content, tmpdir):
+		dead = self.unused_port()
+		(slow, corrupt, dying, good) = self.peers(content, [ 'slow', 'corrupt', 'dying', 'good' ])
+
+		remote_file = '%s/%s' % (REPO, PACKAGE)
+		local_file  = str(tmpdir.join(PACKAGE))
+		checksum    = client.metadata.lookup(remote_file)
+
+		peers = [ dead, slow.address, corrupt.address, dying.address, good.address ]
+		assert client.download(remote_file, local_file, checksum, peers)
+
+		with open(local_file, 'rb') as f:
+			assert f.read() == content
+
+		# Every peer but the last was dropped for the file
+		assert client.unregistered == [ '127.0.0.1' ] * 4
+
+		# The corrupt copy was thrown away, the good peer picked
+		# up where the dying one stopped
+		assert dying.requests[0][1] is None
+		assert good.requests == [ (remote_file, 'bytes=%d-' % (len(content) // 2)) ]
+
+		# and the frontend only served the metadata
+		assert remote_file not in [ path for (path, _) in frontend.requests ]
+
+		# Nothing left behind
+		assert os.listdir(os.path.dirname(local_file)) == [ os.path.basename(local_file) ]
+
+	def test_swarm_frontend(self, client, frontend, content, tmpdir):
+		(corrupt, dying) = self.peers(content, [ 'corrupt', 'dying' ])
+
+		remote_file = '%s/%s' % (REPO, PACKAGE)
+		local_file  = str(tmpdir.join(PACKAGE))
+		checksum    = client.metadata.lookup(remote_file)
+
+		assert client.download(remote_file, local_file, checksum, [ corrupt.address, dying.address ])
+
+		with open(local_file, 'rb') as f:
+			assert f.read() == content
+		assert (remote_file, 'bytes=%d-' % (len(content) // 2)) in frontend.requests
+
+	def test_unchecked_file(self, client, frontend, tmpdir):
+		frontend.files['/install/sbin/profile.cgi'] = b'profile'
+
+		local_file = str(tmpdir.join('profile.cgi'))
+		assert not client.download('/install/sbin/profile.cgi', local_file, None, [])
+
+		with open(local_file, 'rb') as f:
+			assert f.read() == b'profile'
+
+
+class TestTimeouts:
+	def test_timeouts(self):
+		timeouts = load_client().Timeouts(initial=(0.5, 5.0), floor=(0.1, 1.0), ceiling=(5.0, 60.0))
+
+		assert timeouts.get('peer') == (0.5, 5.0)
+
+		for i in range(10):
+			timeouts.sample('peer', 0.2)
+		(connect, read) = timeouts.get('peer')
+		assert 0.2 <= connect < 0.5
+		assert read == max(connect * 4, 1.0)
+
+		timeouts.failure('peer')
+		timeouts.failure('peer')
+		assert timeouts.get('peer')[0] == pytest.approx(connect * 4)
+
+		# Answering again starts over
+		timeouts.sample('peer', 0.2)
+		assert timeouts.get('peer')[0] < connect * 4
+
+
+class SourceAdapter(requests.adapters.HTTPAdapter):
+	"""
+	Connects from the given loopback address, so every simulated
+	host looks like a different one to the server.
+	"""
+
+	def __init__(self, source):
+		self.source = source
+		super().__init__()
+
+	def init_poolmanager(self, *args, **kwargs):
+		kwargs['source_address'] = (self.source, 0)
+		super().init_poolmanager(*args, **kwargs)
+
+
+def host(source):
+	session = requests.Session()
+	session.mount('http://', SourceAdapter(source))
+	return session
+
+
+class TestUploads:
+	"""
+	The client serving a saved file to other hosts.
+	"""
+
+	@pytest.fixture
+	def content(self):
+		return os.urandom(1024 * 1024)
+
+	@pytest.fixture
+	def client(self, monkeypatch, tmpdir, content):
+		client = load_client()
+		client.client_settings['LOCAL_SAVE_LOCATION'] = str(tmpdir)
+		monkeypatch.setattr(client, 'report_load', lambda uploads, limit: None)
+
+		tmpdir.join(REPO, PACKAGE).write_binary(content, ensure=True)
+
+		sent = []
+		def sendfile(*args, sendfile=os.sendfile):
+			sent.append(args)
+			return sendfile(*args)
+		monkeypatch.setattr(os, 'sendfile', sendfile)
+		client.sent = sent
+
+		server = client.Server(('127.0.0.1', 0), client.RequestHandler)
+		server.set_app(client.app)
+		threading.Thread(target=server.serve_forever, daemon=True).start()
+		client.url = 'http://127.0.0.1:%d%s/%s' % (server.server_address[1], REPO, PACKAGE)
+
+		yield client
+
+		server.shutdown()
+		server.server_close()
+
+	def test_sendfile(self, client, content):
+		res = host('127.0.0.2').get(client.url)
+		assert res.status_code == 200
+		assert res.content == content
+		assert client.sent
+
+		# Resumes are sent from python
+		res = host('127.0.0.2').get(client.url, headers={ 'Range': 'bytes=1000-' })
+		assert res.status_code == 206
+		assert res.content == content[1000:]
+
+		assert client.uploads.active == 0
+
+	def test_upload_cap(self, client, content):
+		client.uploads.active = client.MAX_UPLOADS
+
+		res = host('127.0.0.2').get(client.url)
+		assert res.status_code == 503
+
+		# The installer on this host is never turned away
+		res = host('127.0.0.1').get(client.url)
+		assert res.status_code == 200
+		assert res.content == content
+
+		client.uploads.active = 0
+		assert host('127.0.0.2').get(client.url).status_code == 200
+
+	def test_load(self, client, content):
+		"""
+		1,000 hosts after the same file at once. No more than
+		MAX_UPLOADS are sent at a time, the rest are told to come
+		back.
+		"""
+
+		lock = threading.Lock()
+		highest = [ 0 ]
+		start = client.uploads.start
+		def counting():
+			started = start()
+			with lock:
+				highest[0] = max(highest[0], client.uploads.active)
+			return started
+		client.uploads.start = counting
+
+		def download(node):
+			session = host('127.1.%d.%d' % (node // 250, node % 250 + 1))
+			busy = 0
+			while True:
+				res = session.get(client.url)
+				if res.status_code != 503:
+					break
+				busy += 1
+				time.sleep(0.01)
+			session.close()
+			return (res.status_code, hashlib.sha256(res.content).digest(), busy)
+
+		began = time.time()
+		with ThreadPoolExecutor(max_workers=100) as pool:
+			results = list(pool.map(download, range(1000)))
+		elapsed = time.time() - began
+
+		busy = sum(b for (*_, b) in results)
+		print()
+		print('%d downloads in %.1f s, %d turned away' % (len(results), elapsed, busy))
+
+		digest = hashlib.sha256(content).digest()
+		assert [ (status, sha) for (status, sha, _) in results ] == [ (200, digest) ] * 1000
+		assert busy > 0
+		assert 0 < highest[0] <= client.MAX_UPLOADS
+		assert client.uploads.active == 0
@@ -0,0 +1,516 @@
+import collections
+import importlib.util
+import random
+import socket
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+import redis
+import requests
+from werkzeug.serving import make_server
+
+
+def load_server():
+	sys.path.insert(0, '/opt/stack/bin')
+	try:
+		spec = importlib.util.spec_from_file_location('ludicrousServer', '/opt/stack/bin/ludicrousServer.py')
+		module = importlib.util.module_from_spec(spec)
+		spec.loader.exec_module(module)
+	finally:
+		sys.path.remove('/opt/stack/bin')
+	return module
+
+
+@pytest.fixture(scope='module')
+def server():
+	return load_server()
+
+
+def address(node):
+	return '10.%d.%d.%d' % (node // 65536, (node // 256) % 256, node % 256 + 1)
+
+
+def number(addr):
+	(_, a, b, c) = [ int(octet) for octet in addr.split('.') ]
+	return a * 65536 + b * 256 + c - 1
+
+
+class Cluster:
+	"""
+	Racks of nodes, a few racks to a network.
+	"""
+
+	def __init__(self, nodes=1000, rack_size=40, racks_per_network=5):
+		self.nodes = nodes
+		self.rack_size = rack_size
+		self.racks_per_network = racks_per_network
+
+	def rack(self, node):
+		return node // self.rack_size
+
+	def network(self, node):
+		return self.rack(node) // self.racks_per_network
+
+	def topology(self, server):
+		cluster = self
+
+		class Topology(server.Topology):
+			def load(self):
+				self.hosts = { address(node): ('rack%d' % cluster.rack(node),
+							       'net%d' % cluster.network(node))
+					       for node in range(cluster.nodes) }
+				self.loaded = float('inf')
+
+		return Topology()
+
+
+class Swarm:
+	"""
+	Every node installs the same packages one after the other, each
+	from the first peer the tracker hands out or else the frontend.
+	Nodes start over the first minute. Each transfer gets an equal
+	share of every link it crosses: the uplink of the source, the
+	downlink of the node, and the uplinks of both racks when it goes
+	between racks. The racks are 10:1 oversubscribed.
+	"""
+
+	NIC = 125.0		# MB/s
+	RACK_UPLINK = 500.0	# MB/s
+	FRONTEND = 1250.0	# MB/s
+	PACKAGES = 10
+	SIZE = 100.0		# MB
+	STEP = 0.1		# s
+	START = 60.0		# s
+
+	def __init__(self, cluster, choose):
+		self.cluster = cluster
+		self.choose = choose
+		self.random = random.Random(2018)
+
+	def run(self):
+		cluster = self.cluster
+		start = [ self.random.uniform(0, self.START) for node in range(cluster.nodes) ]
+		installed = [ 0 ] * cluster.nodes
+		holders = [ [] for package in range(self.PACKAGES) ]
+		uploads = collections.Counter()
+		active = {}		# node -> [ source, package, remaining ]
+		done = 0
+
+		bytes = collections.Counter()
+		now = 0.0
+		while done < cluster.nodes:
+			for node in range(cluster.nodes):
+				if node in active or installed[node] == self.PACKAGES or start[node] > now:
+					continue
+				package = installed[node]
+				source = self.choose(node, holders[package], uploads)
+				if source is not None:
+					uploads[source] += 1
+				active[node] = [ source, package, self.SIZE ]
+
+			links = collections.Counter()
+			for (node, (source, package, remaining)) in active.items():
+				for link in self.links(node, source):
+					links[link] += 1
+
+			finished = []
+			for (node, transfer) in active.items():
+				(source, package, remaining) = transfer
+				rate = min(self.capacity(link) / links[link] for link in self.links(node, source))
+				sent = min(remaining, rate * self.STEP)
+				transfer[2] -= sent
+
+				if source is None:
+					bytes['frontend'] += sent
+				elif cluster.rack(source) != cluster.rack(node):
+					bytes['cross-rack'] += sent
+				else:
+					bytes['in-rack'] += sent
+
+				if transfer[2] <= 0:
+					finished.append(node)
+
+			for node in finished:
+				(source, package, remaining) = active.pop(node)
+				if source is not None:
+					uploads[source] -= 1
+				holders[package].append(node)
+				installed[node] += 1
+				if installed[node] == self.PACKAGES:
+					done += 1
+
+			now += self.STEP
+
+		return now, bytes
+
+	def links(self, node, source):
+		links = [ ('down', node) ]
+		if source is None:
+			links.append(('frontend',))
+			links.append(('rack-down', self.cluster.rack(node)))
+		else:
+			links.append(('up', source))
+			if self.cluster.rack(source) != self.cluster.rack(node):
+				links.append(('rack-up', self.cluster.rack(source)))
+				links.append(('rack-down', self.cluster.rack(node)))
+		return links
+
+	def capacity(self, link):
+		return {
+			'down': self.NIC,
+			'up': self.NIC,
+			'frontend': self.FRONTEND,
+			'rack-up': self.RACK_UPLINK,
+			'rack-down': self.RACK_UPLINK
+		}[link[0]]
+
+
+class TestRank:
+	def test_rank(self, server):
+		cluster = Cluster()
+		topology = cluster.topology(server)
+		loads = collections.Counter()
+		failures = collections.Counter()
+
+		def stats(peers):
+			return [ (loads[peer], failures[peer], True) for peer in peers ]
+
+		same_rack = address(1)
+		same_network = address(cluster.rack_size)
+		far = address(cluster.rack_size * cluster.racks_per_network)
+		peers = [ far, same_network, same_rack ]
+
+		assert server.rank(address(0), peers, topology, stats) == [ same_rack, same_network, far ]
+
+		# Saturated peers are left out, failing ones go last
+		loads[same_rack] = server.MAX_LOAD
+		assert server.rank(address(0), peers, topology, stats) == [ same_network, far ]
+
+		failures[same_network] = server.MAX_FAILURES
+		assert server.rank(address(0), peers, topology, stats) == [ far, same_network ]
+
+		# Less busy first among the same rack
+		loads.clear()
+		failures.clear()
+		others = [ address(node) for node in range(2, 10) ]
+		for (load, peer) in enumerate(others):
+			loads[peer] = load % server.MAX_LOAD
+		ranked = server.rank(address(0), others, topology, stats, count=len(others))
+		assert [ loads[peer] for peer in ranked ] == sorted(loads[peer] for peer in others)
+
+		# Never more than asked for
+		assert len(server.rank(address(0), others, topology, stats)) == server.MAX_PEERS
+		assert server.rank(address(0), [], topology, stats) == []
+
+	def test_topology_reload(self, server):
+		"""
+		While one thread reloads the topology the others answer from
+		the hosts it already has rather than loading it too.
+		"""
+
+		started = threading.Event()
+		finish = threading.Event()
+
+		class Topology(server.Topology):
+			loads = 0
+
+			def load(self):
+				Topology.loads += 1
+				started.set()
+				finish.wait(10)
+				self.hosts = { address(0): ('rack1', 'net1') }
+
+		topology = Topology(ttl=300, retry=30)
+		topology.hosts = { address(0): ('rack0', 'net0') }
+
+		with ThreadPoolExecutor(8) as pool:
+			first = pool.submit(topology.get, address(0))
+			assert started.wait(10)
+
+			# The load is under way, nobody waits for it
+			others = [ pool.submit(topology.get, address(0)) for _ in range(16) ]
+			assert [ f.result(5) for f in others ] == [ ('rack0', 'net0') ] * 16
+
+			finish.set()
+			assert first.result(10) == ('rack1', 'net1')
+
+		assert Topology.loads == 1
+		assert topology.get(address(0)) == ('rack1', 'net1')
+
+		# Nor does an unknown address start another load right away
+		assert topology.get(address(1)) == (None, None)
+		assert Topology.loads == 1
+
+	def test_swarm(self, server):
+		"""
+		A 1,000 node install with random peers (what the tracker used
+		to do) and with ranked peers.
+		"""
+
+		cluster = Cluster(nodes=1000)
+		topology = cluster.topology(server)
+		rng = random.Random(2018)
+
+		def shuffled(node, holders, uploads):
+			if not holders:
+				return None
+			return rng.choice(holders)
+
+		def ranked(node, holders, uploads):
+			def stats(peers):
+				return [ (uploads[number(peer)], 0, True) for peer in peers ]
+
+			peers = server.rank(address(node), [ address(holder) for holder in holders ], topology, stats)
+			return number(peers[0]) if peers else None
+
+		results = {}
+		for (name, choose) in (('random', shuffled), ('ranked', ranked)):
+			results[name] = Swarm(cluster, choose).run()
+
+		print()
+		print('%-8s %10s %14s %12s %12s' % ('peers', 'time (s)', 'cross-rack MB', 'in-rack MB', 'frontend MB'))
+		for (name, (elapsed, bytes)) in results.items():
+			print('%-8s %10.1f %14d %12d %12d' % (name, elapsed,
+							       bytes['cross-rack'], bytes['in-rack'], bytes['frontend']))
+
+		(random_time, random_bytes) = results['random']
+		(ranked_time, ranked_bytes) = results['ranked']
+		assert ranked_bytes['cross-rack'] < random_bytes['cross-rack'] / 4
+		assert ranked_time < random_time / 2
+
+
+class TestIndex:
+	"""
+	The tracker against a scratch redis database.
+	"""
+
+	@pytest.fixture
+	def tracker(self, server, monkeypatch):
+		r = redis.StrictRedis(db=15)
+		r.flushdb()
+		monkeypatch.setattr(server, 'ludicredis', r)
+		monkeypatch.setattr(server, 'topology', Cluster().topology(server))
+
+		# Keep the messages away from the real message queue
+		mq = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+		mq.bind(('127.0.0.1', 0))
+		mq.settimeout(0.5)
+		monkeypatch.setattr(server.stack.mq.ports, 'publish', mq.getsockname()[1])
+		server.mq = mq
+
+		yield server
+
+		mq.close()
+		r.flushdb()
+
+	def call(self, server, method, url, node):
+		client = server.app.test_client()
+		res = client.open('/%s' % url, method=method, environ_base={'REMOTE_ADDR': address(node)})
+		assert res.status_code == 200
+		return res.get_json()
+
+	def files(self, server, hashcode):
+		return { peer.decode() for peer in server.ludicredis.smembers('ludicrous:%s' % hashcode) }
+
+	def test_peerdone(self, tracker):
+		for node in (1, 2):
+			for hashcode in ('a', 'b', 'c'):
+				self.call(tracker, 'POST', 'register/80/%s' % hashcode, node)
+
+		self.call(tracker, 'DELETE', 'peerdone', 1)
+
+		for hashcode in ('a', 'b', 'c'):
+			assert self.files(tracker, hashcode) == { address(2) }
+			assert self.files(tracker, '%s:rack:rack0' % hashcode) == { address(2) }
+		assert not tracker.ludicredis.exists('ludicrous:files:%s' % address(1))
+
+		self.call(tracker, 'DELETE', 'unregister/hashcode/a?peer=%s' % address(2), 3)
+		assert self.files(tracker, 'a') == set()
+		assert tracker.ludicredis.smembers('ludicrous:files:%s' % address(2)) == { b'b', b'c' }
+
+	def test_expiry(self, tracker, monkeypatch):
+		monkeypatch.setattr(tracker, 'PEER_TTL', 1)
+		for node in (1, 2):
+			for hashcode in ('a', 'b'):
+				self.call(tracker, 'POST', 'register/80/%s' % hashcode, node)
+
+		# Node 2 keeps sending heartbeats, node 1 died
+		time.sleep(0.6)
+		self.call(tracker, 'POST', 'load/0', 2)
+		time.sleep(0.6)
+
+		# Between reaps dead peers are never handed out, and are
+		# dropped from the file looked up right away
+		tracker.ludicredis.set('ludicrous:reaped', 1)
+		assert self.call(tracker, 'GET', 'lookup/a', 3)['peers'] == [ '%s:80' % address(2) ]
+		assert self.files(tracker, 'a') == { address(2) }
+		assert self.files(tracker, 'b') == { address(1), address(2) }
+
+		# and from the rest by the next reap
+		tracker.ludicredis.delete('ludicrous:reaped')
+		assert tracker.reap() == [ address(1) ]
+		assert self.files(tracker, 'b') == { address(2) }
+
+	def test_message(self, tracker):
+		for i in range(10):
+			self.call(tracker, 'GET', 'lookup/a', 3)
+
+		(message, _) = tracker.mq.recvfrom(65536)
+		assert b'install download' in message
+		with pytest.raises(socket.timeout):
+			tracker.mq.recvfrom(65536)
+
+	def test_benchmark(self, tracker):
+		"""
+		Tracker operations with a million file-peer entries, 1,000
+		peers that each have the same 1,000 files.
+		"""
+
+		peers = [ address(node) for node in range(1000) ]
+		hashcodes = [ '%064x' % i for i in range(1000) ]
+
+		cluster = Cluster()
+		racks = collections.defaultdict(list)
+		for (node, peer) in enumerate(peers):
+			racks['rack%d' % cluster.rack(node)].append(peer)
+
+		r = tracker.ludicredis
+		pipe = r.pipeline(transaction=False)
+		for hashcode in hashcodes:
+			pipe.sadd('ludicrous:%s' % hashcode, *peers)
+			for (rack, members) in racks.items():
+				pipe.sadd('ludicrous:%s:rack:%s' % (hashcode, rack), *members)
+		for (rack, members) in racks.items():
+			pipe.hmset('ludicrous:racks', { peer: rack for peer in members })
+		for peer in peers:
+			pipe.sadd('ludicrous:files:%s' % peer, *hashcodes)
+			tracker.heartbeat(pipe, peer)
+		pipe.execute()
+		assert sum(r.scard('ludicrous:%s' % hashcode) for hashcode in hashcodes) == 1000000
+
+		results = []
+		def measure(name, count, func):
+			start = time.time()
+			for i in range(count):
+				func(i)
+			elapsed = time.time() - start
+			results.append((name, count / elapsed))
+
+		measure('lookup', 1000, lambda i: self.call(tracker, 'GET', 'lookup/%s' % hashcodes[i], 1000 + i))
+		measure('register', 1000, lambda i: self.call(tracker, 'POST', 'register/80/%s' % ('%064x' % (1000 + i)), i))
+		measure('unregister', 1000, lambda i: self.call(tracker, 'DELETE', 'unregister/hashcode/%s?peer=%s' % (hashcodes[i], peers[i]), 1000))
+		measure('peerdone', 100, lambda i: self.call(tracker, 'DELETE', 'peerdone', i))
+
+		# Half of what's left stopped sending heartbeats
+		for peer in peers[100:550]:
+			r.delete('ludicrous:alive:%s' % peer)
+		r.delete('ludicrous:reaped')
+		start = time.time()
+		assert len(tracker.reap()) == 450
+		reaped = time.time() - start
+
+		print()
+		for (name, rate) in results:
+			print('%-12s %10.1f ops/s' % (name, rate))
+		print('%-12s %10.1f s for 450 peers' % ('reap', reaped))
+
+		assert sum(r.scard('ludicrous:%s' % hashcode) for hashcode in hashcodes) < 450000
+		assert dict(results)['peerdone'] > 10
+
+
+class SourceAdapter(requests.adapters.HTTPAdapter):
+	"""
+	Connects from the given loopback address, so every simulated
+	host looks like a different one to the tracker.
+	"""
+
+	def __init__(self, source):
+		self.source = source
+		super().__init__()
+
+	def init_poolmanager(self, *args, **kwargs):
+		kwargs['source_address'] = (self.source, 0)
+		super().init_poolmanager(*args, **kwargs)
+
+
+def loopback(node):
+	return '127.1.%d.%d' % (node // 250, node % 250 + 1)
+
+
+class TestLoad:
+	"""
+	1,000 clients installing at once against the tracker served over
+	HTTP.
+	"""
+
+	@pytest.fixture
+	def tracker(self, server, monkeypatch):
+		r = redis.StrictRedis(db=15)
+		r.flushdb()
+		monkeypatch.setattr(server, 'ludicredis', r)
+		monkeypatch.setattr(server, 'report_download', lambda ipaddr: None)
+
+		cluster = Cluster()
+		topology = server.Topology()
+		topology.hosts = { loopback(node): ('rack%d' % cluster.rack(node), 'net%d' % cluster.network(node))
+				   for node in range(cluster.nodes) }
+		topology.loaded = float('inf')
+		monkeypatch.setattr(server, 'topology', topology)
+
+		httpd = make_server('127.0.0.1', 0, server.app, threaded=True)
+		threading.Thread(target=httpd.serve_forever, daemon=True).start()
+		server.url = 'http://127.0.0.1:%d' % httpd.server_port
+		server.httpd = httpd
+
+		yield server
+
+		httpd.shutdown()
+		r.flushdb()
+
+	def test_load(self, tracker):
+		hashcodes = [ '%064x' % i for i in range(100) ]
+		saturated = { loopback(node) for node in range(0, 1000, 10) }
+
+		def install(node):
+			session = requests.Session()
+			session.mount('http://', SourceAdapter(loopback(node)))
+
+			calls = []
+			def call(method, url):
+				res = session.request(method, '%s/%s' % (tracker.url, url))
+				calls.append(res.status_code)
+				return res.json()
+
+			# Every host has a few files already, every tenth is
+			# sending as many as it can
+			for hashcode in random.sample(hashcodes, 5):
+				call('POST', 'register/80/%s' % hashcode)
+			uploads = 4 if loopback(node) in saturated else random.randint(0, 3)
+			call('POST', 'load/%d?limit=4' % uploads)
+
+			handed = []
+			for hashcode in random.sample(hashcodes, 5):
+				handed.extend(call('GET', 'lookup/%s' % hashcode)['peers'])
+
+			session.close()
+			return (calls, handed)
+
+		start = time.time()
+		with ThreadPoolExecutor(max_workers=100) as pool:
+			results = list(pool.map(install, range(1000)))
+		elapsed = time.time() - start
+
+		calls = [ status for (statuses, _) in results for status in statuses ]
+		handed = [ peer.split(':')[0] for (_, peers) in results for peer in peers ]
+
+		print()
+		print('%d requests in %.1f s, %.1f requests/s' % (len(calls), elapsed, len(calls) / elapsed))
+
+		assert calls == [ 200 ] * 11000
+		assert handed
+
+		# Saturated hosts are only handed out before they said so
+		assert len(saturated.intersection(handed)) < len(handed) / 10
@@ -0,0 +1,62 @@
+import threading
+
+import pytest
+import redis
+
+import stack.mq.rollup as rollup
+
+
+@pytest.fixture
+def r():
+	r = redis.StrictRedis(db=15)
+	r.flushdb()
+	yield r
+	r.flushdb()
+
+
+class TestRollup:
+	def test_update_aggregates_bucket(self, r):
+		rollup.update(r, 1, {'load': 1.0}, now=120)
+		rollup.update(r, 1, {'load': 3.0}, now=150)
+
+		result = rollup.fetch(r, 1, ['load'], 60, 0, 200)
+		assert result == {'load': [(120, 2, 4.0, 1.0, 3.0)]}
+
+		result = rollup.fetch(r, 1, ['load'], 10, 0, 200)
+		assert result == {'load': [(120, 1, 1.0, 1.0, 1.0), (150, 1, 3.0, 3.0, 3.0)]}
+
+		assert r.smembers('host:1:metrics') == {b'load'}
+
+	def test_ring_buffer_wraps(self, r):
+		# Same slot of the 10 second buffer, one lap apart
+		rollup.update(r, 1, {'cpu': 10}, now=1000)
+		rollup.update(r, 1, {'cpu': 20}, now=4600)
+
+		assert r.hlen('host:1:metrics:cpu:10') == 1
+		assert rollup.fetch(r, 1, ['cpu'], 10, 0, 5000) == {'cpu': [(4600, 1, 20.0, 20.0, 20.0)]}
+
+	def test_concurrent_updates(self, r):
+		# Processors updating the same host at once don't lose samples
+		def update(value):
+			client = redis.StrictRedis(db=15)
+			for i in range(100):
+				rollup.update(client, 1, {'load': value}, now=120)
+
+		threads = [ threading.Thread(target=update, args=(value, )) for value in range(8) ]
+		for thread in threads:
+			thread.start()
+		for thread in threads:
+			thread.join()
+
+		assert rollup.fetch(r, 1, ['load'], 60, 0, 200) == {'load': [(120, 800, 2800.0, 0.0, 7.0)]}
+
+	def test_non_numeric_samples_ignored(self, r):
+		rollup.update(r, 1, {'state': 'online'}, now=10)
+		assert r.keys('*') == []
+
+	def test_resolution(self):
+		assert rollup.resolution(60) == 10
+		assert rollup.resolution(3600) == 10
+		assert rollup.resolution(7200) == 60
+		assert rollup.resolution(7 * 86400) == 3600
+		assert rollup.resolution(365 * 86400) == 3600
@@ -0,0 +1,148 @@
+import json
+import sys
+
+import pytest
+
+import stack.omapi
+from stack.omapi import OMAPI, OMAPIError
+
+
+# Stands in for omshell talking to dhcpd, the host objects dhcpd has
+# are kept in a json file next to it.
+OMSHELL = '''#!{python}
+import json, sys
+
+db = {db!r}
+hosts = json.load(open(db))
+obj = None
+for line in sys.stdin.read().split('\\n'):
+	words = line.split()
+	if not words:
+		continue
+	if words[0] == 'connect':
+		if not hosts.get('up', True):
+			print("can't connect to dhcpd: connection refused")
+			sys.exit(1)
+		print('obj: <null>')
+	elif words[0] == 'new':
+		obj = {{}}
+		print('obj: host')
+	elif words[0] == 'set':
+		name, value = line[4:].split(' = ', 1)
+		obj[name] = value.strip('"')
+		print('obj: host')
+		print('%s = %s' % (name, value))
+	elif words[0] == 'open':
+		if obj['name'] not in hosts:
+			print("can't open object: not found")
+			continue
+		obj = dict(hosts[obj['name']])
+		print('obj: host')
+		print('name = "%s"' % obj['name'])
+		print('hardware-address = %s' % obj['hardware-address'])
+		print('ip-address = %s' % ':'.join('%02x' % int(x) for x in obj['ip-address'].split('.')))
+	elif words[0] == 'remove':
+		if obj.get('name') not in hosts:
+			print("can't destroy object: not found")
+		else:
+			del hosts[obj['name']]
+	elif words[0] == 'create':
+		if obj['name'] in hosts:
+			print("can't create object: already exists")
+		else:
+			hosts[obj['name']] = obj
+json.dump(hosts, open(db, 'w'))
+'''
+
+
+class TestOMAPI:
+	@pytest.fixture
+	def omshell(self, tmpdir):
+		db = tmpdir.join('hosts.json')
+		db.write('{}')
+
+		omshell = tmpdir.join('omshell')
+		omshell.write(OMSHELL.format(python=sys.executable, db=str(db)))
+		omshell.chmod(0o755)
+
+		def hosts():
+			return json.loads(db.read())
+
+		return str(omshell), hosts, db
+
+	def test_add_remove(self, omshell):
+		path, hosts, db = omshell
+		api = OMAPI('secret', omshell=path)
+
+		api.add('backend-0-0.private.eth0', '52:54:00:00:00:01', '10.1.255.254', 'next-server 10.1.1.1;')
+		api.add('backend-0-1.private.eth0', '52:54:00:00:00:02', '10.1.255.253')
+		api.commit()
+
+		assert hosts()['backend-0-0.private.eth0']['statements'] == 'next-server 10.1.1.1;'
+		assert api.lookup(['backend-0-0.private.eth0', 'backend-0-1.private.eth0', 'nope']) == {
+			'backend-0-0.private.eth0': ('52:54:00:00:00:01', '10.1.255.254'),
+			'backend-0-1.private.eth0': ('52:54:00:00:00:02', '10.1.255.253')
+		}
+
+		# Adding a host again replaces it
+		api.add('backend-0-0.private.eth0', '52:54:00:00:00:03', '10.1.255.254')
+		api.remove('backend-0-1.private.eth0')
+		api.commit()
+
+		assert api.lookup(['backend-0-0.private.eth0', 'backend-0-1.private.eth0']) == {
+			'backend-0-0.private.eth0': ('52:54:00:00:00:03', '10.1.255.254')
+		}
+
+	def test_remove_missing(self, omshell):
+		path, hosts, db = omshell
+		api = OMAPI('secret', omshell=path)
+
+		api.remove('backend-0-0.private.eth0')
+		api.commit()
+		assert hosts() == {}
+
+	def test_not_running(self, omshell):
+		path, hosts, db = omshell
+		db.write('{"up": false}')
+		api = OMAPI('secret', omshell=path)
+
+		api.remove('backend-0-0.private.eth0')
+		with pytest.raises(OMAPIError):
+			api.commit()
+
+	def test_key(self, tmpdir):
+		path = str(tmpdir.join('omapi.key'))
+
+		assert stack.omapi.readKey(path) is None
+		stack.omapi.createKey(path)
+		secret = stack.omapi.readKey(path)
+		assert secret
+
+		# An existing key is kept
+		stack.omapi.createKey(path)
+		assert stack.omapi.readKey(path) == secret
+
+	def test_strip_leases(self, tmpdir):
+		leases = tmpdir.join('dhcpd.leases')
+		leases.write(
+			'lease 10.1.1.5 {\n'
+			'  starts 4 2018/09/20 17:00:00;\n'
+			'}\n'
+			'host backend-0-0.private.eth0 {\n'
+			'  dynamic;\n'
+			'  hardware ethernet 52:54:00:00:00:01;\n'
+			'  fixed-address 10.1.255.254;\n'
+			'}\n'
+			'host backend-0-0.private.eth0 {\n'
+			'  dynamic;\n'
+			'  deleted;\n'
+			'}\n')
+
+		stack.omapi.stripLeases(str(leases))
+		assert leases.read() == (
+			'lease 10.1.1.5 {\n'
+			'  starts 4 2018/09/20 17:00:00;\n'
+			'}\n')
+
+		# No leases file yet is fine
+		stack.omapi.stripLeases(str(tmpdir.join('missing')))
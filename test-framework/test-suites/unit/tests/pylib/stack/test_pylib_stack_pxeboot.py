@@ -0,0 +1,117 @@
+import concurrent.futures
+import socketserver
+import threading
+import time
+import urllib.error
+import urllib.request
+from wsgiref.simple_server import WSGIServer, WSGIRequestHandler, make_server
+
+import pytest
+
+from stack.pxeboot import InstallComplete
+
+
+class ThreadingWSGIServer(socketserver.ThreadingMixIn, WSGIServer):
+	daemon_threads = True
+	request_queue_size = 1024
+
+
+class QuietHandler(WSGIRequestHandler):
+	def log_message(self, *args):
+		pass
+
+
+class Recorder(InstallComplete):
+	"""
+	Keeps the batches instead of touching the database, the commit
+	is slow enough for nodes to queue up behind it.
+	"""
+
+	def __init__(self, window):
+		super().__init__(window, timeout=30)
+		self.commits = []
+		self.syncs = []
+		self.synced = threading.Event()
+		self.fail = False
+
+	def commit(self, addrs):
+		time.sleep(0.2)
+		self.commits.append(addrs)
+		return [ 'host-%s' % addr for addr in addrs ]
+
+	def sync(self, hosts):
+		self.syncs.append(hosts)
+		self.synced.set()
+		return not self.fail
+
+
+class TestInstallComplete:
+	@pytest.fixture
+	def server(self):
+		app = Recorder(window=1)
+
+		# Every request comes from localhost, the test says which
+		# node it is
+		def fake_addr(environ, start_response):
+			environ['REMOTE_ADDR'] = environ.get('HTTP_X_NODE', environ['REMOTE_ADDR'])
+			return app(environ, start_response)
+
+		httpd = make_server('127.0.0.1', 0, fake_addr,
+				    server_class=ThreadingWSGIServer,
+				    handler_class=QuietHandler)
+		thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+		thread.start()
+
+		yield app, 'http://127.0.0.1:%d/pxeboot/complete' % httpd.server_port
+
+		httpd.shutdown()
+		httpd.server_close()
+
+	def complete(self, url, addr):
+		request = urllib.request.Request(url, headers={ 'X-Node': addr })
+		try:
+			with urllib.request.urlopen(request, timeout=30) as response:
+				return response.status
+		except urllib.error.HTTPError as e:
+			return e.code
+
+	def test_many_nodes(self, server):
+		app, url = server
+		addrs = [ '10.1.%d.%d' % (i // 250, i % 250 + 1) for i in range(1000) ]
+
+		with concurrent.futures.ThreadPoolExecutor(100) as pool:
+			status = list(pool.map(lambda addr: self.complete(url, addr), addrs))
+
+		# Every node is answered once its batch is synced
+		assert status == [ 200 ] * len(addrs)
+
+		# Every node is in exactly one batch, and there are far
+		# fewer batches than nodes
+		committed = [ addr for batch in app.commits for addr in batch ]
+		assert sorted(committed) == sorted(addrs)
+		assert len(app.commits) <= len(addrs) // 25
+		assert len(app.syncs) == len(app.commits)
+
+	def test_next_batch(self, server):
+		app, url = server
+
+		# The same node calling twice in a window is one entry
+		with concurrent.futures.ThreadPoolExecutor(2) as pool:
+			assert list(pool.map(lambda addr: self.complete(url, addr),
+					     [ '10.1.0.1', '10.1.0.1' ])) == [ 200, 200 ]
+
+		# Nodes done after the first batch make the next one
+		assert self.complete(url, '10.1.0.2') == 200
+
+		assert app.commits == [ [ '10.1.0.1' ], [ '10.1.0.2' ] ]
+
+	def test_failed_sync(self, server):
+		app, url = server
+		app.fail = True
+
+		# The node is told to try again
+		assert self.complete(url, '10.1.0.1') == 503
+
+		app.fail = False
+		assert self.complete(url, '10.1.0.1') == 200
+		assert app.commits == [ [ '10.1.0.1' ], [ '10.1.0.1' ] ]
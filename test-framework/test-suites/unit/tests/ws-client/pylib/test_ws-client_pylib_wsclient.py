@@ -0,0 +1,61 @@
+from wsclient import StackWSClient
+
+
+class Response:
+	def __init__(self, chunks):
+		self.chunks = chunks
+
+	def raise_for_status(self):
+		pass
+
+	def iter_content(self, chunk_size=None):
+		return iter(self.chunks)
+
+	def json(self):
+		return {}
+
+
+class Session:
+	def __init__(self, chunks=()):
+		self.chunks = chunks
+		self.urls = []
+
+	def get(self, url, **kwargs):
+		self.urls.append(url)
+		return Response(self.chunks)
+
+	post = get
+
+
+class TestStackWSClient:
+	def client(self, chunks=()):
+		client = StackWSClient('frontend', 'admin', 'key')
+
+		def login():
+			client.session = Session(chunks)
+			client.logged_in = True
+		client.login = login
+
+		return client
+
+	def test_log_split_character(self):
+		# A multi-byte character split across chunks comes out whole
+		text = 'sync host boot: ✓ done\n'.encode()
+		split = text.index('✓'.encode()) + 1
+		client = self.client([ text[:split], text[split:] ])
+
+		assert ''.join(client.log(1)) == 'sync host boot: ✓ done\n'
+
+	def test_login_first(self):
+		client = self.client()
+
+		client.job(1)
+		assert client.logged_in
+		list(client.log(1))
+		client.cancel(1)
+
+		assert client.session.urls == [
+			'http://frontend/stack/jobs/1',
+			'http://frontend/stack/jobs/1/log',
+			'http://frontend/stack/jobs/1/cancel'
+		]
@@ -0,0 +1,35 @@
+import subprocess
+import sys
+
+from stack.restapi.privileged import captured
+
+
+class TestCaptured:
+	def test_captured(self, capfd):
+		with captured() as printed:
+			print('from python')
+			sys.stdout.write('no newline')
+			sys.stderr.write('error\n')
+			subprocess.run(['echo', 'from a subprocess'])
+			subprocess.run(['sh', '-c', 'echo subprocess error >&2'])
+
+		assert printed == [
+			'from python\nno newlinefrom a subprocess\n',
+			'error\nsubprocess error\n'
+		]
+
+		# Nothing leaked out, and stdout works again afterwards
+		print('after')
+		out, err = capfd.readouterr()
+		assert out == 'after\n'
+		assert err == ''
+
+	def test_raises(self):
+		try:
+			with captured() as printed:
+				print('before the error')
+				raise ValueError
+		except ValueError:
+			pass
+
+		assert printed[0] == 'before the error\n'